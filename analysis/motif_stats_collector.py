@@ -1,11 +1,16 @@
 #!/usr/bin/env python
+"""Collect the distribution of event means at each position of the motif and null sites
+"""
 import sys
 import glob
 import os
 import cPickle
+import numpy as np
 sys.path.append("../")
-from lib.utils import cull_motif_features4
+from lib.utils import cull_motif_features4, get_motif_range
+from lib.online_stats import PositionStats
 from argparse import ArgumentParser
+from multiprocessing import Pool
 
 
 def parse_args():
@@ -17,6 +22,12 @@ def parse_args():
                         help="directory with alignment files")
     parser.add_argument('--strand', '-st', action='store', dest='strand', required=True,
                         help="which strand get get stats for")
+    parser.add_argument('--jobs', '-j', action='store', dest='jobs', required=False, default=4, type=int,
+                        help="number of processes")
+    parser.add_argument('--bins', action='store', dest='bins', required=False, default=None, type=int,
+                        help="number of histogram bins for each position, to get approximate quantiles")
+    parser.add_argument('--range', action='store', dest='range', required=False, default=[0.0, 200.0], type=float,
+                        nargs=2, help="range of the histogram bins, values outside of it go in the end bins")
     parser.add_argument('--output_location', '-o', action='store', dest='out',
                         required=True, type=str, default=None,
                         help="file to put results")
@@ -24,6 +35,18 @@ def parse_args():
     return args
 
 
+def collect_stats(work):
+    # stats for a chunk of files, so only one PositionStats per chunk is sent back
+    tsvs, sites, strand, bin_edges = work
+    stats = PositionStats(sorted(set(get_motif_range(sites))), bin_edges=bin_edges)
+    for tsv in tsvs:
+        motif_table = cull_motif_features4(motif=sites, tsv=tsv, strand=strand, feature_set="mean")
+        if motif_table is False:
+            continue
+        stats.push(motif_table['ref_pos'].values, motif_table['delta_mean'].values)
+    return stats
+
+
 def main(args):
     args = parse_args()
 
@@ -35,26 +58,23 @@ def main(args):
 
     # get the files
     tsvs = [x for x in glob.glob(args.files) if os.stat(x).st_size != 0]
-    # container for stats
-    stats = {}
-    strand = args.strand
-    for tsv in tsvs:
-        motif_table = cull_motif_features4(motif=all_sites, tsv=tsv, strand=strand, feature_set="mean")
-        if motif_table is False:
-            continue
-        for row in motif_table.iterrows():
-            try:
-                idx = str(row[1]['ref_pos'])
-                d_mean = row[1]['delta_mean']
-                stats[idx].append(d_mean)
-            except KeyError:
-                idx = str(row[1]['ref_pos'])
-                d_mean = row[1]['delta_mean']
-                stats[idx] = [d_mean]
-    cPickle.dump(stats, open(args.out, 'w'))
+    bin_edges = None if args.bins is None else np.linspace(args.range[0], args.range[1], args.bins + 1)
+    chunk_size = max(1, min(100, len(tsvs) / (4 * args.jobs)))
+    work = [(tsvs[i:i + chunk_size], all_sites, args.strand, bin_edges) for i in xrange(0, len(tsvs), chunk_size)]
 
+    stats = PositionStats(sorted(set(get_motif_range(all_sites))), bin_edges=bin_edges)
+    pool = Pool(args.jobs)
+    for chunk_stats in pool.imap_unordered(collect_stats, work):
+        stats.merge(chunk_stats)
+    pool.close()
+    pool.join()
 
-if __name__ == "__main__":
-    sys.exit(main(sys.argv))
+    # arrays indexed like stats['positions'], see PositionStats.arrays
+    cPickle.dump(stats.arrays(), open(args.out, 'w'), protocol=cPickle.HIGHEST_PROTOCOL)
+    print >> sys.stderr, "collected {0} events at {1} positions from {2} files".format(stats.count.sum(),
+                                                                                      np.sum(stats.count > 0),
+                                                                                      len(tsvs))
 
 
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
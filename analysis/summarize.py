@@ -1,24 +1,58 @@
 #!/usr/bin/env python
-
-import numpy as np
+"""Summarize the test accuracies recorded in a results database (run_nn.py --results_db)
+"""
 import sys
 import os
+import numpy as np
+sys.path.append("../")
+from lib.results_store import ResultsStore
+from argparse import ArgumentParser
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('results', action='store', type=str,
+                        help="results database, or a run_nn.py output directory with a results.db")
+    parser.add_argument('--experiment', action='store', dest='experiment', required=False, type=str, default=None,
+                        help="only summarize this experiment")
+    parser.add_argument('--title', action='store', dest='title', required=False, type=str, default=None,
+                        help="list every run of this site")
+    parser.add_argument('--by_params', action='store_true', dest='by_params', default=False,
+                        help="compare the sets of hyperparameters instead of the sites")
+    args = parser.parse_args()
+    return args
+
 
-results = []
+def main(args):
+    args = parse_args()
+    path = os.path.join(args.results, "results.db") if os.path.isdir(args.results) else args.results
+    assert(os.path.exists(path)), "didn't find a results database at {}".format(path)
 
-path = sys.argv[1]
+    with ResultsStore(path) as store:
+        if args.title is not None:
+            for run_id, experiment, title, accuracy, nb_iterations, params in store.site_accuracies(
+                    experiment=args.experiment, title=args.title):
+                print >> sys.stdout, "{0}\t{1}\t{2:.2f}\t{3} iterations\tepochs={4}\tlearning_rate={5}".format(
+                    run_id, experiment, accuracy * 100, nb_iterations, params.get('epochs'),
+                    params.get('learning_rate'))
+            return
 
-result_files = [x for x in os.listdir(path) if x.endswith(".tsv")]
+        if args.by_params:
+            for param_set, nb_runs, mean_accuracy, best_accuracy, params in store.param_set_accuracies(
+                    experiment=args.experiment):
+                print >> sys.stdout, "{0}\t{1} runs\tmean {2:.2f}\tbest {3:.2f}\t{4}".format(
+                    param_set, nb_runs, mean_accuracy * 100, best_accuracy * 100,
+                    " ".join("{0}={1}".format(k, params[k]) for k in ["model_type", "hidden_dim", "epochs",
+                                                                     "learning_rate", "L1_reg", "L2_reg",
+                                                                     "preprocess", "feature_set"] if k in params))
+            return
 
-for f in result_files:
-    for line in open(path + f, 'r'):
-        if line.startswith(">"):
-            line = line[1:]
-            line = line.split()
-            results.append((line[0], line[1]))
+        # the latest run of each site
+        results = store.latest_accuracies(experiment=args.experiment)
+    for title, accuracy, _ in results:
+        print >> sys.stdout, "{0}\t{1:.2f}".format(title, accuracy * 100)
+    print "Avg: {0:.2f}".format(np.mean([accuracy * 100 for _, accuracy, _ in results]))
 
-for result in results:
-    print >> sys.stdout, "{0}\t{1:.2f}".format(result[0], (float(result[1]) * 100))
 
-results = [float(x[1]) * 100 for x in results]
-print "Avg: {0:.2f}".format(np.mean(results))
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
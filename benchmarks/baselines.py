@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Compare benchmark results (JSON, a dict with a "results" list) with a stored baseline of the same benchmark
+"""
+from __future__ import print_function
+import json
+
+
+def add_baseline_args(parser, metrics):
+    parser.add_argument('--output', '-o', action='store', dest='output', required=False, type=str, default=None,
+                        help="file to write the results to (JSON), use it as a later run's baseline")
+    parser.add_argument('--results', action='store', dest='results', required=False, type=str, default=None,
+                        help="compare these results (JSON) with the baseline instead of running the benchmark")
+    parser.add_argument('--baseline', action='store', dest='baseline', required=False, type=str, default=None,
+                        help="results (JSON) to compare with")
+    parser.add_argument('--metrics', action='store', dest='metrics', required=False, type=str, nargs='+',
+                        default=metrics, help="metrics to compare with the baseline")
+    parser.add_argument('--tolerance', action='store', dest='tolerance', required=False, type=float, default=0.2,
+                        help="fraction a metric can get worse by before it's flagged")
+
+
+def compare(results, baseline, key_fields, metrics, tolerance, lower_is_better=()):
+    """Lines comparing each result with the baseline result that has the same key_fields, and the number of
+    regressions. The metrics in lower_is_better are times, the rest are rates
+    """
+    def key(result):
+        return tuple(result[field] for field in key_fields)
+    baseline = dict((key(r), r) for r in baseline["results"])
+    lines, regressions = [], 0
+    for result in results["results"]:
+        base = baseline.get(key(result))
+        if base is None:
+            continue
+        for metric in metrics:
+            if result.get(metric) is None or not base.get(metric):
+                continue
+            change = result[metric] / base[metric]
+            worse = change > 1.0 + tolerance if metric in lower_is_better else change < 1.0 - tolerance
+            regressions += worse
+            lines.append("{0}\t{1}\t{2:.3f}\t{3:.3f}\t{4:.2f}{5}".format(
+                "/".join(map(str, key(result))), metric, base[metric], result[metric], change,
+                "\tREGRESSION" if worse else ""))
+    return lines, regressions
+
+
+def report(args, run_benchmark, key_fields, lower_is_better=()):
+    """Run the benchmark (or load args.results), write the results and compare them with args.baseline. Returns
+    the exit status (1 if there were regressions) and the results
+    """
+    results = json.load(open(args.results)) if args.results is not None else run_benchmark(args)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    elif args.results is None and args.baseline is None:
+        print(json.dumps(results, indent=1, sort_keys=True))
+
+    if args.baseline is None:
+        return 0, results
+    lines, regressions = compare(results, json.load(open(args.baseline)), key_fields, args.metrics, args.tolerance,
+                                 lower_is_better=lower_is_better)
+    print("settings\tmetric\tbaseline\tcurrent\tratio")
+    for line in lines:
+        print(line)
+    print("{0} regressions in {1} comparisons".format(regressions, len(lines)))
+    return 1 if regressions > 0 else 0, results
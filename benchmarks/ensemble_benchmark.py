@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Cost of scoring data with K per-iteration models as one batched ensemble against K separate predictions
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import cPickle
+sys.path.append("../")
+import numpy as np
+from argparse import ArgumentParser
+from lib.model import ReLUThreeLayerNetwork
+from lib.inference import NumpyPredictor
+from lib.ensemble import EnsemblePredictor
+from lib.neural_network import predict, load_network
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--nb_models', '-k', action='store', dest='nb_models', required=False, type=int, default=10)
+    parser.add_argument('--nb_vectors', '-n', action='store', dest='nb_vectors', required=False, type=int,
+                        default=100000)
+    parser.add_argument('--hidden_dim', action='store', dest='hidden_dim', required=False, type=int, nargs=2,
+                        default=[100, 100])
+    parser.add_argument('--in_dim', action='store', dest='in_dim', required=False, type=int, default=48)
+    return parser.parse_args()
+
+
+def random_model(seed, in_dim, hidden_dim, n_classes=3):
+    rng = np.random.RandomState(seed)
+    dims = [in_dim] + list(hidden_dim) + [n_classes]
+    model = {"model": ReLUThreeLayerNetwork, "in_dim": in_dim, "n_classes": n_classes, "hidden_dim": list(hidden_dim)}
+    for layer_id, (n_in, n_out) in zip(['h0', 'h1', 's0'], zip(dims[:-1], dims[1:])):
+        model[layer_id + 'weights'] = rng.uniform(-1, 1, size=(n_in, n_out)) / np.sqrt(n_in)
+        model[layer_id + 'biases'] = rng.uniform(-0.1, 0.1, size=n_out)
+    return model
+
+
+def timed(f):
+    start = time.time()
+    result = f()
+    return result, time.time() - start
+
+
+def main(args):
+    args = parse_args()
+    models = [random_model(k, args.in_dim, args.hidden_dim) for k in xrange(args.nb_models)]
+    data = np.random.randn(args.nb_vectors, args.in_dim).astype(np.float32)
+    labels = np.zeros(args.nb_vectors, dtype=np.int32)
+
+    model_dir = tempfile.mkdtemp()
+    try:
+        model_files = []
+        for k, model in enumerate(models):
+            model_files.append(os.path.join(model_dir, "model{}.pkl".format(k)))
+            cPickle.dump(model, open(model_files[-1], 'w'))
+
+        def theano_predictions():
+            return np.mean([predict(data, labels, args.nb_vectors, load_network(f))[1] for f in model_files], axis=0)
+
+        def numpy_predictions():
+            return np.mean([NumpyPredictor(m).predict_proba(data) for m in models], axis=0)
+
+        ensemble = EnsemblePredictor(models)
+        theano_probs, theano_time = timed(theano_predictions)
+        numpy_probs, numpy_time = timed(numpy_predictions)
+        ensemble_probs, ensemble_time = timed(lambda: ensemble.predict_proba(data))
+    finally:
+        shutil.rmtree(model_dir)
+
+    print("{0} models, {1} vectors, hidden dims {2}".format(args.nb_models, args.nb_vectors, args.hidden_dim))
+    print("method\tseconds\tmax abs difference from ensemble")
+    print("{0} x predict (theano)\t{1:.3f}\t{2:.2e}".format(args.nb_models, theano_time,
+                                                            np.abs(theano_probs - ensemble_probs).max()))
+    print("{0} x NumpyPredictor\t{1:.3f}\t{2:.2e}".format(args.nb_models, numpy_time,
+                                                          np.abs(numpy_probs - ensemble_probs).max()))
+    print("EnsemblePredictor\t{0:.3f}\t0".format(ensemble_time))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""Inference latency and throughput of each feed-forward model type with each engine: the compiled Theano network
+(TheanoPredictor, what evaluate_network uses), NumPy in float32 and float64, int8 quantized and CSR sparse. For each
+one it measures the cold start (imports, loading the model file, compiling) in a new process, single vector latency
+percentiles and bulk samples/sec, and checks that the probabilities match Theano's. predict and evaluate_network are
+timed on the same data. The results are written as JSON, and compared with a baseline JSON to flag regressions
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+sys.path.append("../")
+from argparse import ArgumentParser
+from baselines import add_baseline_args, report
+
+# the models that every engine can run (the NumPy engines only do feed-forward models)
+MODEL_TYPES = ["twoLayer", "threeLayer", "ReLUthreeLayer", "fourLayer", "ReLUfourLayer"]
+# number of hidden layers of each model type
+HIDDEN_LAYERS = {"twoLayer": 1, "threeLayer": 2, "ReLUthreeLayer": 2, "fourLayer": 3, "ReLUfourLayer": 3}
+ENGINES = ["theano", "numpy", "numpy64", "quantized", "sparse"]
+# largest difference from Theano's probabilities for an engine to be equivalent, the quantized model is checked
+# on how often it calls the same class instead
+MAX_PROB_DIFFERENCE = {"theano": 0.0, "numpy": 1e-4, "numpy64": 1e-6, "sparse": 1e-4}
+MIN_QUANTIZED_AGREEMENT = 0.95
+KEY_FIELDS = ["model_type", "engine", "hidden_dim"]
+TIME_METRICS = ["cold_start_seconds", "import_seconds", "load_seconds", "compile_seconds", "latency_p50_ms",
+                "latency_p90_ms", "latency_p99_ms"]
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--model_types', action='store', dest='model_types', required=False, type=str, nargs='+',
+                        default=MODEL_TYPES)
+    parser.add_argument('--engines', action='store', dest='engines', required=False, type=str, nargs='+',
+                        default=ENGINES)
+    parser.add_argument('--hidden_dim', action='store', dest='hidden_dim', required=False, type=int, default=100,
+                        help="width of the hidden layers")
+    parser.add_argument('--in_dim', action='store', dest='in_dim', required=False, type=int, default=48)
+    parser.add_argument('--nb_vectors', '-n', action='store', dest='nb_vectors', required=False, type=int,
+                        default=100000, help="vectors for the bulk throughput")
+    parser.add_argument('--batch_size', '-b', action='store', dest='batch_size', required=False, type=int,
+                        default=10000, help="batch size for the bulk throughput")
+    parser.add_argument('--repeats', '-r', action='store', dest='repeats', required=False, type=int, default=1000,
+                        help="single vector predictions for the latency percentiles")
+    parser.add_argument('--cold_start', action='store', dest='cold_start', required=False, type=str, nargs=2,
+                        default=None, help="(internal) time the cold start of an engine for a model file")
+    add_baseline_args(parser, ["samples_per_sec", "latency_p50_ms", "latency_p99_ms", "cold_start_seconds"])
+    return parser.parse_args()
+
+
+def load_predictor(engine, model_file, timings):
+    """Predictor for a model file, the time to load the file and to build (or compile) the predictor are added to
+    timings
+    """
+    start = time.time()
+    if engine == "theano":
+        from lib.neural_network import load_network, TheanoPredictor
+        net = load_network(model_file)
+        timings["load_seconds"] = time.time() - start
+        start = time.time()
+        predictor = TheanoPredictor(net)
+    else:
+        import numpy as np
+        from lib.inference import load_model_dict, NumpyPredictor
+        from lib.quantization import quantize_model, QuantizedPredictor
+        from lib.pruning import sparse_model, SparsePredictor
+        model = load_model_dict(model_file)
+        timings["load_seconds"] = time.time() - start
+        start = time.time()
+        if engine == "numpy":
+            predictor = NumpyPredictor(model)
+        elif engine == "numpy64":
+            predictor = NumpyPredictor(model, dtype=np.float64)
+        elif engine == "quantized":
+            predictor = QuantizedPredictor(quantize_model(model))
+        else:
+            # nothing is pruned, so every layer is densified
+            predictor = SparsePredictor(sparse_model(model))
+    timings["compile_seconds"] = time.time() - start
+    return predictor
+
+
+def cold_start(engine, model_file):
+    # runs in a new interpreter, so the imports aren't already loaded
+    start = time.time()
+    import numpy as np
+    if engine == "theano":
+        import lib.neural_network
+    else:
+        import lib.inference, lib.quantization, lib.pruning
+    timings = {"import_seconds": time.time() - start}
+    predictor = load_predictor(engine, model_file, timings)
+    first_call = time.time()
+    predictor.predict_proba(np.zeros((1, predictor.in_dim)))
+    timings["first_call_seconds"] = time.time() - first_call
+    timings["cold_start_seconds"] = time.time() - start
+    return timings
+
+
+def time_cold_start(engine, model_file):
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--cold_start", engine, model_file],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def random_model_file(model_type, in_dim, hidden_dim, file_path, n_classes=3, seed=0):
+    # every layer gets random params, a new network's softmax layer is all zeros so its output is uniform and any
+    # engine would match it
+    import numpy as np
+    import theano.tensor as T
+    from lib.utils import get_network
+    rng = np.random.RandomState(seed)
+    net = get_network(x=T.matrix('x'), in_dim=in_dim, n_classes=n_classes,
+                      hidden_dim=[hidden_dim] * HIDDEN_LAYERS[model_type], model_type=model_type)
+    for param in net.params:
+        value = param.get_value()
+        scale = 1.0 / np.sqrt(value.shape[0]) if value.ndim == 2 else 0.1
+        param.set_value(np.asarray(scale * rng.randn(*value.shape), dtype=value.dtype))
+    net.write(file_path)
+    return file_path
+
+
+def latency_percentiles(predictor, data, repeats):
+    import numpy as np
+    times = []
+    for i in xrange(repeats):
+        x = data[i % len(data)][None, :]
+        start = time.time()
+        predictor.predict_proba(x)
+        times.append(time.time() - start)
+    return dict(("latency_p{}_ms".format(p), 1000 * np.percentile(times, p)) for p in [50, 90, 99])
+
+
+def equivalence(engine, probs, reference):
+    import numpy as np
+    difference = float(np.abs(probs - reference).max())
+    agreement = float(np.mean(np.argmax(probs, axis=1) == np.argmax(reference, axis=1)))
+    if engine == "quantized":
+        equivalent = agreement >= MIN_QUANTIZED_AGREEMENT
+    else:
+        equivalent = difference <= MAX_PROB_DIFFERENCE[engine]
+    return {"max_prob_difference": difference, "agreement": agreement, "equivalent": equivalent}
+
+
+def time_theano_functions(model_file, data, labels, batch_size):
+    """samples/sec of predict (compiles its functions on every call) and evaluate_network, cold and then with the
+    compiled network in the registry
+    """
+    from lib.neural_network import load_network, predict, evaluate_network
+    from lib.registry import ModelRegistry
+    net = load_network(model_file)
+    n = (len(data) / batch_size) * batch_size
+    registry = ModelRegistry()
+    rates = {}
+    for name, f in [("predict", lambda: predict(data, labels, batch_size, net)),
+                    ("evaluate_network cold", lambda: evaluate_network(data, labels, model_file, None, batch_size,
+                                                                       registry=registry)),
+                    ("evaluate_network", lambda: evaluate_network(data, labels, model_file, None, batch_size,
+                                                                  registry=registry))]:
+        start = time.time()
+        f()
+        rates[name] = n / (time.time() - start)
+    return rates
+
+
+def run_benchmark(args):
+    import numpy as np
+    import theano
+    from lib.inference import throughput
+    rng = np.random.RandomState(0)
+    data = rng.randn(args.nb_vectors, args.in_dim).astype(theano.config.floatX)
+    labels = rng.randint(3, size=args.nb_vectors).astype(np.int32)
+    check = data[:min(len(data), 1000)]
+    work_dir = tempfile.mkdtemp()
+    results = []
+    print("model\tengine\tcold start s\tp50 ms\tp99 ms\tsamples/sec\tmax prob diff\tequivalent", file=sys.stderr)
+    try:
+        for model_type in args.model_types:
+            model_file = random_model_file(model_type, args.in_dim, args.hidden_dim,
+                                           os.path.join(work_dir, model_type + ".pkl"))
+            reference = load_predictor("theano", model_file, {}).predict_proba(check)
+            for engine in args.engines:
+                assert(engine in ENGINES), "engine needs to be one of {}".format(ENGINES)
+                result = {"model_type": model_type, "engine": engine, "hidden_dim": args.hidden_dim}
+                result.update(time_cold_start(engine, model_file))
+                predictor = load_predictor(engine, model_file, {})
+                result.update(latency_percentiles(predictor, data, args.repeats))
+                result["samples_per_sec"] = throughput(predictor, data, batch_size=args.batch_size)
+                result.update(equivalence(engine, predictor.predict_proba(check), reference))
+                results.append(result)
+                print("{0}\t{1}\t{2:.3f}\t{3:.3f}\t{4:.3f}\t{5:.0f}\t{6:.2g}\t{7}".format(
+                    model_type, engine, result["cold_start_seconds"], result["latency_p50_ms"],
+                    result["latency_p99_ms"], result["samples_per_sec"], result["max_prob_difference"],
+                    result["equivalent"]), file=sys.stderr)
+            for name, rate in sorted(time_theano_functions(model_file, data, labels, args.batch_size).items()):
+                results.append({"model_type": model_type, "engine": name, "hidden_dim": args.hidden_dim,
+                                "samples_per_sec": rate})
+                print("{0}\t{1}\t\t\t\t{2:.0f}".format(model_type, name, rate), file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir)
+    not_equivalent = ["{0}/{1}".format(r["model_type"], r["engine"]) for r in results if r.get("equivalent") is False]
+    if len(not_equivalent) > 0:
+        print("outputs differ from Theano's for {}".format(", ".join(not_equivalent)), file=sys.stderr)
+    return {
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "theano": {"version": theano.__version__, "floatX": theano.config.floatX, "blas": theano.config.blas.ldflags},
+        "nb_vectors": args.nb_vectors,
+        "batch_size": args.batch_size,
+        "in_dim": args.in_dim,
+        "results": results,
+        "not_equivalent": not_equivalent,
+    }
+
+
+def main(args):
+    args = parse_args()
+    if args.cold_start is not None:
+        print(json.dumps(cold_start(*args.cold_start)))
+        return 0
+    status, results = report(args, run_benchmark, KEY_FIELDS, lower_is_better=TIME_METRICS)
+    # an engine that doesn't match Theano fails the run like a regression
+    return 1 if status != 0 or len(results.get("not_equivalent", [])) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
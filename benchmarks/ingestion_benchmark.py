@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Throughput and peak memory of reading alignment files into feature vectors, on synthetic reads at a few scales
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import resource
+sys.path.append("../")
+from argparse import ArgumentParser
+from multiprocessing import Process, Queue
+from lib.synthetic import write_reads
+from lib.utils import cull_motif_features4, collect_data_vectors2, stack_and_level_datasets3, \
+    append_and_level_labels3, preprocess_data, shuffle_and_maintain_labels
+
+MOTIF_STARTS = [148, 289, 525, 747]
+# long enough for reads that miss the motifs
+REFERENCE_LENGTH = 2000
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--scales', action='store', dest='scales', required=False, type=int, nargs='+',
+                        default=[10, 100, 1000], help="numbers of reads in each group")
+    parser.add_argument('--events', '-ev', action='store', dest='events', required=False, type=int, default=2,
+                        help="events per position for the vectors")
+    parser.add_argument('--motif_hit_fraction', action='store', dest='motif_hit_fraction', required=False,
+                        type=float, default=0.5, help="fraction of the reads that cover a motif")
+    parser.add_argument('--strand', '-st', action='store', dest='strand', required=False, type=str, default="t")
+    parser.add_argument('--feature_set', '-f', action='store', dest='features', required=False, type=str,
+                        default=None)
+    return parser.parse_args()
+
+
+def cull_files(files, args):
+    nb_tables = 0
+    for f in files:
+        nb_tables += cull_motif_features4(MOTIF_STARTS, f, args.strand, feature_set=args.features) is not False
+    return nb_tables
+
+
+def collect_group(group, args):
+    sets = collect_data_vectors2(events_per_pos=args.events, label=0, portion=0.8, files=group, strand=args.strand,
+                                 motif_starts=MOTIF_STARTS, dataset_title="benchmark", max_samples=sys.maxint,
+                                 feature_set=args.features)
+    return sum(len(s[0]) for s in sets)
+
+
+def site_pipeline(groups, args):
+    # what classify_with_network3 does before training: collect, split and level each group, then pre-process
+    sets = [collect_data_vectors2(events_per_pos=args.events, label=n, portion=0.8, files=group,
+                                  strand=args.strand, motif_starts=MOTIF_STARTS, dataset_title="benchmark",
+                                  max_samples=sys.maxint, feature_set=args.features)
+            for n, group in enumerate(groups)]
+    levels = [min(len(sets[n][i][0]) for n in xrange(3)) for i in xrange(3)]
+    stacked = [stack_and_level_datasets3(sets[0][i][0], sets[1][i][0], sets[2][i][0], levels[i]) for i in xrange(3)]
+    labels = append_and_level_labels3(sets[0][0][1], sets[1][0][1], sets[2][0][1], levels[0])
+    train, xtrain, test = preprocess_data(stacked[0], stacked[1], stacked[2], preprocess="normalize")
+    X, y = shuffle_and_maintain_labels(train, labels)
+    return len(X) + len(xtrain) + len(test)
+
+
+def measure(queue, f):
+    # runs in its own process, so the peak RSS is this stage's
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    result = f()
+    elapsed = time.time() - start
+    queue.put((result, elapsed, start_rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def run_stage(f):
+    queue = Queue()
+    process = Process(target=measure, args=(queue, f))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main(args):
+    args = parse_args()
+    work_dir = tempfile.mkdtemp()
+    print("scale\tstage\tseconds\trows/sec\tvectors\tpeak RSS MB\tstage RSS MB")
+    try:
+        for scale in args.scales:
+            group_dirs = [os.path.join(work_dir, "{0}_{1}".format(scale, n)) for n in xrange(3)]
+            files = [write_reads(d, scale, MOTIF_STARTS, reference_length=REFERENCE_LENGTH,
+                                 motif_hit_fraction=args.motif_hit_fraction, shift=2.0 * n,
+                                 seed=n) for n, d in enumerate(group_dirs)]
+            groups = [d + "/*.tsv" for d in group_dirs]
+            rows = [sum(1 for f in group_files for _ in open(f)) for group_files in files]
+
+            stages = [("cull_motif_features4", rows[0], lambda: cull_files(files[0], args)),
+                      ("collect_data_vectors2", rows[0], lambda: collect_group(groups[0], args)),
+                      ("site pipeline (3 groups)", sum(rows), lambda: site_pipeline(groups, args))]
+            for name, nb_rows, f in stages:
+                result, elapsed, start_rss, peak_rss = run_stage(f)
+                print("{0}\t{1}\t{2:.3f}\t{3:.0f}\t{4}\t{5:.1f}\t{6:.1f}".format(
+                    scale, name, elapsed, nb_rows / elapsed, "-" if name == stages[0][0] else result,
+                    peak_rss / 1024.0, (peak_rss - start_rss) / 1024.0))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
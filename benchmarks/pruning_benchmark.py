@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Latency of sparse (CSR) inference against dense inference as a model is pruned to lower densities
+"""
+from __future__ import print_function
+import sys
+import time
+sys.path.append("../")
+import numpy as np
+from argparse import ArgumentParser
+from lib.model import ReLUThreeLayerNetwork
+from lib.inference import NumpyPredictor, load_model_dict
+from lib.pruning import threshold_for_density, prune_model, layer_densities, sparse_model, SparsePredictor
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--model', '-m', action='store', dest='model', required=False, type=str, default=None,
+                        help="model file, default is a random ReLUthreeLayer [500, 500] like the ecoli configs")
+    parser.add_argument('--batch_size', '-b', action='store', dest='batch_size', required=False, type=int,
+                        default=1000)
+    parser.add_argument('--repeats', '-r', action='store', dest='repeats', required=False, type=int, default=20)
+    parser.add_argument('--densities', action='store', dest='densities', required=False, type=float, nargs='+',
+                        default=[1.0, 0.5, 0.3, 0.2, 0.1, 0.05, 0.02, 0.01])
+    return parser.parse_args()
+
+
+def random_model(in_dim=48, hidden_dim=(500, 500), n_classes=2):
+    rng = np.random.RandomState(0)
+    dims = [in_dim] + list(hidden_dim) + [n_classes]
+    model = {"model": ReLUThreeLayerNetwork, "in_dim": in_dim, "n_classes": n_classes, "hidden_dim": list(hidden_dim)}
+    for layer_id, (n_in, n_out) in zip(['h0', 'h1', 's0'], zip(dims[:-1], dims[1:])):
+        model[layer_id + 'weights'] = rng.uniform(-np.sqrt(6. / (n_in + n_out)), np.sqrt(6. / (n_in + n_out)),
+                                                  size=(n_in, n_out))
+        model[layer_id + 'biases'] = np.zeros(n_out)
+    return model
+
+
+def latency(predictor, batch, repeats):
+    """Median milliseconds for predictor to score one batch
+    """
+    times = []
+    for _ in xrange(repeats):
+        start = time.time()
+        predictor.predict_proba(batch)
+        times.append(time.time() - start)
+    return 1000 * np.median(times)
+
+
+def main(args):
+    args = parse_args()
+    model = load_model_dict(args.model) if args.model is not None else random_model()
+    batch = np.random.randn(args.batch_size, model['in_dim'])
+
+    dense_ms = latency(NumpyPredictor(model), batch, args.repeats)
+    print("density\tlayer densities\tdense ms\tsparse ms\tspeedup")
+    for density in args.densities:
+        pruned, _ = prune_model(model, threshold_for_density(model, density, per_layer=True))
+        # force every layer through the sparse path so the crossover point shows up
+        sparse_ms = latency(SparsePredictor(sparse_model(pruned), density_threshold=1.1), batch, args.repeats)
+        print("{0:.2f}\t{1}\t{2:.3f}\t{3:.3f}\t{4:.2f}".format(
+            density, ",".join("{:.3f}".format(d) for d in layer_densities(pruned)), dense_ms, sparse_ms,
+            dense_ms / sparse_ms))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
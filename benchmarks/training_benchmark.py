@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Training throughput of each model type and trainer at a grid of batch sizes and hidden layer widths, on the
+digits toy dataset and synthetic data. Graph building, compiling and the training steps are timed separately (see
+the "timings" in the training summary). The results are written as JSON, and compared with a baseline JSON to flag
+regressions
+"""
+from __future__ import print_function
+import sys
+import platform
+sys.path.append("../")
+sys.path.append("../tests/")
+import numpy as np
+import theano
+from argparse import ArgumentParser
+from itertools import product
+from toy_datasets import load_digit_dataset
+from baselines import add_baseline_args, report
+from lib.optimization import mini_batch_sgd, mini_batch_sgd_with_annealing, mini_batch_sgd_recurrent
+
+# number of hidden layers of each model type, the hidden dims are the width repeated, None is the ConvNet3 (an int
+# hidden dim) and the recurrent models get sequences instead of vectors
+MODEL_LAYERS = {
+    "twoLayer": 1,
+    "threeLayer": 2,
+    "ReLUthreeLayer": 2,
+    "fourLayer": 3,
+    "ReLUfourLayer": 3,
+    "ConvNet3": None,
+    "GRU": 1,
+    "LSTM": 1,
+}
+RECURRENT = ["GRU", "LSTM"]
+TRAINERS = {"sgd": mini_batch_sgd, "annealing": mini_batch_sgd_with_annealing}
+# steps in each sequence for the recurrent models, the vectors are split into this many events
+SEQUENCE_LENGTH = 8
+# settings that identify a result when comparing with a baseline
+KEY_FIELDS = ["dataset", "model_type", "trainer", "batch_size", "hidden_dim"]
+# metrics where lower is better, the rest are rates
+TIME_METRICS = ["graph_seconds", "compile_seconds", "train_seconds", "eval_seconds"]
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--model_types', action='store', dest='model_types', required=False, type=str, nargs='+',
+                        default=sorted(MODEL_LAYERS.keys()))
+    parser.add_argument('--trainers', action='store', dest='trainers', required=False, type=str, nargs='+',
+                        default=["sgd", "annealing"], help="recurrent models always use mini_batch_sgd_recurrent")
+    parser.add_argument('--batch_sizes', action='store', dest='batch_sizes', required=False, type=int, nargs='+',
+                        default=[10, 100])
+    parser.add_argument('--hidden_dims', action='store', dest='hidden_dims', required=False, type=int, nargs='+',
+                        default=[10, 100], help="hidden layer widths")
+    parser.add_argument('--datasets', action='store', dest='datasets', required=False, type=str, nargs='+',
+                        default=["digits", "synthetic"])
+    parser.add_argument('--epochs', '-ep', action='store', dest='epochs', required=False, type=int, default=5)
+    parser.add_argument('--nb_synthetic', action='store', dest='nb_synthetic', required=False, type=int,
+                        default=3000, help="number of synthetic vectors")
+    add_baseline_args(parser, ["samples_per_sec"])
+    return parser.parse_args()
+
+
+def digits_dataset():
+    tr_data, xtr_data, _ = load_digit_dataset(0.7)
+    # pixel values are 0-16
+    X = np.array([x[0] for x in tr_data]) / 16.0
+    y = np.array([x[1] for x in tr_data])
+    xX = np.array([x[0] for x in xtr_data]) / 16.0
+    xy = np.array([x[1] for x in xtr_data])
+    return X, y, xX, xy, [8, 8]
+
+
+def synthetic_dataset(nb_vectors, in_dim=48, n_classes=3, seed=0):
+    # a gaussian blob for each class, like the event features of 3 groups at a site
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(n_classes, in_dim)
+    labels = rng.randint(n_classes, size=nb_vectors)
+    data = centers[labels] + 2.0 * rng.randn(nb_vectors, in_dim)
+    split = int(0.8 * nb_vectors)
+    return data[:split], labels[:split], data[split:], labels[split:], [SEQUENCE_LENGTH, in_dim / SEQUENCE_LENGTH]
+
+
+def model_args(model_type, width, batch_size, data_shape):
+    """(hidden_dim, extra_args) for a model type with hidden layers of width
+    """
+    if MODEL_LAYERS[model_type] is not None:
+        return [width] * MODEL_LAYERS[model_type], None
+    extra_args = {
+        "batch_size": batch_size,
+        "n_filters": [10],
+        "n_channels": [1],
+        "data_shape": data_shape,
+        "filter_shape": [1, 3],
+        "poolsize": (2, 2),
+    }
+    return width, extra_args
+
+
+def run(dataset, model_type, trainer, batch_size, width, epochs):
+    X, y, xX, xy, data_shape = dataset
+    hidden_dim, extra_args = model_args(model_type, width, batch_size, data_shape)
+    kwargs = dict(motif="benchmark", labels=y, xTrain_targets=xy, learning_rate=0.01, L1_reg=0.0, L2_reg=0.0,
+                  epochs=epochs, batch_size=batch_size, hidden_dim=hidden_dim, model_type=model_type, verbose=False,
+                  extra_args=extra_args)
+    if model_type in RECURRENT:
+        _, summary = mini_batch_sgd_recurrent(train_data=[x.reshape(SEQUENCE_LENGTH, -1) for x in X],
+                                              xTrain_data=[x.reshape(SEQUENCE_LENGTH, -1) for x in xX], **kwargs)
+    else:
+        _, summary = TRAINERS[trainer](train_data=X, xTrain_data=xX, **kwargs)
+    result = dict(summary["timings"])
+    result["xtrain_accuracy"] = float(summary["xtrain_accuracies"][-1])
+    result["nb_train"] = len(X)
+    return result
+
+
+def run_benchmark(args):
+    datasets = {}
+    if "digits" in args.datasets:
+        datasets["digits"] = digits_dataset()
+    if "synthetic" in args.datasets:
+        datasets["synthetic"] = synthetic_dataset(args.nb_synthetic)
+    results = []
+    seen = set()
+    print("dataset\tmodel\ttrainer\tbatch\twidth\tgraph s\tcompile s\tsteps/sec\tsamples/sec\txtrain acc",
+          file=sys.stderr)
+    for name, model_type, trainer, batch_size, width in product(args.datasets, args.model_types, args.trainers,
+                                                                args.batch_sizes, args.hidden_dims):
+        assert(model_type in MODEL_LAYERS), "no benchmark settings for model type {}".format(model_type)
+        trainer = "recurrent" if model_type in RECURRENT else trainer
+        key = (name, model_type, trainer, batch_size, width)
+        if key in seen:
+            continue
+        seen.add(key)
+        result = run(datasets[name], model_type, trainer, batch_size, width, args.epochs)
+        result.update(dict(zip(KEY_FIELDS, key)))
+        results.append(result)
+        print("{0}\t{1}\t{2}\t{3}\t{4}\t{5:.2f}\t{6:.2f}\t{7:.0f}\t{8:.0f}\t{9:.1f}".format(
+            name, model_type, trainer, batch_size, width, result["graph_seconds"], result["compile_seconds"],
+            result["steps_per_sec"], result["samples_per_sec"], result["xtrain_accuracy"]), file=sys.stderr)
+    return {
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "theano": {"version": theano.__version__, "floatX": theano.config.floatX, "blas": theano.config.blas.ldflags},
+        "epochs": args.epochs,
+        "results": results,
+    }
+
+
+def main(args):
+    args = parse_args()
+    status, _ = report(args, run_benchmark, KEY_FIELDS, lower_is_better=TIME_METRICS)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
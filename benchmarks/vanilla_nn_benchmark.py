@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Compare training throughput (samples/sec) of the VanillaNeuralNet mini-batch trainer with the Theano trainer
+"""
+from __future__ import print_function
+import sys
+import time
+sys.path.append("../")
+sys.path.append("../tests/")
+import numpy as np
+from argparse import ArgumentParser
+from toy_datasets import load_digit_dataset
+from lib.model import VanillaNeuralNet, tanh_activation
+from lib.optimization import mini_batch_sgd
+
+# Theano model with the same number of tanh hidden layers as the VanillaNeuralNet
+THEANO_MODELS = {1: "twoLayer", 2: "threeLayer", 3: "fourLayer"}
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--epochs', '-ep', action='store', dest='epochs', required=False, default=20, type=int)
+    parser.add_argument('--batch_size', '-b', action='store', dest='batch_size', required=False, default=10,
+                        type=int)
+    parser.add_argument('--hidden_dims', action='store', dest='hidden_dims', required=False, default=[100, 100],
+                        type=int, nargs='+')
+    return parser.parse_args()
+
+
+def time_vanilla(X, y, hidden_dims, epochs, batch_size, dtype):
+    net = VanillaNeuralNet(input_dim=X.shape[1], nb_classes=len(set(y)), hidden_dims=hidden_dims,
+                           activation_function=tanh_activation, dtype=dtype)
+    start = time.time()
+    net.mini_batch_sgd(X, y, epochs=epochs, batch_size=batch_size, epsilon=0.001, lbda=0.0)
+    return (len(X) * epochs) / (time.time() - start)
+
+
+def time_theano(X, y, xX, xy, hidden_dims, epochs, batch_size):
+    # mini_batch_sgd also builds and compiles the graph, so time two runs and take the difference to get the
+    # throughput of the training epochs alone. The first run fills the compile cache so both timed runs pay the
+    # same (cached) compile cost
+    def run(nb_epochs):
+        start = time.time()
+        mini_batch_sgd(motif="benchmark", train_data=X, labels=y, xTrain_data=xX, xTrain_targets=xy,
+                       learning_rate=0.001, L1_reg=0.0, L2_reg=0.0, epochs=nb_epochs, batch_size=batch_size,
+                       hidden_dim=hidden_dims, model_type=THEANO_MODELS[len(hidden_dims)], verbose=False)
+        return time.time() - start
+    run(10)
+    short, full = run(10), run(10 + epochs)
+    return ((len(X) / batch_size) * batch_size * epochs) / max(full - short, 1e-9)
+
+
+def main(args):
+    args = parse_args()
+    assert(len(args.hidden_dims) in THEANO_MODELS), "can only compare 1-3 hidden layers"
+    tr_data, xtr_data, _ = load_digit_dataset(0.7)
+    X = np.array([x[0] for x in tr_data])
+    y = np.array([x[1] for x in tr_data])
+    xX = np.array([x[0] for x in xtr_data])
+    xy = [x[1] for x in xtr_data]
+
+    results = [
+        ("vanilla float64", time_vanilla(X, y, args.hidden_dims, args.epochs, args.batch_size, np.float64)),
+        ("vanilla float32", time_vanilla(X, y, args.hidden_dims, args.epochs, args.batch_size, np.float32)),
+        ("theano", time_theano(X, y, xX, xy, args.hidden_dims, args.epochs, args.batch_size)),
+    ]
+    print("hidden dims {0}, batch size {1}, {2} training samples".format(args.hidden_dims, args.batch_size, len(X)))
+    for name, samples_per_sec in results:
+        print("{0}\t{1:.0f} samples/sec".format(name, samples_per_sec))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
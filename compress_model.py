@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""Compress a trained model for fast inference and report how it compares to the original on held-out data
+"""
+import sys
+import cPickle
+import numpy as np
+from argparse import ArgumentParser
+from itertools import chain
+from lib.utils import find_model_path, collect_group_vectors, collect_data_vectors2
+from lib.inference import NumpyPredictor, load_model_dict, accuracy, throughput
+from lib.quantization import quantize_model, write_quantized_model, quantization_report
+from lib.pruning import threshold_for_density, prune_model, layer_densities, fine_tune_pruned_model, \
+    sparse_model, write_sparse_model, SparsePredictor
+from lib.distillation import distill, distillation_report
+
+
+def add_model_args(parser):
+    parser.add_argument('--model', '-m', action='store', dest='model', required=False, type=str, default=None,
+                        help="model file to compress")
+    parser.add_argument('--model_dir', action='store', dest='model_dir', required=False, type=str, default=None,
+                        help="directory with models, the model for --title is found with find_model_path")
+
+
+def add_data_args(parser):
+    # held-out data, collected the same way run_nn.py collects vectors for a site in the config
+    parser.add_argument('--group_1', '-1', action='store', dest='group_1', required=True, type=str,
+                        help="group 1 files")
+    parser.add_argument('--group_2', '-2', action='store', dest='group_2', required=True, type=str,
+                        help="group 2 files")
+    parser.add_argument('--group_3', '-3', action='store', dest='group_3', required=False, type=str, default=None,
+                        help="group 3 files")
+    parser.add_argument('--config_file', '-c', action='store', dest='config', required=True, type=str,
+                        help="config file (pickle) with the site")
+    parser.add_argument('--title', '-t', action='store', dest='title', required=True, type=str,
+                        help="title of the site in the config file")
+    parser.add_argument('--strand', '-st', action='store', dest='strand', required=True, type=str,
+                        help="which strand to use, options = {t, c, both}")
+    parser.add_argument('--events', '-ev', action='store', dest='events', required=True, type=int,
+                        help="number of events per alignment column the model was trained with")
+    parser.add_argument('--feature_set', '-f', action='store', dest='features', required=False, type=str,
+                        default=None, help="feature set the model was trained with")
+    parser.add_argument('-nb_files', '-nb', action='store', dest='nb_files', required=False, type=int,
+                        default=50, help="maximum number of reads to use from each group")
+    parser.add_argument('--batch_size', '-b', action='store', dest='batch_size', required=False, type=int,
+                        default=10000, help="inference batch size for the throughput measurement")
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='command')
+
+    quantize = subparsers.add_parser('quantize', help="per-channel int8 post-training quantization")
+    add_model_args(quantize)
+    add_data_args(quantize)
+    quantize.add_argument('--output', '-o', action='store', dest='out', required=True, type=str,
+                          help="file to write the quantized model to")
+
+    prune = subparsers.add_parser('prune', help="magnitude pruning, stores the pruned layers in CSR form")
+    add_model_args(prune)
+    add_data_args(prune)
+    prune.add_argument('--output', '-o', action='store', dest='out', required=True, type=str,
+                       help="file to write the sparse model to")
+    prune.add_argument('--threshold', action='store', dest='threshold', required=False, type=float, default=None,
+                       help="zero the weights with magnitude below this")
+    prune.add_argument('--density', action='store', dest='density', required=False, type=float, default=None,
+                       help="pick the threshold so this fraction of the weights are kept")
+    prune.add_argument('--per_layer', action='store_true', dest='per_layer', default=False,
+                       help="with --density, prune each layer to the same density instead of using one threshold")
+    prune.add_argument('--fine_tune_epochs', action='store', dest='fine_tune_epochs', required=False, type=int,
+                       default=0, help="epochs of fine-tuning after pruning, 0 for none")
+    prune.add_argument('--learning_rate', '-e', action='store', dest='learning_rate', required=False, type=float,
+                       default=0.01, help="learning rate for fine-tuning")
+    prune.add_argument('--train_test', '-s', action='store', dest='split', required=False, type=float,
+                       default=0.9, help="portion of the vectors used for fine-tuning, the rest is split into "
+                                         "cross-train and test")
+    prune.add_argument('--train_batch_size', action='store', dest='train_batch_size', required=False, type=int,
+                       default=10, help="batch size for fine-tuning")
+
+    student = subparsers.add_parser('distill', help="train a small student network on the model's probabilities")
+    add_model_args(student)
+    add_data_args(student)
+    student.add_argument('--unlabeled', '-u', action='store', dest='unlabeled', required=True, type=str,
+                         help="unlabeled alignment files to score with the teacher and train the student on")
+    student.add_argument('--output', '-o', action='store', dest='out', required=True, type=str,
+                         help="directory to put the student models in")
+    student.add_argument('--student_type', action='store', dest='student_type', required=False, type=str,
+                         default="twoLayer", help="model_type of the student")
+    student.add_argument('--student_hidden_dim', action='store', dest='student_hidden_dim', required=False,
+                         type=int, nargs='+', default=[10], help="hidden dims of the student")
+    student.add_argument('--epochs', '-ep', action='store', dest='epochs', required=False, type=int, default=1000)
+    student.add_argument('--learning_rate', '-e', action='store', dest='learning_rate', required=False, type=float,
+                         default=0.01)
+    student.add_argument('--train_batch_size', action='store', dest='train_batch_size', required=False, type=int,
+                         default=10, help="batch size for training the student")
+
+    args = parser.parse_args()
+    if args.command == "prune":
+        assert((args.threshold is None) != (args.density is None)), "need one of --threshold or --density"
+    assert(args.model is not None or args.model_dir is not None), "need --model or --model_dir"
+    return args
+
+
+def get_held_out_data(args):
+    config = cPickle.load(open(args.config, 'r'))
+    sites = [site for site in config['sites'] if site['title'] == args.title]
+    assert(len(sites) == 1), "didn't find site {0} in {1}".format(args.title, args.config)
+    return collect_group_vectors(groups=(args.group_1, args.group_2, args.group_3),
+                                 motif_start_positions=sites[0]['motif_start_position'],
+                                 events_per_pos=args.events, strand=args.strand, max_samples=args.nb_files,
+                                 dataset_title=args.title, feature_set=args.features)
+
+
+def print_report(title, report):
+    print >> sys.stdout, "#    {}".format(title)
+    for key in sorted(report.keys()):
+        print >> sys.stdout, "#    {0}: {1}".format(key, report[key])
+
+
+def split_vectors(data, labels, portion):
+    # shuffle and split into train, cross-train and test, the same proportions collect_data_vectors2 uses
+    order = np.random.permutation(len(data))
+    data, labels = data[order], labels[order]
+    train_split = int(portion * len(data))
+    xtrain_split = int(train_split + 0.5 * ((1 - portion) * len(data)))
+    return (data[:train_split], labels[:train_split]), \
+           (data[train_split:xtrain_split], labels[train_split:xtrain_split]), \
+           (data[xtrain_split:], labels[xtrain_split:])
+
+
+def prune(model, data, labels, args):
+    report = {}
+    if args.fine_tune_epochs > 0:
+        (train, train_labels), (xtrain, xtrain_labels), (data, labels) = split_vectors(data, labels, args.split)
+
+    threshold = args.threshold if args.threshold is not None else threshold_for_density(model, args.density,
+                                                                                           per_layer=args.per_layer)
+    pruned, masks = prune_model(model, threshold)
+    report['threshold'] = threshold
+    report['layer_densities'] = layer_densities(pruned)
+    report['dense_accuracy'] = accuracy(NumpyPredictor(model), data, labels, args.batch_size)
+    report['pruned_accuracy'] = accuracy(NumpyPredictor(pruned), data, labels, args.batch_size)
+
+    if args.fine_tune_epochs > 0:
+        pruned = fine_tune_pruned_model(pruned, masks, train, train_labels, xtrain, xtrain_labels,
+                                        learning_rate=args.learning_rate, epochs=args.fine_tune_epochs,
+                                        batch_size=args.train_batch_size)
+        report['fine_tuned_accuracy'] = accuracy(NumpyPredictor(pruned), data, labels, args.batch_size)
+
+    sparse_pruned = sparse_model(pruned)
+    write_sparse_model(sparse_pruned, args.out)
+    dense_predictor, sparse_predictor = NumpyPredictor(model), SparsePredictor(sparse_pruned)
+    report['dense_samples_per_sec'] = throughput(dense_predictor, data, args.batch_size)
+    report['sparse_samples_per_sec'] = throughput(sparse_predictor, data, args.batch_size)
+    report['dense_bytes'] = dense_predictor.nbytes()
+    report['sparse_bytes'] = sparse_predictor.nbytes()
+    return report
+
+
+def student(model_file, data, labels, args):
+    # the labeled vectors are split in half, one half picks the best student and the other is for the report
+    config = cPickle.load(open(args.config, 'r'))
+    site = [site for site in config['sites'] if site['title'] == args.title][0]
+    unlabeled, _ = collect_data_vectors2(events_per_pos=args.events, label=0, portion=0.0, files=args.unlabeled,
+                                         strand=args.strand,
+                                         motif_starts=sorted(set(chain(*site['motif_start_position']))),
+                                         dataset_title=args.title + "_unlabeled", max_samples=args.nb_files,
+                                         feature_set=args.features, split_dataset=False)
+    _, (xtrain, xtrain_labels), (test, test_labels) = split_vectors(data, labels, 0.0)
+    out_dir = args.out if args.out.endswith("/") else args.out + "/"
+    net, summary = distill(model_file, unlabeled, xtrain, xtrain_labels,
+                           student_type=args.student_type, student_hidden_dim=args.student_hidden_dim,
+                           learning_rate=args.learning_rate, epochs=args.epochs, batch_size=args.train_batch_size,
+                           trained_model_dir=out_dir)
+    report = distillation_report(model_file, summary['best_model'], test, test_labels, args.batch_size)
+    report['student_model'] = summary['best_model']
+    return report
+
+
+def main(args):
+    args = parse_args()
+    model_file = args.model if args.model is not None else find_model_path(args.model_dir, args.title)
+    model = load_model_dict(model_file)
+    # the predictors set the NaNs to 0 with the model's normalization
+    test_data, labels = get_held_out_data(args)
+
+    if args.command == "quantize":
+        write_quantized_model(quantize_model(model), args.out)
+        print_report("int8 quantization of {0} on {1} held-out vectors".format(model_file, len(test_data)),
+                     quantization_report(model, test_data, labels, batch_size=args.batch_size))
+    elif args.command == "prune":
+        print_report("magnitude pruning of {0} on {1} vectors".format(model_file, len(test_data)),
+                     prune(model, test_data, labels, args))
+    elif args.command == "distill":
+        print_report("distillation of {0} into a {1} {2}".format(model_file, args.student_type,
+                                                                 args.student_hidden_dim),
+                     student(model_file, test_data, labels, args))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
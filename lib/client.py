@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Client for the inference server (see server.py), only needs the standard library so it's cheap to import
+"""
+import json
+import socket
+
+
+class InferenceClient(object):
+    """Talks to an InferenceServer on a Unix socket (socket_path) or a localhost TCP port. One client keeps one
+    connection, use a client per thread
+    """
+    def __init__(self, socket_path=None, port=None, host="127.0.0.1", timeout=None):
+        assert((socket_path is None) != (port is None)), "need one of socket_path or port"
+        if socket_path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(socket_path)
+        else:
+            self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile('r')
+
+    def request(self, **request):
+        self.sock.sendall(json.dumps(request) + "\n")
+        line = self.reader.readline()
+        assert(line != ''), "the server closed the connection"
+        response = json.loads(line)
+        if response["ok"] is not True:
+            raise RuntimeError(response["error"])
+        return response
+
+    def predict_proba(self, model, vectors):
+        """Class probabilities for a list of feature vectors (or a 2D array)
+        """
+        if hasattr(vectors, "tolist"):
+            vectors = vectors.tolist()
+        return self.request(op="predict", model=model, vectors=vectors)["probs"]
+
+    def score_file(self, model, alignment_file):
+        """Probabilities for each motif start of the model's site in an alignment file, returns the motif starts
+        that had events and their probabilities
+        """
+        response = self.request(op="score_file", model=model, file=alignment_file)
+        return response["motif_starts"], response["probs"]
+
+    def models(self):
+        return self.request(op="models")["models"]
+
+    def stats(self):
+        return self.request(op="stats")["stats"]
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
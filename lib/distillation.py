@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Distill a large site model into a small, fast student network trained on the teacher's probabilities
+"""
+from __future__ import print_function
+import sys
+import numpy as np
+from neural_network import predict, load_network
+from normalization import Normalizer
+from optimization import mini_batch_sgd
+from inference import NumpyPredictor, load_model_dict, accuracy, throughput
+
+
+def teacher_probabilities(teacher, data, batch_size):
+    """Class probabilities from predict for each vector in data. predict drops the last partial batch, so the
+    probabilities are for data[:len(probs)]
+    """
+    _, probs = predict(test_data=data, true_labels=np.zeros(len(data), dtype=np.int32), batch_size=batch_size,
+                       model=teacher)
+    return np.asarray(probs)
+
+
+def distill(teacher_model_file, unlabeled_data, xtrain_data, xtrain_targets,
+            student_type, student_hidden_dim, learning_rate, epochs, batch_size,
+            L1_reg=0.0, L2_reg=0.0, trained_model_dir=None, teacher_type=None, extra_args=None, verbose=True):
+    """Train a student network with mini_batch_sgd on the teacher's probabilities for the unlabeled vectors, the
+    labeled cross-train set is used to pick the best student. The student gets the teacher's normalization, so both
+    take the same raw vectors. Returns the student network and the training summary
+    """
+    teacher = load_network(teacher_model_file, model_type=teacher_type, extra_args=extra_args)
+    normalizer = Normalizer.from_dict(teacher.normalization)
+    soft_targets = teacher_probabilities(teacher, unlabeled_data, batch_size)
+    train_data = normalizer.transform(unlabeled_data[:len(soft_targets)])
+    print("distilling {0} into a {1} {2} with {3} unlabeled vectors".format(
+        teacher_model_file, student_type, student_hidden_dim, len(train_data)), file=sys.stderr)
+
+    return mini_batch_sgd(motif="distill", train_data=train_data,
+                          labels=np.argmax(soft_targets, axis=1).astype(np.int32),
+                          xTrain_data=normalizer.transform(xtrain_data), xTrain_targets=xtrain_targets,
+                          learning_rate=learning_rate, L1_reg=L1_reg, L2_reg=L2_reg, epochs=epochs,
+                          batch_size=batch_size, hidden_dim=student_hidden_dim, model_type=student_type,
+                          model_file=None, trained_model_dir=trained_model_dir, verbose=verbose,
+                          soft_targets=soft_targets, normalization=teacher.normalization)
+
+
+def distillation_report(teacher_model_file, student_model_file, test_data, labels, batch_size=10000):
+    """Compare the teacher and student on labeled held-out data, returns a dict with the accuracy of each, how
+    often they agree, their samples/sec (NumPy inference) and parameter sizes
+    """
+    teacher = NumpyPredictor(load_model_dict(teacher_model_file))
+    student = NumpyPredictor(load_model_dict(student_model_file))
+    teacher_throughput = throughput(teacher, test_data, batch_size)
+    student_throughput = throughput(student, test_data, batch_size)
+    return {
+        "teacher_accuracy": accuracy(teacher, test_data, labels, batch_size),
+        "student_accuracy": accuracy(student, test_data, labels, batch_size),
+        "agreement": np.mean(teacher.predict(test_data) == student.predict(test_data)),
+        "teacher_samples_per_sec": teacher_throughput,
+        "student_samples_per_sec": student_throughput,
+        "speedup": student_throughput / teacher_throughput,
+        "teacher_bytes": teacher.nbytes(),
+        "student_bytes": student.nbytes(),
+    }
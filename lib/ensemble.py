@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Score data with all of a site's per-iteration best models at once
+"""
+from __future__ import print_function
+import os
+import glob
+import cPickle
+import numpy as np
+from itertools import izip
+from inference import HIDDEN_ACTIVATIONS, model_layers, load_model_dict, softmax
+from normalization import model_normalizer
+
+
+def site_model_files(out_path, title):
+    """Best model file of each classify_with_network3 iteration for a site, in iteration order. Like
+    find_model_path, the directory in the summary's best_model path is disregarded so that moved output
+    directories still work
+    """
+    summaries = glob.glob("{outpath}/{title}_Models/*/summary_stats.pkl".format(outpath=out_path, title=title))
+    iterations = sorted((int(os.path.basename(os.path.dirname(s))), s) for s in summaries
+                        if os.path.basename(os.path.dirname(s)).isdigit())
+    model_files = []
+    for _, summary_file in iterations:
+        summary = cPickle.load(open(summary_file, 'r'))
+        if summary.get('best_model', '') == '':
+            continue
+        model_files.append(os.path.join(os.path.dirname(summary_file), os.path.basename(summary['best_model'])))
+    assert(len(model_files) > 0), "didn't find any models for {0} in {1}".format(title, out_path)
+    return model_files
+
+
+def fold_normalization(model, weights, biases):
+    """First layer weights and biases that take the raw vectors, with the model's normalization folded in:
+    ((x - mean) / std) . W = x . (W / std) - (mean / std) . W. A NaN input is 0 after the normalization, so with the
+    folded weights it needs (mean / std) * W added back, that's the third thing returned (None when it's all zeros)
+    """
+    normalizer = model_normalizer(model)
+    if normalizer.mean is None:
+        return weights, biases, None
+    scale, shift = np.ones(len(weights)), np.zeros(len(weights))
+    nb_features = len(normalizer.mean)
+    if normalizer.std is not None:
+        scale[:nb_features] = 1.0 / normalizer.std
+    shift[:nb_features] = normalizer.mean * scale[:nb_features]
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights * scale[:, None], biases - np.dot(shift, weights), shift[:, None] * weights
+
+
+class EnsemblePredictor(object):
+    """Runs K models with the same architecture as one batched network. The first layers of all the models are
+    concatenated into one (in_dim, K * hidden) matrix so the input is only multiplied once, then each model's block
+    of columns goes through the rest of its layers with np.dot, one model at a time (the later layers are kept
+    stacked as (K, n_in, n_out) and (K, n_out) arrays). Each model's normalization is folded into its block of the
+    first layer, so the models don't need the same statistics
+    """
+    def __init__(self, models, dtype=np.float32):
+        assert(len(models) > 0), "need at least one model"
+        for model in models[1:]:
+            assert(model['model'] == models[0]['model'] and model['in_dim'] == models[0]['in_dim'] and
+                   model['hidden_dim'] == models[0]['hidden_dim'] and
+                   model['n_classes'] == models[0]['n_classes']), "all the models need the same architecture"
+        self.nb_models = len(models)
+        self.in_dim = models[0]['in_dim']
+        self.n_classes = models[0]['n_classes']
+        self.dtype = dtype
+        self.activations = HIDDEN_ACTIVATIONS[models[0]['model']]
+
+        layers = [model_layers(model) for model in models]  # [model][layer] -> (weights, biases)
+        first_layers = [fold_normalization(model, *model_layer[0]) for model, model_layer in izip(models, layers)]
+        self.first_width = first_layers[0][0].shape[1]
+        self.first_weights = np.hstack([np.asarray(w, dtype=dtype) for w, _, _ in first_layers])
+        self.first_biases = np.concatenate([np.asarray(b, dtype=dtype) for _, b, _ in first_layers])
+        # what a NaN input adds back to each block, None if none of the models are normalized
+        self.nan_weights = None
+        if any(nan_weights is not None for _, _, nan_weights in first_layers):
+            self.nan_weights = np.hstack([np.zeros_like(w) if nan_weights is None else nan_weights
+                                          for w, _, nan_weights in first_layers]).astype(dtype)
+        # the later layers are (K, n_in, n_out) and (K, n_out)
+        self.weights = [np.stack([np.asarray(model_layer[i][0], dtype=dtype) for model_layer in layers])
+                        for i in xrange(1, len(layers[0]))]
+        self.biases = [np.stack([np.asarray(model_layer[i][1], dtype=dtype) for model_layer in layers])
+                       for i in xrange(1, len(layers[0]))]
+
+    @classmethod
+    def from_files(cls, model_files, dtype=np.float32):
+        return cls([load_model_dict(f) for f in model_files], dtype=dtype)
+
+    def predict_all(self, x):
+        """Probabilities from every model, shape (K, n, n_classes)
+        """
+        x = np.asarray(x, dtype=self.dtype)
+        missing = np.isnan(x) if self.nan_weights is not None else None
+        z = np.dot(np.nan_to_num(x), self.first_weights)
+        z += self.first_biases
+        if missing is not None and missing.any():
+            z += np.dot(missing.astype(self.dtype), self.nan_weights)
+        # each model's block of columns is a strided view BLAS can use directly, np.matmul over a (K, n, h) stack
+        # doesn't go through BLAS with our numpy
+        z = self.activations[0](z)
+        blocks = [z[:, k * self.first_width:(k + 1) * self.first_width] for k in xrange(self.nb_models)]
+        for i, (weights, biases) in enumerate(izip(self.weights, self.biases)):
+            blocks = [np.dot(block, weights[k]) + biases[k] for k, block in enumerate(blocks)]
+            if i + 1 < len(self.activations):
+                blocks = [self.activations[i + 1](block) for block in blocks]
+        return softmax(np.stack(blocks))
+
+    def predict_proba(self, x):
+        return self.predict_all(x).mean(axis=0)
+
+    def predict(self, x):
+        return np.argmax(self.predict_proba(x), axis=1)
+
+    def score(self, x):
+        """Returns the averaged probabilities, the fraction of models whose call disagrees with the ensemble's call
+        and the standard deviation of each class probability across the models
+        """
+        all_probs = self.predict_all(x)
+        mean_probs = all_probs.mean(axis=0)
+        calls = np.argmax(mean_probs, axis=1)
+        disagreement = np.mean(np.argmax(all_probs, axis=2) != calls[None, :], axis=0)
+        return mean_probs, disagreement, all_probs.std(axis=0)
+
+    def nbytes(self):
+        nan_bytes = self.nan_weights.nbytes if self.nan_weights is not None else 0
+        return self.first_weights.nbytes + self.first_biases.nbytes + nan_bytes + \
+               sum(w.nbytes for w in self.weights) + sum(b.nbytes for b in self.biases)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""Task queue in a directory on a shared filesystem (eg. NFS), for running the sites of a run_nn job on several
+nodes without a message broker. Every state change is a rename, which is atomic, so only one worker can claim a
+task:
+
+    pending/  tasks waiting for a worker, named {priority}.{attempt}.{leases_lost}.{task_id}, the lowest priority is
+              claimed first
+    claimed/  tasks a worker is running, the file's modification time is its lease, the worker renews it while the
+              task runs. A task whose lease ran out (its worker died or lost the mount) is put back in pending/ with
+              leases_lost counted up, that doesn't use up one of its max_attempts
+    done/     finished tasks and their results ({task_id}.json)
+    failed/   tasks that raised max_attempts times or lost max_leases_lost leases, and their errors
+
+A worker renames its task into done/ or failed/ before it writes the record, so a worker that lost its lease can't
+leave one behind. Until the record is there the task is still in progress, and it keeps the lease it had when it
+was claimed (the rename doesn't change the modification time).
+
+Leases are measured against the file server's clock (see fs_time), so clock skew between nodes doesn't matter.
+Each claim of a task has a different file name, so a worker whose lease ran out can't move or record a task
+that another worker has claimed since: its renames fail and its results are dropped
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import json
+import errno
+import socket
+import cPickle
+import tempfile
+import traceback
+from multiprocessing import Process, Pipe
+
+STATES = ["pending", "claimed", "done", "failed"]
+# the lease time and attempts are set by the coordinator, the workers read them from here
+SETTINGS_FILE = "queue.json"
+DEFAULT_SETTINGS = {"lease_seconds": 600.0, "max_attempts": 3, "max_leases_lost": 3}
+
+
+def task_file_name(priority, attempt, leases_lost, task_id):
+    return "{0:06d}.{1}.{2}.{3}".format(priority, attempt, leases_lost, task_id)
+
+
+def parse_task_file_name(name):
+    # (priority, attempt, leases_lost, task_id)
+    priority, attempt, leases_lost, task_id = name.split(".", 3)
+    return int(priority), int(attempt), int(leases_lost), task_id
+
+
+def worker_name():
+    return "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+
+class TaskQueue(object):
+    def __init__(self, path, lease_seconds=None, max_attempts=None, max_leases_lost=None):
+        # the settings that are given are written to the queue's settings, the rest are read from it
+        self.path = path
+        for state in STATES + ["tmp"]:
+            directory = os.path.join(path, state)
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                # another node made it
+                if e.errno != errno.EEXIST:
+                    raise
+        settings_file = os.path.join(path, SETTINGS_FILE)
+        settings = dict(DEFAULT_SETTINGS)
+        if os.path.exists(settings_file):
+            settings.update(json.load(open(settings_file)))
+        given = [(k, v) for k, v in [("lease_seconds", lease_seconds), ("max_attempts", max_attempts),
+                                     ("max_leases_lost", max_leases_lost)] if v is not None]
+        if len(given) > 0:
+            settings.update(given)
+            self.write_atomic(settings_file, json.dumps(settings, sort_keys=True))
+        self.lease_seconds = settings["lease_seconds"]
+        self.max_attempts = settings["max_attempts"]
+        self.max_leases_lost = settings["max_leases_lost"]
+
+    def state_path(self, state, name=""):
+        return os.path.join(self.path, state, name)
+
+    def task_files(self, state):
+        return sorted(f for f in os.listdir(self.state_path(state)) if not f.startswith("."))
+
+    def write_atomic(self, path, data):
+        # written in tmp/ and renamed, so a reader never sees part of the file
+        fd, tmp = tempfile.mkstemp(dir=self.state_path("tmp"))
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.rename(tmp, path)
+
+    def fs_time(self):
+        """The file server's time, from the modification time of a file this worker touches in tmp/. Leases are
+        compared with this and not time.time(), the nodes' clocks can be off from the server's and each other's
+        """
+        clock = self.state_path("tmp", "clock." + worker_name())
+        with open(clock, 'a'):
+            os.utime(clock, None)
+        return os.stat(clock).st_mtime
+
+    def task_ids(self, state):
+        if state in ["done", "failed"]:
+            return set(f[:-len(".json")] for f in self.task_files(state) if f.endswith(".json"))
+        return set(parse_task_file_name(f)[3] for f in self.task_files(state))
+
+    def unrecorded(self, state):
+        # task files in done/ or failed/ whose worker hasn't written the record yet
+        recorded = self.task_ids(state)
+        return [f for f in self.task_files(state) if not f.endswith(".json") and
+                parse_task_file_name(f)[3] not in recorded]
+
+    def remove_record(self, state, task_id):
+        for name in self.task_files(state):
+            if name == task_id + ".json" or (not name.endswith(".json") and parse_task_file_name(name)[3] == task_id):
+                try:
+                    os.remove(self.state_path(state, name))
+                except OSError:
+                    pass
+
+    def put(self, task_id, task, priority=0, replace=False):
+        """Queue a task (anything that pickles), unless a task with the same id is already queued or done (with
+        replace, a done task is queued again). A task that failed is queued again. Returns whether it was queued
+        """
+        assert("/" not in task_id), "task ids are used as file names"
+        for state in ["done", "failed"] if replace else ["failed"]:
+            self.remove_record(state, task_id)
+        if any(task_id in self.task_ids(state) for state in ["pending", "claimed", "done"]):
+            return False
+        self.write_atomic(self.state_path("pending", task_file_name(priority, 0, 0, task_id)),
+                          cPickle.dumps(task, cPickle.HIGHEST_PROTOCOL))
+        return True
+
+    def claim(self):
+        """(claimed file, task_id, attempt, task) for the first pending task this worker gets, or None. The
+        claimed file is what renew, complete and fail take
+        """
+        for name in self.task_files("pending"):
+            pending, claimed = self.state_path("pending", name), self.state_path("claimed", name)
+            try:
+                # the modification time is the lease, so it's renewed before the rename makes it visible
+                os.utime(pending, None)
+                os.rename(pending, claimed)
+            except OSError:
+                # another worker got it first
+                continue
+            _, attempt, _, task_id = parse_task_file_name(name)
+            with open(claimed, 'r') as f:
+                return claimed, task_id, attempt, cPickle.load(f)
+        return None
+
+    def renew(self, claimed):
+        # False if the lease was lost, the task has been put back in pending/
+        try:
+            os.utime(claimed, None)
+            return True
+        except OSError:
+            return False
+
+    def move(self, claimed, state, name):
+        # False if the lease was lost, then the task isn't this worker's to move
+        try:
+            os.rename(claimed, self.state_path(state, name))
+            return True
+        except OSError:
+            return False
+
+    def record(self, state, task_id, record):
+        self.write_atomic(self.state_path(state, task_id + ".json"), json.dumps(record, sort_keys=True, default=str))
+
+    def complete(self, claimed, task_id, result):
+        """Move the task to done/ and write its result, unless the lease was lost (the result is dropped, whoever
+        has the task now will write theirs). Returns whether it was recorded
+        """
+        if not self.move(claimed, "done", os.path.basename(claimed)):
+            return False
+        self.record("done", task_id, result)
+        return True
+
+    def fail(self, claimed, task_id, error):
+        """Put the task back in pending/ for another attempt, or in failed/ after max_attempts. Returns the state it
+        went to, or None if the lease was lost
+        """
+        priority, attempt, leases_lost, _ = parse_task_file_name(os.path.basename(claimed))
+        if attempt + 1 < self.max_attempts:
+            return "pending" if self.move(claimed, "pending", task_file_name(priority, attempt + 1, leases_lost,
+                                                                              task_id)) else None
+        if not self.move(claimed, "failed", os.path.basename(claimed)):
+            return None
+        self.record("failed", task_id, {"error": error, "attempts": attempt + 1, "leases_lost": leases_lost,
+                                        "worker": worker_name()})
+        return "failed"
+
+    def requeue_expired(self, now=None):
+        """Put the claimed tasks whose leases have run out back in pending/ (or in failed/ after max_leases_lost),
+        with the tasks moved to done/ or failed/ by a worker that died before writing the record. Lost leases don't
+        count as attempts. now is in the file server's time (default fs_time()). Returns their ids
+        """
+        now = self.fs_time() if now is None else now
+        requeued = []
+        in_progress = [("claimed", name) for name in self.task_files("claimed")] + \
+            [(state, name) for state in ["done", "failed"] for name in self.unrecorded(state)]
+        for state, name in in_progress:
+            claimed = self.state_path(state, name)
+            try:
+                expired = os.stat(claimed).st_mtime + self.lease_seconds < now
+            except OSError:
+                continue
+            if not expired:
+                continue
+            priority, attempt, leases_lost, task_id = parse_task_file_name(name)
+            if leases_lost + 1 < self.max_leases_lost:
+                moved = self.move(claimed, "pending", task_file_name(priority, attempt, leases_lost + 1, task_id))
+            else:
+                moved = self.move(claimed, "failed", name)
+                if moved:
+                    self.record("failed", task_id, {"error": "lease expired", "attempts": attempt + 1,
+                                                    "leases_lost": leases_lost + 1, "worker": None})
+            if moved:
+                requeued.append(task_id)
+        return requeued
+
+    def counts(self):
+        return dict((state, len(self.task_ids(state))) for state in STATES)
+
+    def drained(self):
+        counts = self.counts()
+        return counts["pending"] == 0 and counts["claimed"] == 0 and \
+            len(self.unrecorded("done")) == 0 and len(self.unrecorded("failed")) == 0
+
+    def results(self):
+        """{task_id: (state, result or error record)} for the finished and failed tasks
+        """
+        results = {}
+        for state in ["done", "failed"]:
+            for task_id in self.task_ids(state):
+                with open(self.state_path(state, task_id + ".json"), 'r') as f:
+                    results[task_id] = (state, json.load(f))
+        return results
+
+
+def task_process(run_task, task, connection):
+    try:
+        connection.send(("done", run_task(task)))
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def run_claimed(queue, claimed_file, run_task, task):
+    """Run a claimed task in a child process, renewing its lease every quarter of the lease time. If the lease is
+    lost the child is killed, so it doesn't write outputs that the worker that has the task now is writing too.
+    Returns ("done", result), ("error", traceback) or ("lost", None)
+    """
+    receiver, sender = Pipe(duplex=False)
+    process = Process(target=task_process, args=(run_task, task, sender))
+    process.start()
+    sender.close()
+    while True:
+        if receiver.poll(queue.lease_seconds / 4.0):
+            try:
+                outcome = receiver.recv()
+            except EOFError:
+                outcome = None
+            process.join()
+            if outcome is None:
+                return "error", "task process exited with code {}".format(process.exitcode)
+            return outcome
+        if not process.is_alive() and not receiver.poll():
+            process.join()
+            return "error", "task process exited with code {}".format(process.exitcode)
+        if not queue.renew(claimed_file):
+            process.terminate()
+            process.join()
+            return "lost", None
+
+
+def run_worker(queue, run_task, poll_seconds=5.0, wait=True):
+    """Claim and run tasks until the queue is drained (or, without wait, until there's nothing pending). run_task
+    is called with each task (in a child process) and returns a JSON-able result. Returns the number of tasks this
+    worker ran
+    """
+    nb_run = 0
+    while True:
+        queue.requeue_expired()
+        claimed = queue.claim()
+        if claimed is None:
+            if not wait or queue.drained():
+                return nb_run
+            time.sleep(poll_seconds)
+            continue
+        claimed_file, task_id, attempt, task = claimed
+        start = time.time()
+        status, value = run_claimed(queue, claimed_file, run_task, task)
+        if status == "done":
+            leases_lost = parse_task_file_name(os.path.basename(claimed_file))[2]
+            recorded = queue.complete(claimed_file, task_id, {"result": value, "seconds": time.time() - start,
+                                                              "attempt": attempt + 1, "leases_lost": leases_lost,
+                                                              "worker": worker_name()})
+        elif status == "error":
+            print("{0} failed on attempt {1}:\n{2}".format(task_id, attempt + 1, value), file=sys.stderr)
+            recorded = queue.fail(claimed_file, task_id, value) is not None
+        else:
+            recorded = False
+        if not recorded:
+            print("{}: lost the lease, another worker has it now".format(task_id), file=sys.stderr)
+        nb_run += 1
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""Incremental updates of a site's model as new alignment files arrive, without retraining from scratch
+
+The state for a site is kept in {out_path}/{title}_Models/incremental/state.pkl: the alignment files that have been
+used, a replay buffer of older training vectors and the held-out test split of the model that was started from.
+Each update trains on the vectors from the new files mixed with a sample from the replay buffer, continuing from the
+current model, and writes the new version to {title}_Models/incremental/v{version}/
+"""
+from __future__ import print_function
+import os
+import sys
+import cPickle
+import numpy as np
+from itertools import izip
+from utils import shuffle_and_maintain_labels
+from normalization import model_normalizer
+from optimization import mini_batch_sgd
+from inference import NumpyPredictor, load_model_dict, accuracy
+from scoring import read_vectors, alignment_files
+from ensemble import site_model_files
+
+
+class ReplayBuffer(object):
+    """Reservoir sample of up to capacity training vectors for each class, every vector added so far has the same
+    chance of being in the buffer. The buffer is kept in a dict so it can be pickled with the rest of the state
+    """
+    def __init__(self, state):
+        self.state = state
+
+    @classmethod
+    def empty(cls, capacity):
+        return cls({"capacity": capacity, "vectors": {}, "seen": {}})
+
+    def add(self, vectors, labels):
+        capacity = self.state["capacity"]
+        for label in np.unique(labels):
+            kept = list(self.state["vectors"].get(int(label), []))
+            seen = self.state["seen"].get(int(label), 0)
+            for vector in np.asarray(vectors)[labels == label]:
+                seen += 1
+                # once the buffer is full each vector replaces a random one with probability capacity / seen
+                if len(kept) < capacity:
+                    kept.append(vector)
+                else:
+                    j = np.random.randint(seen)
+                    if j < capacity:
+                        kept[j] = vector
+            self.state["vectors"][int(label)] = np.asarray(kept)
+            self.state["seen"][int(label)] = seen
+
+    def sample(self, n_per_class, dim=0):
+        """Up to n_per_class vectors of each class, without replacement. An empty buffer gives a (0, dim) array
+        """
+        vectors, labels = [], []
+        for label, kept in self.state["vectors"].items():
+            if len(kept) == 0:
+                continue
+            take = np.random.permutation(len(kept))[:n_per_class]
+            vectors.append(kept[take])
+            labels.append(np.full(len(take), label, dtype=np.int32))
+        if len(vectors) == 0:
+            return np.empty((0, dim)), np.empty(0, dtype=np.int32)
+        return np.vstack(vectors), np.concatenate(labels)
+
+    def __len__(self):
+        return sum(len(kept) for kept in self.state["vectors"].values())
+
+
+def checkpoint(out_path, title):
+    """Iteration directory and best model of the classify_with_network3 (or 2) iteration with the best cross-train
+    accuracy for a site
+    """
+    best_accuracy, best = -np.inf, None
+    for model_file in site_model_files(out_path, title):
+        summary = cPickle.load(open(os.path.join(os.path.dirname(model_file), "summary_stats.pkl"), 'r'))
+        if max(summary['xtrain_accuracies']) > best_accuracy:
+            best_accuracy, best = max(summary['xtrain_accuracies']), model_file
+    return os.path.dirname(best), best
+
+
+def group_vectors(files, motif_starts, label, title, events_per_pos, strand, feature_set=None, keep=None):
+    """Vectors and labels for the motif starts in files, like collect_data_vectors2 without the split. keep is an
+    optional function of (file, motif_start) to select vectors
+    """
+    vectors = []
+    for tsv in files:
+        _, site_vectors = read_vectors(tsv, [(title, motif_starts)], events_per_pos, strand, feature_set=feature_set)
+        if not site_vectors:
+            continue
+        _, starts, file_vectors = site_vectors[0]
+        vectors += [v for start, v in izip(starts, file_vectors) if keep is None or keep(tsv, start)]
+    return np.asarray(vectors), np.full(len(vectors), label, dtype=np.int32)
+
+
+def test_rows(iteration_dir):
+    """(label, read, motif_start) of each test vector of a classify iteration, from its test_provenance.pkl and
+    test_probs.pkl
+    """
+    provenance = cPickle.load(open(os.path.join(iteration_dir, "test_provenance.pkl"), 'r'))
+    targets = [target for _, target in cPickle.load(open(os.path.join(iteration_dir, "test_probs.pkl"), 'r'))]
+    return set((target, read, start) for (read, start), target in izip(provenance, targets))
+
+
+def held_out_split(iteration_dir, groups, motif_start_positions, title, events_per_pos, strand, feature_set=None):
+    """Rebuild the test vectors of a classify iteration, the reads are looked up by name in the group of their label
+    """
+    rows = test_rows(iteration_dir)
+    vectors, labels = [], []
+    for label, group in enumerate(groups):
+        reads = set(read for target, read, _ in rows if target == label)
+        files = [f for f in alignment_files(group) if os.path.basename(f) in reads]
+        group_set = group_vectors(files, motif_start_positions[label], label, title, events_per_pos, strand,
+                                  feature_set=feature_set,
+                                  keep=lambda f, s: (label, os.path.basename(f), s) in rows)
+        vectors.append(group_set[0])
+        labels.append(group_set[1])
+    vectors = [v for v in vectors if len(v) > 0]
+    assert(len(vectors) > 0), "couldn't rebuild the test split from {}".format(iteration_dir)
+    return np.vstack(vectors), np.concatenate(labels)
+
+
+def state_path(out_path, title):
+    return "{outpath}/{title}_Models/incremental/state.pkl".format(outpath=out_path, title=title)
+
+
+def load_state(out_path, title):
+    path = state_path(out_path, title)
+    return cPickle.load(open(path, 'r')) if os.path.exists(path) else None
+
+
+def write_state(state, out_path, title):
+    # write then rename so an interrupted update leaves the last state
+    path = state_path(out_path, title)
+    with open(path + ".tmp", 'w') as f:
+        cPickle.dump(state, f, protocol=cPickle.HIGHEST_PROTOCOL)
+    os.rename(path + ".tmp", path)
+
+
+def start_state(groups, motif_start_positions, title, events_per_pos, strand, feature_set, out_path, replay_size):
+    """State for a site's first update, from the best classify iteration in out_path. The files that are already
+    there are taken to be the ones the model was trained on, a sample of them (without the test vectors) goes in the
+    replay buffer
+    """
+    iteration_dir, model_file = checkpoint(out_path, title)
+    test_vectors, test_labels = held_out_split(iteration_dir, groups, motif_start_positions, title, events_per_pos,
+                                               strand, feature_set=feature_set)
+    rows = test_rows(iteration_dir)
+    replay = ReplayBuffer.empty(replay_size)
+    seen = set()
+    for label, group in enumerate(groups):
+        files = alignment_files(group)
+        seen.update(files)
+        np.random.shuffle(files)
+        # each file that covers the site gives at least one vector, so this many files can fill the buffer
+        vectors, labels = group_vectors(files[:replay_size], motif_start_positions[label], label, title,
+                                        events_per_pos, strand, feature_set=feature_set,
+                                        keep=lambda f, s: (label, os.path.basename(f), s) not in rows)
+        if len(vectors) > 0:
+            replay.add(vectors, labels)
+    test_accuracy = accuracy(NumpyPredictor(load_model_dict(model_file)), test_vectors, test_labels)
+    if not os.path.exists(os.path.dirname(state_path(out_path, title))):
+        os.makedirs(os.path.dirname(state_path(out_path, title)))
+    return {
+        "title": title,
+        "seen": seen,
+        "replay": replay.state,
+        "test_vectors": test_vectors,
+        "test_labels": test_labels,
+        "model": model_file,
+        "versions": [{"version": 0, "model": model_file, "new_files": 0, "new_vectors": 0,
+                      "test_accuracy": test_accuracy}],
+    }
+
+
+def update_site(groups, motif_start_positions, title, strand, events_per_pos, feature_set, out_path,
+                learning_rate, L1_reg, L2_reg, epochs, batch_size, hidden_dim, model_type, extra_args=None,
+                replay_size=5000, replay_ratio=1.0, xtrain_portion=0.1):
+    """Train a new version of a site's model on the files in groups (globs, one for each label) that haven't been
+    used yet. The new vectors are mixed with replay_ratio times as many vectors from the replay buffer, leveled
+    across the labels like classify does, and training continues from the current version. The vectors are
+    normalized with the statistics in the first version's model file, so every version gets the same inputs.
+    Returns the record of the new version, or None if there weren't enough new vectors
+    """
+    state = load_state(out_path, title)
+    if state is None:
+        print("{}: starting incremental updates from the best classify iteration".format(title), file=sys.stderr)
+        state = start_state(groups, motif_start_positions, title, events_per_pos, strand, feature_set, out_path,
+                            replay_size)
+        write_state(state, out_path, title)
+    replay = ReplayBuffer(state["replay"])
+
+    new_files = [[f for f in alignment_files(group) if f not in state["seen"]] for group in groups]
+    new_sets = [group_vectors(files, motif_start_positions[label], label, title, events_per_pos, strand,
+                              feature_set=feature_set) for label, files in enumerate(new_files)]
+    new_sets = [(v, l) for v, l in new_sets if len(v) > 0]
+    nb_new_files = sum(len(files) for files in new_files)
+    nb_new = sum(len(v) for v, _ in new_sets)
+    print("{0}: {1} new files with {2} vectors, {3} vectors in the replay buffer".format(title, nb_new_files, nb_new,
+                                                                                      len(replay)), file=sys.stderr)
+    if nb_new < 2 * batch_size:
+        print("{}: not enough new vectors for an update".format(title), file=sys.stderr)
+        return None
+    new_vectors = np.vstack([v for v, _ in new_sets])
+    new_labels = np.concatenate([l for _, l in new_sets])
+
+    # new vectors and a replay sample, leveled so each label gets the same exposure
+    replay_vectors, replay_labels = replay.sample(max(1, int(replay_ratio * nb_new / len(groups))),
+                                                  dim=new_vectors.shape[1])
+    vectors = np.vstack((new_vectors, replay_vectors))
+    labels = np.concatenate((new_labels, replay_labels))
+    level = min(np.sum(labels == label) for label in xrange(len(groups)))
+    assert(level > 0), "{} doesn't have vectors for all of the labels".format(title)
+    leveled = np.concatenate([np.random.permutation(np.flatnonzero(labels == label))[:level]
+                              for label in xrange(len(groups))])
+    X, y = shuffle_and_maintain_labels(vectors[leveled], labels[leveled])
+    nb_xtrain = max(batch_size, int(xtrain_portion * len(X)))
+    normalizer = model_normalizer(load_model_dict(state["model"]))
+    train, xtrain = normalizer.transform(X[nb_xtrain:]), normalizer.transform(X[:nb_xtrain])
+
+    version = state["versions"][-1]["version"] + 1
+    version_dir = "{outpath}/{title}_Models/incremental/v{version}/".format(outpath=out_path, title=title,
+                                                                           version=version)
+    net, summary = mini_batch_sgd(motif=title, train_data=train, labels=y[nb_xtrain:], xTrain_data=xtrain,
+                                  xTrain_targets=y[:nb_xtrain], learning_rate=learning_rate, L1_reg=L1_reg,
+                                  L2_reg=L2_reg, epochs=epochs, batch_size=batch_size, hidden_dim=hidden_dim,
+                                  model_type=model_type, model_file=state["model"], trained_model_dir=version_dir,
+                                  extra_args=extra_args)
+    test_accuracy = accuracy(NumpyPredictor(load_model_dict(summary['best_model'])), state["test_vectors"],
+                             state["test_labels"])
+    record = {"version": version, "model": summary['best_model'], "new_files": nb_new_files, "new_vectors": nb_new,
+              "test_accuracy": test_accuracy}
+    print("{0}: version {1} test accuracy {2} (was {3})".format(title, version, test_accuracy,
+                                                                state["versions"][-1]["test_accuracy"]),
+          file=sys.stderr)
+
+    replay.add(new_vectors, new_labels)
+    for files in new_files:
+        state["seen"].update(files)
+    state["model"] = summary['best_model']
+    state["versions"].append(record)
+    write_state(state, out_path, title)
+    return record
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""NumPy forward passes for saved models, so trained networks can be run without building a Theano graph
+"""
+from __future__ import print_function
+import time
+import cPickle
+import numpy as np
+from itertools import izip
+from normalization import model_normalizer
+from model import NeuralNetwork, ThreeLayerNetwork, ReLUThreeLayerNetwork, FourLayerNetwork, FourLayerReLUNetwork
+
+
+def _tanh(x):
+    return np.tanh(x, out=x)
+
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+# model_type for each model class, as used by get_network
+MODEL_TYPES = {
+    NeuralNetwork: "twoLayer",
+    ThreeLayerNetwork: "threeLayer",
+    ReLUThreeLayerNetwork: "ReLUthreeLayer",
+    FourLayerNetwork: "fourLayer",
+    FourLayerReLUNetwork: "ReLUfourLayer",
+}
+
+# activation of each hidden layer of the feed-forward models, in layer order
+HIDDEN_ACTIVATIONS = {
+    NeuralNetwork: [_tanh],
+    ThreeLayerNetwork: [_tanh, _tanh],
+    ReLUThreeLayerNetwork: [_relu, _tanh],
+    FourLayerNetwork: [_tanh, _tanh, _tanh],
+    FourLayerReLUNetwork: [_relu, _tanh, _tanh],
+}
+
+
+def load_model_dict(model_file):
+    """Load the dict written by Model.write
+    """
+    with open(model_file, 'r') as f:
+        return cPickle.load(f)
+
+
+def layer_ids(model):
+    """Get the layer ids of a model dict, hidden layers first (in order) then the softmax layer
+    """
+    assert(model['model'] in HIDDEN_ACTIVATIONS), "{} can't be run with NumPy".format(model['model'].__name__)
+    weight_keys = [k for k in model.keys() if isinstance(k, str) and k.endswith('weights')]
+    hidden_ids = sorted(k[:-len('weights')] for k in weight_keys if k.startswith('h'))
+    softmax_ids = [k[:-len('weights')] for k in weight_keys if k.startswith('s')]
+    assert(len(hidden_ids) == len(HIDDEN_ACTIVATIONS[model['model']]) and len(softmax_ids) == 1), \
+        "unexpected layers in model file {}".format(weight_keys)
+    return hidden_ids + softmax_ids
+
+
+def model_layers(model):
+    """Get the (weights, biases) of each layer of a model dict, hidden layers first (in order) then the softmax
+    layer. Only the feed-forward models are supported
+    """
+    return [(model[layer_id + 'weights'], model[layer_id + 'biases']) for layer_id in layer_ids(model)]
+
+
+def softmax(z):
+    # in place, stable softmax over the last axis of z
+    z -= np.max(z, axis=-1, keepdims=True)
+    np.exp(z, out=z)
+    z /= np.sum(z, axis=-1, keepdims=True)
+    return z
+
+
+class NumpyPredictor(object):
+    """Forward pass of a feed-forward model dict with NumPy
+    """
+    def __init__(self, model, dtype=np.float32):
+        self.in_dim = model['in_dim']
+        self.n_classes = model['n_classes']
+        self.dtype = dtype
+        layers = model_layers(model)
+        self.weights = [np.asarray(w, dtype=dtype) for w, _ in layers]
+        self.biases = [np.asarray(b, dtype=dtype) for _, b in layers]
+        self.activations = HIDDEN_ACTIVATIONS[model['model']]
+        self.normalizer = model_normalizer(model)
+
+    def predict_proba(self, x):
+        activation = self.normalizer.transform(x, dtype=self.dtype)
+        assert(activation.shape[1] == self.in_dim), "data has {0} features, model expects {1}".format(
+            activation.shape[1], self.in_dim)
+        for weights, biases, f in izip(self.weights[:-1], self.biases[:-1], self.activations):
+            z = np.dot(activation, weights)
+            z += biases
+            activation = f(z)
+        z = np.dot(activation, self.weights[-1])
+        z += self.biases[-1]
+        return softmax(z)
+
+    def predict(self, x):
+        return np.argmax(self.predict_proba(x), axis=1)
+
+    def nbytes(self):
+        return sum(w.nbytes for w in self.weights) + sum(b.nbytes for b in self.biases)
+
+
+def accuracy(predictor, data, labels, batch_size=10000):
+    calls = np.concatenate([predictor.predict(data[k:k + batch_size]) for k in xrange(0, len(data), batch_size)])
+    return np.mean(calls == np.asarray(labels))
+
+
+def throughput(predictor, data, batch_size=10000, repeats=3):
+    """Best samples/sec over a few passes of data through predictor.predict_proba in batches of batch_size
+    """
+    best = np.inf
+    for _ in xrange(repeats):
+        start = time.time()
+        for k in xrange(0, len(data), batch_size):
+            predictor.predict_proba(data[k:k + batch_size])
+        best = min(best, time.time() - start)
+    return len(data) / max(best, 1e-9)
+
+
+class SiteConditionedPredictor(object):
+    """One site's view of a multi-task model, the site's one-hot vector is appended to the vectors before they're
+    passed to the shared predictor. The predictor isn't copied so every site can share one model
+    """
+    def __init__(self, predictor, site_index, nb_sites):
+        assert(0 <= site_index < nb_sites), "site index out of range"
+        self.predictor = predictor
+        self.site_index = site_index
+        self.nb_sites = nb_sites
+        self.in_dim = predictor.in_dim - nb_sites
+        self.n_classes = predictor.n_classes
+
+    def predict_proba(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        one_hot = np.zeros((len(x), self.nb_sites), dtype=x.dtype)
+        one_hot[:, self.site_index] = 1
+        return self.predictor.predict_proba(np.hstack((x, one_hot)))
+
+    def predict(self, x):
+        return np.argmax(self.predict_proba(x), axis=1)
+
+    def nbytes(self):
+        # the shared predictor is counted by whoever keeps it
+        return 0
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Timers and counters for the stages of the training pipeline, from globbing the alignment files to writing the
+trained models. A PipelineMetrics is passed down to the functions that do each stage, and each site's iteration
+writes its record as a JSON line and prints a one-line summary
+"""
+from __future__ import print_function
+import sys
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# stages in pipeline order, for the summary line
+STAGES = ["glob", "parse", "features", "vectors", "preprocess", "graph", "compile", "train", "train_eval",
+          "evaluate", "checkpoint"]
+
+
+class PipelineMetrics(object):
+    def __init__(self, title=None, iteration=None):
+        # the site and iteration the record is for
+        self.title = title
+        self.iteration = iteration
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.skipped = defaultdict(int)
+        # the first file skipped for each reason
+        self.skipped_examples = {}
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.time() - start
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def skip(self, tsv, reason):
+        # returns False so the caller can return it, like a file without motif events
+        self.skipped[reason] += 1
+        self.skipped_examples.setdefault(reason, tsv)
+        return False
+
+    def add_training(self, timings):
+        """Add the timings in a training summary (see optimization.py)
+        """
+        for stage, key in [("graph", "graph_seconds"), ("compile", "compile_seconds"), ("train", "train_seconds"),
+                           ("train_eval", "eval_seconds"), ("checkpoint", "checkpoint_seconds")]:
+            self.seconds[stage] += timings.get(key, 0.0)
+        self.count("train_steps", timings.get("steps", 0))
+        self.count("train_samples", timings.get("samples", 0))
+
+    def merge(self, other):
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] += seconds
+        for name, n in other.counters.items():
+            self.counters[name] += n
+        for reason, n in other.skipped.items():
+            self.skipped[reason] += n
+        for reason, tsv in other.skipped_examples.items():
+            self.skipped_examples.setdefault(reason, tsv)
+        return self
+
+    def nan_fill_rate(self):
+        return self.counters["nan_values"] / float(self.counters["vector_values"]) \
+            if self.counters["vector_values"] > 0 else None
+
+    def steps_per_sec(self):
+        return self.counters["train_steps"] / self.seconds["train"] if self.seconds["train"] > 0 else None
+
+    def values(self):
+        """Flat dict of the numbers, seconds_<stage> for the timers
+        """
+        values = dict(("seconds_" + stage, seconds) for stage, seconds in self.seconds.items())
+        values.update(self.counters)
+        values["files_skipped"] = sum(self.skipped.values())
+        for name, value in [("nan_fill_rate", self.nan_fill_rate()), ("steps_per_sec", self.steps_per_sec())]:
+            if value is not None:
+                values[name] = value
+        return values
+
+    def record(self):
+        record = {"title": self.title, "iteration": self.iteration}
+        record.update({
+            "seconds": dict(self.seconds),
+            "counters": dict(self.counters),
+            "skipped": dict(self.skipped),
+            "skipped_examples": self.skipped_examples,
+            "nan_fill_rate": self.nan_fill_rate(),
+            "steps_per_sec": self.steps_per_sec(),
+        })
+        return record
+
+    def summary_line(self):
+        stages = sorted(self.seconds.keys(), key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES))
+        skipped = ", ".join("{0} {1}".format(reason, n) for reason, n in sorted(self.skipped.items()))
+        nan_fill_rate, steps_per_sec = self.nan_fill_rate(), self.steps_per_sec()
+        return "{title}:{iteration}: {times} | {read} files read, {skipped} skipped{reasons} | {rows} rows, " \
+               "{vectors} vectors{nans}{steps}".format(
+                   title=self.title, iteration=self.iteration,
+                   times=" ".join("{0} {1:.2f}s".format(s, self.seconds[s]) for s in stages),
+                   read=self.counters["files_read"], skipped=sum(self.skipped.values()),
+                   reasons="" if skipped == "" else " ({})".format(skipped), rows=self.counters["rows_parsed"],
+                   vectors=self.counters["vectors_built"],
+                   nans="" if nan_fill_rate is None else " ({:.1%} NaN)".format(nan_fill_rate),
+                   steps="" if steps_per_sec is None else " | {:.0f} steps/sec".format(steps_per_sec))
+
+    def emit(self, metrics_file=None):
+        """Print the summary line to stderr and append the record to metrics_file (JSON lines)
+        """
+        print(self.summary_line(), file=sys.stderr)
+        if metrics_file is not None:
+            with open(metrics_file, 'a') as f:
+                f.write(json.dumps(self.record(), sort_keys=True) + "\n")
+
+
+def read_metrics(metrics_file):
+    with open(metrics_file, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
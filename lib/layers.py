@@ -100,3 +100,84 @@ class ConvPoolLayer(object):
 
         self.params = [self.weights, self.biases]
 
+
+
+class GRULayer(object):
+    def __init__(self, x, mask, in_dim, out_dim, layer_id):
+        # x is a 3D tensor of (time steps, batch, in_dim) and mask is a (time steps, batch) matrix that is 1 where
+        # the step holds a real event and 0 where it is padding. The gates are stacked as [reset, update, candidate]
+        W_bound = np.sqrt(6. / (in_dim + out_dim))
+        U_bound = np.sqrt(6. / (out_dim + out_dim))
+        W_values = np.asarray(RNG.uniform(low=-W_bound, high=W_bound, size=(in_dim, 3 * out_dim)),
+                              dtype=theano.config.floatX)
+        U_values = np.asarray(RNG.uniform(low=-U_bound, high=U_bound, size=(out_dim, 3 * out_dim)),
+                              dtype=theano.config.floatX)
+        b_values = np.zeros((3 * out_dim,), dtype=theano.config.floatX)
+
+        self.weights = theano.shared(value=W_values, name=layer_id + 'weights', borrow=True)
+        self.recurrent_weights = theano.shared(value=U_values, name=layer_id + 'recurrent_weights', borrow=True)
+        self.biases = theano.shared(value=b_values, name=layer_id + 'biases', borrow=True)
+        self.params = [self.weights, self.recurrent_weights, self.biases]
+
+        self.input = x
+        self.mask = mask
+
+        def step(x_t, m_t, h_prev, U):
+            # x_t is the input projection for this step, computed for all steps at once outside of the scan
+            r = T.nnet.sigmoid(x_t[:, :out_dim] + T.dot(h_prev, U[:, :out_dim]))
+            z = T.nnet.sigmoid(x_t[:, out_dim:2 * out_dim] + T.dot(h_prev, U[:, out_dim:2 * out_dim]))
+            h_candidate = T.tanh(x_t[:, 2 * out_dim:] + T.dot(r * h_prev, U[:, 2 * out_dim:]))
+            h = (1. - z) * h_prev + z * h_candidate
+            # padded steps carry the previous state forward, so the last state is the one after the last event
+            m = m_t.dimshuffle(0, 'x')
+            return m * h + (1. - m) * h_prev
+
+        x_projection = T.dot(x, self.weights) + self.biases
+        h0 = T.zeros((x.shape[1], out_dim), dtype=theano.config.floatX)
+        hidden_states, _ = theano.scan(fn=step,
+                                       sequences=[x_projection, mask],
+                                       outputs_info=[h0],
+                                       non_sequences=[self.recurrent_weights])
+        self.output = hidden_states[-1]
+
+
+class LSTMLayer(object):
+    def __init__(self, x, mask, in_dim, out_dim, layer_id):
+        # same input conventions as the GRULayer, the gates are stacked as [input, forget, output, candidate]
+        W_bound = np.sqrt(6. / (in_dim + out_dim))
+        U_bound = np.sqrt(6. / (out_dim + out_dim))
+        W_values = np.asarray(RNG.uniform(low=-W_bound, high=W_bound, size=(in_dim, 4 * out_dim)),
+                              dtype=theano.config.floatX)
+        U_values = np.asarray(RNG.uniform(low=-U_bound, high=U_bound, size=(out_dim, 4 * out_dim)),
+                              dtype=theano.config.floatX)
+        b_values = np.zeros((4 * out_dim,), dtype=theano.config.floatX)
+        # start with the forget gate open
+        b_values[out_dim:2 * out_dim] = 1.
+
+        self.weights = theano.shared(value=W_values, name=layer_id + 'weights', borrow=True)
+        self.recurrent_weights = theano.shared(value=U_values, name=layer_id + 'recurrent_weights', borrow=True)
+        self.biases = theano.shared(value=b_values, name=layer_id + 'biases', borrow=True)
+        self.params = [self.weights, self.recurrent_weights, self.biases]
+
+        self.input = x
+        self.mask = mask
+
+        def step(x_t, m_t, h_prev, c_prev, U):
+            gates = x_t + T.dot(h_prev, U)
+            i = T.nnet.sigmoid(gates[:, :out_dim])
+            f = T.nnet.sigmoid(gates[:, out_dim:2 * out_dim])
+            o = T.nnet.sigmoid(gates[:, 2 * out_dim:3 * out_dim])
+            c_candidate = T.tanh(gates[:, 3 * out_dim:])
+            c = f * c_prev + i * c_candidate
+            h = o * T.tanh(c)
+            m = m_t.dimshuffle(0, 'x')
+            return m * h + (1. - m) * h_prev, m * c + (1. - m) * c_prev
+
+        x_projection = T.dot(x, self.weights) + self.biases
+        h0 = T.zeros((x.shape[1], out_dim), dtype=theano.config.floatX)
+        c0 = T.zeros((x.shape[1], out_dim), dtype=theano.config.floatX)
+        [hidden_states, _], _ = theano.scan(fn=step,
+                                            sequences=[x_projection, mask],
+                                            outputs_info=[h0, c0],
+                                            non_sequences=[self.recurrent_weights])
+        self.output = hidden_states[-1]
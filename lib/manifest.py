@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Manifest of the site-iterations that have finished in an output directory, so rerunning a config after a crash or
+a change only trains the ones that are missing or stale. Entries are keyed by a hash of the site, its
+hyperparameters and the input files (their paths, sizes and modification times), each one is appended as a JSON line
+when an iteration finishes so the workers of a run_nn job can share the file
+"""
+from __future__ import print_function
+import os
+import glob
+import json
+import fcntl
+import time
+import hashlib
+
+MANIFEST_FILE = "manifest.jsonl"
+# hyperparameters that don't change what an iteration trains, asking for more iterations reuses the ones that are
+# done
+UNKEYED_PARAMS = ["iterations"]
+
+
+def input_files(files):
+    """(path, size, modification time) of each file matching the glob files
+    """
+    if files is None:
+        return []
+    return [(f, os.stat(f).st_size, int(os.stat(f).st_mtime)) for f in sorted(glob.glob(files))]
+
+
+def task_key(title, params, motifs):
+    """Hash of a site (its title and motifs), its hyperparameters and the alignment files in its groups
+    """
+    keyed = dict((k, v) for k, v in params.items() if k not in UNKEYED_PARAMS)
+    files = [input_files(params.get(group)) for group in ["group_1", "group_2", "group_3"]]
+    key = json.dumps({"title": title, "params": keyed, "motifs": motifs, "files": files}, sort_keys=True,
+                     default=str)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class Manifest(object):
+    def __init__(self, path, resume=True):
+        # without resume the earlier entries are ignored, new ones are still written
+        self.path = path
+        self.entries = {}
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut off by a crash
+                        continue
+                    self.entries[(entry['key'], entry['iteration'])] = entry
+
+    def completed(self, key, iteration):
+        """The entry for a finished iteration, or None if it isn't done or its files are gone
+        """
+        entry = self.entries.get((key, iteration))
+        if entry is None or not all(os.path.exists(f) for f in entry['files']):
+            return None
+        return entry
+
+    def pending(self, key, iterations):
+        return [i for i in xrange(iterations) if self.completed(key, i) is None]
+
+    def complete(self, key, title, iteration, accuracy, files, **extra):
+        """Record a finished iteration, files are the ones it wrote that a rerun needs (eg. the best model)
+        """
+        entry = {"key": key, "title": title, "iteration": iteration, "accuracy": float(accuracy),
+                 "files": [os.path.abspath(f) for f in files if f], "finished": time.time()}
+        entry.update(extra)
+        with open(self.path, 'a') as f:
+            # appends from several nodes aren't atomic on NFS, the lock (which NFS passes to the server) keeps
+            # their lines from overwriting each other
+            fcntl.lockf(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                f.write(json.dumps(entry, sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+        self.entries[(key, iteration)] = entry
+        return entry
+
+
+def open_manifest(manifest_file, resume=True):
+    return Manifest(manifest_file, resume=resume) if manifest_file is not None else None
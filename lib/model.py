@@ -10,7 +10,7 @@ import sys
 import cPickle
 import numpy as np
 from itertools import izip
-from layers import HiddenLayer, SoftmaxLayer, ConvPoolLayer
+from layers import HiddenLayer, SoftmaxLayer, ConvPoolLayer, GRULayer, LSTMLayer
 import theano.tensor as T
 
 
@@ -18,6 +18,14 @@ def ReLU(x):
         return T.switch(x < 0, 0, x)
 
 
+def tanh_activation(x, derivative):
+    """Activation function for the VanillaNeuralNet, the derivative is taken with respect to the activation output
+    """
+    if derivative is True:
+        return 1. - x ** 2
+    return np.tanh(x)
+
+
 class Model(object):
     """Base class for network models
     """
@@ -32,6 +40,8 @@ class Model(object):
         self.hidden_dim = hidden_dim
         self.params = None
         self.initialized = False
+        # Normalizer.to_dict() of the statistics the network was trained with, kept in the model file
+        self.normalization = None
 
     def write(self, file_path):
         """Write model to file, using cPickle
@@ -44,6 +54,8 @@ class Model(object):
             "n_classes": self.n_classes,
             "hidden_dim": self.hidden_dim,
         }
+        if self.normalization is not None:
+            d["normalization"] = self.normalization
         assert (self.params is not None)
         for param in self.params:
             lb = '{}'.format(param)
@@ -66,6 +78,7 @@ class Model(object):
             d['n_classes'], self.n_classes)
         assert(self.__class__ == d['model'])
         assert(self.hidden_dim == d['hidden_dim'])
+        self.normalization = d.get('normalization', self.normalization)
 
         missing_params = 0
         for param in self.params:
@@ -81,6 +94,37 @@ class Model(object):
     def load_from_object(self, model, careful=False):
         self.load_from_file(file_path=None, model_obj=model, careful=careful)
 
+    def transfer_from_file(self, file_path=None, model_obj=None, reset_layers=("s0",)):
+        """Initialize the hidden layers from a model trained on other data (eg. all of the sites pooled), the
+        layers in reset_layers (by default the softmax layer) keep their initial values. The base model can have
+        more inputs than this one, like a multi-task model with the site one-hot, only the weights of the first
+        in_dim inputs are used. Returns the names of the params that were loaded
+        """
+        if file_path is not None:
+            d = cPickle.load(open(file_path, 'r'))
+        else:
+            assert(model_obj is not None), "need to provide file or dict with model params"
+            d = model_obj
+
+        assert(self.__class__ == d['model']), "can only transfer from a {}".format(self.__class__.__name__)
+        assert(self.hidden_dim == d['hidden_dim']), "base model has different hidden dims"
+        assert(d['in_dim'] >= self.in_dim), "base model has fewer inputs than this one"
+
+        transferred = []
+        for param in self.params:
+            look_up = "{}".format(param)
+            if look_up.startswith(tuple(reset_layers)) or look_up not in d.keys():
+                continue
+            value = d[look_up]
+            if param.get_value().shape != value.shape:
+                # only the input weights of the first layer can differ, by the extra inputs of the base
+                assert(value.shape[1:] == param.get_value().shape[1:]), "{} has a different shape".format(look_up)
+                value = value[:self.in_dim]
+            param.set_value(np.asarray(value, dtype=param.get_value().dtype))
+            transferred.append(look_up)
+        assert(len(transferred) > 0), "didn't find any params to transfer"
+        return transferred
+
 
 class NeuralNetwork(Model):
     def __init__(self, x, in_dim, hidden_dim, n_classes):
@@ -313,19 +357,88 @@ class ConvolutionalNetwork3(Model):
         self.type = "ConvNet3"
 
 
+class GRUNetwork(Model):
+    """Recurrent network over the events aligned to a motif. x is a 3D tensor of (time steps, batch, event features)
+    and mask is a (time steps, batch) matrix marking the steps that hold real events
+    """
+    def __init__(self, x, in_dim, hidden_dim, n_classes, mask=None):
+        assert(len(hidden_dim) == 1)
+        super(GRUNetwork, self).__init__(x=x, in_dim=in_dim, n_classes=n_classes, hidden_dim=hidden_dim)
+
+        self.input = x
+        self.mask = T.matrix('mask') if mask is None else mask
+
+        # recurrent layer, the output is the hidden state after the last event in each sequence
+        self.recurrent_layer = GRULayer(x=x, mask=self.mask, in_dim=in_dim, out_dim=hidden_dim[0], layer_id='r0')
+
+        # final layer (softmax)
+        self.softmax_layer = SoftmaxLayer(x=self.recurrent_layer.output, in_dim=hidden_dim[0], out_dim=n_classes,
+                                          layer_id='s0')
+
+        # Regularization
+        self.L1 = abs(self.recurrent_layer.weights).sum() + abs(self.recurrent_layer.recurrent_weights).sum() + \
+                  abs(self.softmax_layer.weights).sum()
+        self.L2_sq = (self.recurrent_layer.weights ** 2).sum() + (self.recurrent_layer.recurrent_weights ** 2).sum() + \
+                     (self.softmax_layer.weights ** 2).sum()
+
+        # output, errors, and likelihood
+        self.y_predict = self.softmax_layer.y_predict
+        self.negative_log_likelihood = self.softmax_layer.negative_log_likelihood
+        self.errors = self.softmax_layer.errors
+        self.output = self.softmax_layer.output
+        self.params = self.recurrent_layer.params + self.softmax_layer.params
+
+        self.type = "GRU"
+
+
+class LSTMNetwork(Model):
+    """Same as the GRUNetwork but with an LSTM layer
+    """
+    def __init__(self, x, in_dim, hidden_dim, n_classes, mask=None):
+        assert(len(hidden_dim) == 1)
+        super(LSTMNetwork, self).__init__(x=x, in_dim=in_dim, n_classes=n_classes, hidden_dim=hidden_dim)
+
+        self.input = x
+        self.mask = T.matrix('mask') if mask is None else mask
+
+        # recurrent layer
+        self.recurrent_layer = LSTMLayer(x=x, mask=self.mask, in_dim=in_dim, out_dim=hidden_dim[0], layer_id='r0')
+
+        # final layer (softmax)
+        self.softmax_layer = SoftmaxLayer(x=self.recurrent_layer.output, in_dim=hidden_dim[0], out_dim=n_classes,
+                                          layer_id='s0')
+
+        # Regularization
+        self.L1 = abs(self.recurrent_layer.weights).sum() + abs(self.recurrent_layer.recurrent_weights).sum() + \
+                  abs(self.softmax_layer.weights).sum()
+        self.L2_sq = (self.recurrent_layer.weights ** 2).sum() + (self.recurrent_layer.recurrent_weights ** 2).sum() + \
+                     (self.softmax_layer.weights ** 2).sum()
+
+        # output, errors, and likelihood
+        self.y_predict = self.softmax_layer.y_predict
+        self.negative_log_likelihood = self.softmax_layer.negative_log_likelihood
+        self.errors = self.softmax_layer.errors
+        self.output = self.softmax_layer.output
+        self.params = self.recurrent_layer.params + self.softmax_layer.params
+
+        self.type = "LSTM"
+
+
 class VanillaNeuralNet(object):
     """[3], [2]
     A plain vanilla backprop neural network I made from scratch. See citations for the code that inspired
     this implementation
     """
-    def __init__(self, input_dim, nb_classes, hidden_dims, activation_function):
+    def __init__(self, input_dim, nb_classes, hidden_dims, activation_function, dtype=np.float64):
         # eg. dimensions = [2, 10, 3] makes a 2-input, 10 hidden, 3 output NN
         # number of layers is the hidden node depth plus the input and output layers
         self.layers = len(hidden_dims) + 2
         dimensions = [input_dim] + hidden_dims + [nb_classes]
         np.random.seed(0)
-        self.weights = [np.random.randn(x, y) / np.sqrt(x) for x, y, in izip(dimensions[:-1], dimensions[1:])]
-        self.biases = [np.zeros((1, y)) for y in dimensions[1:]]
+        self.dtype = dtype
+        self.weights = [(np.random.randn(x, y) / np.sqrt(x)).astype(dtype)
+                        for x, y, in izip(dimensions[:-1], dimensions[1:])]
+        self.biases = [np.zeros((1, y), dtype=dtype) for y in dimensions[1:]]
         self.activation = activation_function
 
     def predict_old(self, X):
@@ -467,27 +580,70 @@ class VanillaNeuralNet(object):
         if print_loss is True:
             print("after training accuracy: %0.2f" % self.evaluate(training_data, labels), file=sys.stderr)
 
-    def mini_batch_sgd(self, training_data, labels, epochs, batch_size, epsilon=0.01, lbda=0.01, print_loss=False):
-        # place to store gradients
-        whole_dataset = zip(training_data, labels)
+    def batch_backprop(self, X, labels, grad_w, grad_b):
+        """Forward and backward pass for a whole mini-batch at once, the gradients are written into the
+        preallocated grad_w and grad_b buffers. The regularization is left to update_parameters_in_place
+        """
+        # forward pass, keeping track of the activations
+        activation = X
+        activations = [X, ]
+        for i, (bias, weight) in enumerate(izip(self.biases, self.weights)):
+            z = np.dot(activation, weight)
+            z += bias
+            if i < len(self.weights) - 1:
+                activation = self.activation(z, False).astype(self.dtype, copy=False)
+                activations.append(activation)
+            else:
+                # softmax from the final layer input
+                z -= np.max(z, axis=1, keepdims=True)
+                np.exp(z, out=z)
+                z /= np.sum(z, axis=1, keepdims=True)
+                activations.append(z)
 
-        for e in xrange(0, epochs):
-            n = len(whole_dataset)
-            batches = [whole_dataset[k:k + batch_size] for k in xrange(0, n, batch_size)]
+        # backward pass
+        delta = self.cost_derivate(activations[-1], labels)
+
+        np.dot(activations[-2].T, delta, out=grad_w[-1])
+        np.sum(delta, axis=0, keepdims=True, out=grad_b[-1])
 
-            for batch in batches:
-                grad_w = [np.zeros(w.shape) for w in self.weights]
-                grad_b = [np.zeros(b.shape) for b in self.biases]
+        # backprop through the network, starting at the last hidden layer
+        for layer in xrange(2, self.layers):
+            delta = np.dot(delta, self.weights[-layer + 1].T)
+            delta *= self.activation(activations[-layer], True)
+            np.dot(activations[-layer - 1].T, delta, out=grad_w[-layer])
+            np.sum(delta, axis=0, keepdims=True, out=grad_b[-layer])
 
-                # get the gradient for each sample in the batch
-                for sample, label in batch:
-                    delta_w, delta_b = self.backprop(sample=sample, label=label, lbda=lbda)
-                    #assert len()
-                    grad_w = [dw + delta_w for dw, delta_w in izip(grad_w, delta_w)]
-                    grad_b = [db + delta_b for db, delta_b in izip(grad_b, delta_b)]
+        return grad_w, grad_b
 
+    def update_parameters_in_place(self, grad_weights, grad_biases, epsilon, decay=0.0):
+        # same update as update_parameters, with the weight decay (lambda * w per sample) folded into the
+        # update, the gradient buffers are used as scratch space
+        for w, dw in izip(self.weights, grad_weights):
+            if decay != 0.0:
+                w *= (1.0 - epsilon * decay)
+            dw *= epsilon
+            w -= dw
+        for b, db in izip(self.biases, grad_biases):
+            db *= epsilon
+            b -= db
+
+    def mini_batch_sgd(self, training_data, labels, epochs, batch_size, epsilon=0.01, lbda=0.01, print_loss=False):
+        # the gradients are summed over the batch and the weight decay is added once for each sample, the same as
+        # summing the output of backprop for each sample in the batch
+        training_data = np.asarray(training_data, dtype=self.dtype)
+        labels = np.asarray(labels, dtype=np.intp)
+        n = len(training_data)
+
+        # place to store gradients
+        grad_w = [np.empty_like(w) for w in self.weights]
+        grad_b = [np.empty_like(b) for b in self.biases]
+
+        for e in xrange(0, epochs):
+            for k in xrange(0, n, batch_size):
+                batch = training_data[k:k + batch_size]
+                self.batch_backprop(X=batch, labels=labels[k:k + batch_size], grad_w=grad_w, grad_b=grad_b)
                 # update the parameters for this batch
-                self.update_parameters(grad_w, grad_b, epsilon=epsilon)
+                self.update_parameters_in_place(grad_w, grad_b, epsilon=epsilon, decay=lbda * len(batch))
 
             if e % 500 == 0 and print_loss == True:
                 loss, accuracy = self.calculate_loss_and_accuracy(training_data, labels)
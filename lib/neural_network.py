@@ -7,19 +7,31 @@ Citations
 """
 from __future__ import print_function
 import sys, os
+import shutil
 import theano
 import theano.tensor as T
 import numpy as np
-from utils import collect_data_vectors2, shuffle_and_maintain_labels, preprocess_data, chain, get_network, \
+from itertools import izip
+from utils import collect_data_vectors2, shuffle_and_maintain_labels, chain, get_network, \
     stack_and_level_datasets2, stack_and_level_datasets3, append_and_level_labels2, append_and_level_labels3, \
-    find_model_path
-from optimization import mini_batch_sgd, mini_batch_sgd_with_annealing, cPickle
+    find_model_path, collect_sequence_vectors, bucket_sequences, get_nb_features, \
+    append_site_one_hot, RECURRENT_MODELS
+from normalization import Normalizer, row_chunks, model_normalizer
+from inference import MODEL_TYPES, load_model_dict
+from registry import default_registry
+from results_store import start_results_run
+from manifest import open_manifest, task_key
+from instrumentation import PipelineMetrics
+from profiling import theano_profile
+from optimization import mini_batch_sgd, mini_batch_sgd_with_annealing, mini_batch_sgd_recurrent, cPickle
 
 
 def predict(test_data, true_labels, batch_size, model, model_file=None):
     if model_file is not None:
         print("loading model from {}".format(model_file), end='\n', file=sys.stderr)
         model.load_from_file(file_path=model_file, careful=True)
+    # test_data is the raw vectors, they get the normalization the model was trained with
+    test_data = Normalizer.from_dict(model.normalization).transform(test_data, dtype=theano.config.floatX)
 
     n_test_batches = test_data.shape[0] / batch_size
 
@@ -27,11 +39,11 @@ def predict(test_data, true_labels, batch_size, model, model_file=None):
 
     prob_fcn = theano.function(inputs=[model.input],
                                outputs=model.output,
-                               )
+                               name="prob", profile=theano_profile("prob"))
 
     error_fcn = theano.function(inputs=[model.input, y],
                                 outputs=model.errors(y),
-                                )
+                                name="error", profile=theano_profile("error"))
     errors = [error_fcn(test_data[x * batch_size: (x + 1) * batch_size],
                         true_labels[x * batch_size: (x + 1) * batch_size])
               for x in xrange(n_test_batches)]
@@ -44,21 +56,145 @@ def predict(test_data, true_labels, batch_size, model, model_file=None):
     return errors, probs
 
 
-def evaluate_network(test_data, targets, model_file, model_type, batch_size, extra_args=None):
-    # load the model file
+def predict_sequences(test_data, true_labels, batch_size, model, model_file=None):
+    # like predict, but for the recurrent models, test_data is a list of (nb_events, nb_features) sequences.
+    # The probabilities are returned in the same order as test_data
+    if model_file is not None:
+        print("loading model from {}".format(model_file), end='\n', file=sys.stderr)
+        model.load_from_file(file_path=model_file, careful=True)
+    test_data = Normalizer.from_dict(model.normalization).transform_sequences(test_data, dtype=theano.config.floatX)
+
+    y = T.ivector('y')
+
+    prob_fcn = theano.function(inputs=[model.input, model.mask],
+                               outputs=model.output,
+                               name="prob", profile=theano_profile("prob"))
+
+    error_fcn = theano.function(inputs=[model.input, model.mask, y],
+                                outputs=model.errors(y),
+                                name="error", profile=theano_profile("error"))
+
+    batches = bucket_sequences(test_data, true_labels, batch_size, shuffle_batches=False)
+    errors = [error_fcn(b_x, b_mask, b_y) for b_x, b_mask, b_y, _ in batches]
+
+    probs = [None] * len(test_data)
+    for b_x, b_mask, _, index in batches:
+        for i, prob in izip(index, prob_fcn(b_x, b_mask)):
+            probs[i] = prob
+
+    return errors, probs
+
+
+def load_network(model_file, model_type=None, extra_args=None):
+    """Build a network for a model file (written by Model.write) and load its parameters. model_type can be left
+    out for the feed-forward models, it's looked up from the model class
+    """
     model = cPickle.load(open(model_file, 'r'))
+    if model_type is None:
+        model_type = MODEL_TYPES[model['model']]
+    x = T.tensor3('x') if model_type in RECURRENT_MODELS else T.matrix('x')
+    net = get_network(x=x, in_dim=model['in_dim'], n_classes=model['n_classes'], hidden_dim=model['hidden_dim'],
+                      model_type=model_type, extra_args=extra_args)
+    net.load_from_object(model=model)
+    return net
+
+
+class TheanoPredictor(object):
+    """A feed-forward network with its probability function compiled once, for repeated predictions
+    """
+    def __init__(self, net):
+        self.net = net
+        self.in_dim = net.in_dim
+        self.n_classes = net.n_classes
+        self.normalizer = Normalizer.from_dict(net.normalization)
+        self.prob_fcn = theano.function(inputs=[net.input], outputs=net.output, name="prob",
+                                        profile=theano_profile("prob"))
+
+    @classmethod
+    def from_file(cls, model_file, model_type=None, extra_args=None):
+        assert(model_type not in RECURRENT_MODELS), "TheanoPredictor only runs the feed-forward models"
+        return cls(load_network(model_file, model_type=model_type, extra_args=extra_args))
+
+    def predict_proba(self, x):
+        return self.prob_fcn(self.normalizer.transform(x, dtype=theano.config.floatX))
+
+    def predict(self, x):
+        return np.argmax(self.predict_proba(x), axis=1)
+
+    def nbytes(self):
+        return sum(param.get_value(borrow=True).nbytes for param in self.net.params)
+
+
+def evaluate_network(test_data, targets, model_file, model_type, batch_size, extra_args=None, registry=None):
+    # the model and its compiled network are kept in the registry, so evaluating the same model again doesn't
+    # reload or recompile it
+    registry = default_registry() if registry is None else registry
+    model = registry.model(model_file)
     n_train_samples, data_dim = test_data.shape
     n_classes = len(set(targets))
     if data_dim != model['in_dim'] or n_classes != model['n_classes']:
         print("This data is not compatible with this network, exiting", file=sys.stderr)
         return False
-    net = get_network(x=test_data, in_dim=model['in_dim'], n_classes=model['n_classes'], model_type=model_type,
-                      hidden_dim=model['hidden_dim'], extra_args=extra_args)
-    net.load_from_object(model=model, careful=True)
-    errors, probs = predict(test_data=test_data, true_labels=targets, batch_size=batch_size, model=net, model_file=None)
+    predictor = registry.predictor(model_file, engine="theano", model_type=model_type, extra_args=extra_args)
+    # same batches as predict, the last partial batch is left out
+    n_test_batches = test_data.shape[0] / batch_size
+    errors, probs = [], []
+    for x in xrange(n_test_batches):
+        batch_probs = predictor.predict_proba(test_data[x * batch_size: (x + 1) * batch_size])
+        errors.append(np.mean(np.argmax(batch_probs, axis=1) != targets[x * batch_size: (x + 1) * batch_size]))
+        probs += list(batch_probs)
     return errors, probs
 
 
+# the arguments of the classify functions that are recorded as a run's hyperparameters, the sites' motif starts
+# are left out so the runs for all the sites of an experiment share them
+RESULTS_PARAMS = ["group_1", "group_2", "group_3", "strand", "preprocess",
+                  "events_per_pos", "feature_set", "learning_algorithm", "train_test_split", "iterations", "epochs",
+                  "max_samples", "batch_size", "learning_rate", "L1_reg", "L2_reg", "hidden_dim", "model_type",
+                  "model_dir", "extra_args", "transfer_model", "freeze_hidden"]
+
+
+def run_params(arguments):
+    return dict((k, v) for k, v in arguments.items() if k in RESULTS_PARAMS)
+
+
+def iteration_artifacts(trained_model_dir):
+    artifacts = {"model_dir": trained_model_dir, "summary_stats": trained_model_dir + "summary_stats.pkl",
+                 "test_probs": trained_model_dir + "test_probs.pkl",
+                 "test_provenance": trained_model_dir + "test_provenance.pkl"}
+    return dict((kind, path) for kind, path in artifacts.items() if os.path.exists(path))
+
+
+def manifest_key(arguments):
+    # arguments are a classify function's, the motifs are the site's motif starts or the multi-task sites
+    motifs = arguments['sites'] if 'sites' in arguments else arguments['motif_start_positions']
+    return task_key(arguments['title'], run_params(arguments), motifs)
+
+
+def site_normalizer(training_data, preprocess, transfer_model=None):
+    # a fine-tuned model keeps the statistics of its base, the transferred layers were trained on those
+    if transfer_model is None:
+        return Normalizer.fit(row_chunks(training_data), preprocess=preprocess)
+    normalizer = model_normalizer(load_model_dict(transfer_model))
+    assert(normalizer.preprocess == preprocess), "the base model was trained with --preprocess {0}, not {1}".format(
+        normalizer.preprocess, preprocess)
+    return normalizer
+
+
+def resume_iteration(manifest, key, title, iteration, store, run_id):
+    """The manifest entry of an iteration that finished in an earlier run (it's recorded in the results store
+    again), or None if it needs to be trained
+    """
+    done = manifest.completed(key, iteration) if manifest is not None else None
+    if done is None:
+        return None
+    print("{0}:{1}:{2} test accuracy, from an earlier run.".format(title, iteration, done['accuracy'] * 100))
+    if store is not None:
+        store.record_iteration(run_id, iteration, done['accuracy'], summary={"best_model": done['best_model']},
+                               artifacts=iteration_artifacts(done['model_dir']))
+    return done
+
+
 def classify_with_network3(
         # alignment files
         group_1, group_2, group_3,  # these arguments should be strings that are used as the file suffix
@@ -68,11 +204,22 @@ def classify_with_network3(
         learning_algorithm, train_test_split, iterations, epochs, max_samples, batch_size,
         # model params
         learning_rate, L1_reg, L2_reg, hidden_dim, model_type, model_dir=None, extra_args=None,
+        # warm start from a base model (eg. the multi-task model), see Model.transfer_from_file
+        transfer_model=None, freeze_hidden=False,
+        # record the run in a results database (see results_store.py)
+        results_db=None, experiment=None,
+        # skip the iterations that finished in an earlier run, see manifest.py
+        manifest_file=None, resume=True,
         # output params
         out_path="./"):
     # checks and file IO
     assert(len(motif_start_positions) >= 3)
     out_file = open(out_path + title + ".tsv", 'wa')
+    store, run_id = start_results_run(results_db, title, run_params(locals()), experiment=experiment,
+                                      model_type=model_type, out_path=out_path, command=" ".join(sys.argv))
+    manifest, key = open_manifest(manifest_file, resume=resume), manifest_key(locals())
+    # returned if every iteration finished in an earlier run
+    net = None
     if model_dir is not None:
         print("looking for model in {}".format(os.path.abspath(model_dir)))
         model_file = find_model_path(os.path.abspath(model_dir), title)
@@ -87,10 +234,20 @@ def classify_with_network3(
         "strand": strand,
         "max_samples": max_samples,
         "feature_set": feature_set,
-        "kmer_length": 6
+        "kmer_length": 6,
+        "return_provenance": True,
     }
 
+    site_metrics = PipelineMetrics(title=title, iteration="all")
+    metrics_file = out_path + title + "_metrics.jsonl"
+
     for i in xrange(iterations):
+        done = resume_iteration(manifest, key, title, i, store, run_id)
+        if done is not None:
+            out_file.write("{}\n".format(done['accuracy']))
+            scores.append(done['accuracy'])
+            continue
+        metrics = PipelineMetrics(title=title, iteration=i)
         list_of_datasets = []  # [((g1, g1l), (xg1, xg1l), (tg1, tg1l)), ... ]
         add_to_list = list_of_datasets.append
         for n, group in enumerate((group_1, group_2, group_3)):
@@ -98,6 +255,7 @@ def classify_with_network3(
                                                                     files=group,
                                                                     motif_starts=motif_start_positions[n],
                                                                     dataset_title=title + "_group{}".format(n),
+                                                                    metrics=metrics,
                                                                     **collect_data_vectors_args)
             add_to_list((train_set, xtrain_set, test_set))
 
@@ -146,11 +304,13 @@ def classify_with_network3(
         # test
         test_data = stack_and_level_datasets3(c_test, mc_test, hmc_test, test_level)
         test_targets = append_and_level_labels3(c_test_targets, mc_test_targets, hmc_test_targets, test_level)
+        # the (read, motif_start) of each test vector
+        test_provenance = append_and_level_labels3(list_of_datasets[0][2][2], list_of_datasets[1][2][2],
+                                                   list_of_datasets[2][2][2], test_level)
 
-        prc_train, prc_xtrain, prc_test = preprocess_data(training_vectors=training_data,
-                                                          xtrain_vectors=xtrain_data,
-                                                          test_vectors=test_data,
-                                                          preprocess=preprocess)
+        with metrics.timer("preprocess"):
+            normalizer = site_normalizer(training_data, preprocess, transfer_model=transfer_model)
+            prc_train, prc_xtrain = normalizer.transform(training_data), normalizer.transform(xtrain_data)
 
         #if evaluate is True:
         #    all_test_data = np.vstack((xtrain_data, test_data))
@@ -182,16 +342,25 @@ def classify_with_network3(
             "model_type": model_type,
             "model_file": model_file,
             "trained_model_dir": trained_model_dir,
-            "extra_args": extra_args
+            "extra_args": extra_args,
+            "transfer_model": transfer_model,
+            "freeze_transferred": freeze_hidden,
+            "normalization": normalizer.to_dict(),
         }
 
         if learning_algorithm == "annealing":
             net, summary = mini_batch_sgd_with_annealing(**training_routine_args)
         else:
             net, summary = mini_batch_sgd(**training_routine_args)
-
-        errors, probs = predict(prc_test, test_targets, training_routine_args['batch_size'], net,
-                                model_file=summary['best_model'])
+        metrics.add_training(summary['timings'])
+        if transfer_model is not None:
+            print("{0}:{1} fine-tuned {2} of {3} params for {4} epochs, best model at epoch {5}"
+                  .format(title, i, len(net.params) - len(summary['frozen_params']), len(net.params), epochs,
+                          summary['best_epoch']), file=sys.stderr)
+
+        with metrics.timer("evaluate"):
+            errors, probs = predict(test_data, test_targets, training_routine_args['batch_size'], net,
+                                    model_file=summary['best_model'])
         errors = 1 - np.mean(errors)
         probs = zip(probs, test_targets)
 
@@ -199,10 +368,26 @@ def classify_with_network3(
         out_file.write("{}\n".format(errors))
         scores.append(errors)
 
-        with open("{}test_probs.pkl".format(trained_model_dir), 'w') as probs_file:
-            cPickle.dump(probs, probs_file)
+        with metrics.timer("checkpoint"):
+            with open("{}test_probs.pkl".format(trained_model_dir), 'w') as probs_file:
+                cPickle.dump(probs, probs_file)
+            # lined up with test_probs, predict leaves out the last partial batch
+            with open("{}test_provenance.pkl".format(trained_model_dir), 'w') as provenance_file:
+                cPickle.dump(test_provenance[:len(probs)], provenance_file)
+        if manifest is not None:
+            manifest.complete(key, title, i, errors, best_model=summary['best_model'], model_dir=trained_model_dir,
+                              files=[summary['best_model'], trained_model_dir + "test_probs.pkl"])
+        metrics.emit(metrics_file)
+        site_metrics.merge(metrics)
+        if store is not None:
+            store.record_iteration(run_id, i, errors, summary=summary,
+                                   artifacts=iteration_artifacts(trained_model_dir), metrics=metrics.values())
 
     print(">{motif}\t{accuracy}".format(motif=title, accuracy=np.mean(scores), end="\n"), file=out_file)
+    site_metrics.emit(metrics_file)
+    if store is not None:
+        store.finish_run(run_id, np.mean(scores))
+        store.close()
 
     return net
 
@@ -216,11 +401,22 @@ def classify_with_network2(
         learning_algorithm, train_test_split, iterations, epochs, max_samples, batch_size,
         # model params
         learning_rate, L1_reg, L2_reg, hidden_dim, model_type, model_dir=None, extra_args=None,
+        # warm start from a base model (eg. the multi-task model), see Model.transfer_from_file
+        transfer_model=None, freeze_hidden=False,
+        # record the run in a results database (see results_store.py)
+        results_db=None, experiment=None,
+        # skip the iterations that finished in an earlier run, see manifest.py
+        manifest_file=None, resume=True,
         # output params
         out_path="./"):
     print("2 way classification")
     assert(len(motif_start_positions) >= 2)
     out_file = open(out_path + title + ".tsv", 'wa')
+    store, run_id = start_results_run(results_db, title, run_params(locals()), experiment=experiment,
+                                      model_type=model_type, out_path=out_path, command=" ".join(sys.argv))
+    manifest, key = open_manifest(manifest_file, resume=resume), manifest_key(locals())
+    # returned if every iteration finished in an earlier run
+    net = None
     if model_dir is not None:
         print("looking for model in {}".format(model_dir))
         model_file = find_model_path(model_dir, title)
@@ -236,10 +432,20 @@ def classify_with_network2(
         "strand": strand,
         "max_samples": max_samples,
         "feature_set": feature_set,
-        "kmer_length": 6
+        "kmer_length": 6,
+        "return_provenance": True,
     }
 
+    site_metrics = PipelineMetrics(title=title, iteration="all")
+    metrics_file = out_path + title + "_metrics.jsonl"
+
     for i in xrange(iterations):
+        done = resume_iteration(manifest, key, title, i, store, run_id)
+        if done is not None:
+            out_file.write("{}\n".format(done['accuracy']))
+            scores.append(done['accuracy'])
+            continue
+        metrics = PipelineMetrics(title=title, iteration=i)
         list_of_datasets = []  # [((g1, g1l), (xg1, xg1l), (tg1, tg1l)), ... ]
         add_to_list = list_of_datasets.append
         for n, group in enumerate((group_1, group_2)):
@@ -247,6 +453,7 @@ def classify_with_network2(
                                                                     files=group,
                                                                     motif_starts=motif_start_positions[n],
                                                                     dataset_title=title + "_group{}".format(n),
+                                                                    metrics=metrics,
                                                                     **collect_data_vectors_args)
             add_to_list((train_set, xtrain_set, test_set))
         # unpack list
@@ -282,11 +489,11 @@ def classify_with_network2(
 
         test_data = stack_and_level_datasets2(g1_test, g2_test, test_level)
         test_targets = append_and_level_labels2(g1_test_targets, g2_test_targets, test_level)
+        test_provenance = append_and_level_labels2(list_of_datasets[0][2][2], list_of_datasets[1][2][2], test_level)
 
-        prc_train, prc_xtrain, prc_test = preprocess_data(training_vectors=training_data,
-                                                          xtrain_vectors=xtrain_data,
-                                                          test_vectors=test_data,
-                                                          preprocess=preprocess)
+        with metrics.timer("preprocess"):
+            normalizer = site_normalizer(training_data, preprocess, transfer_model=transfer_model)
+            prc_train, prc_xtrain = normalizer.transform(training_data), normalizer.transform(xtrain_data)
 
         # evaluate
 
@@ -309,25 +516,376 @@ def classify_with_network2(
             "model_type": model_type,
             "model_file": model_file,
             "trained_model_dir": trained_model_dir,
-            "extra_args": extra_args
+            "extra_args": extra_args,
+            "transfer_model": transfer_model,
+            "freeze_transferred": freeze_hidden,
+            "normalization": normalizer.to_dict(),
         }
 
         if learning_algorithm == "annealing":
             net, summary = mini_batch_sgd_with_annealing(**training_routine_args)
         else:
             net, summary = mini_batch_sgd(**training_routine_args)
-
-        errors, probs = predict(prc_test, test_targets, training_routine_args['batch_size'], net,
-                                model_file=summary['best_model'])
+        metrics.add_training(summary['timings'])
+        if transfer_model is not None:
+            print("{0}:{1} fine-tuned {2} of {3} params for {4} epochs, best model at epoch {5}"
+                  .format(title, i, len(net.params) - len(summary['frozen_params']), len(net.params), epochs,
+                          summary['best_epoch']), file=sys.stderr)
+
+        with metrics.timer("evaluate"):
+            errors, probs = predict(test_data, test_targets, training_routine_args['batch_size'], net,
+                                    model_file=summary['best_model'])
         errors = 1 - np.mean(errors)
         print("{0}: {1} test accuracy.".format(title, (errors * 100)))
         out_file.write("{}\n".format(errors))
         scores.append(errors)
 
-        with open("{}test_probs.pkl".format(trained_model_dir), 'w') as probs_file:
-            cPickle.dump(probs, probs_file)
+        with metrics.timer("checkpoint"):
+            with open("{}test_probs.pkl".format(trained_model_dir), 'w') as probs_file:
+                cPickle.dump(probs, probs_file)
+            # lined up with test_probs, predict leaves out the last partial batch
+            with open("{}test_provenance.pkl".format(trained_model_dir), 'w') as provenance_file:
+                cPickle.dump(test_provenance[:len(probs)], provenance_file)
+        if manifest is not None:
+            manifest.complete(key, title, i, errors, best_model=summary['best_model'], model_dir=trained_model_dir,
+                              files=[summary['best_model'], trained_model_dir + "test_probs.pkl"])
+        metrics.emit(metrics_file)
+        site_metrics.merge(metrics)
+        if store is not None:
+            store.record_iteration(run_id, i, errors, summary=summary,
+                                   artifacts=iteration_artifacts(trained_model_dir), metrics=metrics.values())
 
     print(">{motif}\t{accuracy}".format(motif=title, accuracy=np.mean(scores), end="\n"), file=out_file)
+    site_metrics.emit(metrics_file)
+    if store is not None:
+        store.finish_run(run_id, np.mean(scores))
+        store.close()
+    return net
+
+
+def classify_multi_task(
+        # alignment files
+        group_1, group_2, group_3,  # group_3 can be None for 2-way classification
+        # which data to use
+        strand, sites, preprocess, events_per_pos, feature_set, title,
+        # training params
+        learning_algorithm, train_test_split, iterations, epochs, max_samples, batch_size,
+        # model params
+        learning_rate, L1_reg, L2_reg, hidden_dim, model_type, model_dir=None, extra_args=None,
+        # record the run in a results database (see results_store.py)
+        results_db=None, experiment=None,
+        # skip the iterations that finished in an earlier run, see manifest.py
+        manifest_file=None, resume=True,
+        # output params
+        out_path="./"):
+    # one network for all of the sites (config['sites']). The vectors from every site are trained on together with
+    # a one-hot vector for the site appended after pre-processing, the accuracy is reported for each site.
+    # title is used for the output file and model directory
+    groups = [g for g in (group_1, group_2, group_3) if g is not None]
+    site_titles = [site['title'] for site in sites]
+    nb_sites = len(sites)
+    out_file = open(out_path + title + ".tsv", 'wa')
+    store, run_id = start_results_run(results_db, title, run_params(locals()), experiment=experiment,
+                                      model_type=model_type, out_path=out_path, command=" ".join(sys.argv))
+    manifest, key = open_manifest(manifest_file, resume=resume), manifest_key(locals())
+    # returned if every iteration finished in an earlier run
+    net = None
+    if model_dir is not None:
+        print("looking for model in {}".format(os.path.abspath(model_dir)))
+        model_file = find_model_path(os.path.abspath(model_dir), title)
+    else:
+        model_file = None
+
+    working_directory_path = "{outpath}/{title}_Models/".format(outpath=out_path, title=title)
+    if not os.path.exists(working_directory_path):
+        os.makedirs(working_directory_path)
+    # the order of the one-hot site vectors
+    with open("{}site_titles.pkl".format(working_directory_path), 'w') as f:
+        cPickle.dump(site_titles, f)
+
+    scores = dict((site_title, []) for site_title in site_titles)
+    best_accuracy, best_model = -1, None
+    accuracies = []
+
+    collect_data_vectors_args = {
+        "events_per_pos": events_per_pos,
+        "portion": train_test_split,
+        "strand": strand,
+        "max_samples": max_samples,
+        "feature_set": feature_set,
+        "kmer_length": 6,
+    }
+
+    site_metrics = PipelineMetrics(title=title, iteration="all")
+    metrics_file = out_path + title + "_metrics.jsonl"
+
+    for i in xrange(iterations):
+        done = resume_iteration(manifest, key, title, i, store, run_id)
+        if done is not None:
+            for site_title in site_titles:
+                if site_title in done['site_accuracies']:
+                    out_file.write("{0}\t{1}\n".format(site_title, done['site_accuracies'][site_title]))
+                    scores[site_title].append(done['site_accuracies'][site_title])
+            if done['accuracy'] > best_accuracy:
+                best_accuracy, best_model = done['accuracy'], done['best_model']
+            accuracies.append(done['accuracy'])
+            continue
+        metrics = PipelineMetrics(title=title, iteration=i)
+        # [train, xtrain, test] -> list of (vectors, labels, site indices) for each site
+        datasets = [[], [], []]
+        for s, site in enumerate(sites):
+            group_sets = [collect_data_vectors2(label=n, files=group, motif_starts=site['motif_start_position'][n],
+                                                dataset_title=site['title'] + "_group{}".format(n),
+                                                metrics=metrics, **collect_data_vectors_args)
+                          for n, group in enumerate(groups)]
+            levels = []
+            for k in xrange(3):
+                # level each site's groups so that the model gets equal exposure
+                level = np.min([len(group_set[k][0]) for group_set in group_sets])
+                levels.append(level)
+                if level == 0:
+                    continue
+                datasets[k].append((np.vstack([group_set[k][0][:level] for group_set in group_sets]),
+                                    np.concatenate([group_set[k][1][:level] for group_set in group_sets]),
+                                    np.full(level * len(groups), s, dtype=np.int32)))
+            print("{motif}: {site} training, cross-training and test vectors leveled to {levels}".format(
+                motif=title, site=site['title'], levels=levels), file=sys.stderr)
+
+        assert(all(len(d) > 0 for d in datasets)), "didn't get training, cross-training and test vectors"
+        (training_data, training_labels, training_sites), (xtrain_data, xtrain_targets, xtrain_sites), \
+            (test_data, test_targets, test_sites) = [[np.concatenate(x) for x in zip(*d)] for d in datasets]
+
+        with metrics.timer("preprocess"):
+            normalizer = Normalizer.fit(row_chunks(training_data), preprocess=preprocess)
+            prc_train, prc_xtrain = normalizer.transform(training_data), normalizer.transform(xtrain_data)
+            prc_train = append_site_one_hot(prc_train, training_sites, nb_sites)
+            prc_xtrain = append_site_one_hot(prc_xtrain, xtrain_sites, nb_sites)
+            # predict normalizes the test vectors with the statistics in the model, the one-hot is left alone
+            test_data = append_site_one_hot(test_data, test_sites, nb_sites)
+
+        X, y = shuffle_and_maintain_labels(prc_train, training_labels)
+
+        trained_model_dir = "{workingdirpath}{iteration}/".format(workingdirpath=working_directory_path,
+                                                                  iteration=i)
+
+        training_routine_args = {
+            "motif": title,
+            "train_data": X,
+            "labels": y,
+            "xTrain_data": prc_xtrain,
+            "xTrain_targets": xtrain_targets,
+            "learning_rate": learning_rate,
+            "L1_reg": L1_reg,
+            "L2_reg": L2_reg,
+            "epochs": epochs,
+            "batch_size": batch_size,
+            "hidden_dim": hidden_dim,
+            "model_type": model_type,
+            "model_file": model_file,
+            "trained_model_dir": trained_model_dir,
+            "extra_args": extra_args,
+            "normalization": normalizer.to_dict(),
+        }
+
+        if learning_algorithm == "annealing":
+            net, summary = mini_batch_sgd_with_annealing(**training_routine_args)
+        else:
+            net, summary = mini_batch_sgd(**training_routine_args)
+        metrics.add_training(summary['timings'])
+
+        with metrics.timer("evaluate"):
+            errors, probs = predict(test_data, test_targets, training_routine_args['batch_size'], net,
+                                    model_file=summary['best_model'])
+        # predict leaves out the last partial batch
+        calls = np.argmax(probs, axis=1) if len(probs) > 0 else np.array([], dtype=np.int32)
+        correct = calls == test_targets[:len(calls)]
+        accuracy = np.mean(correct)
+        for s, site_title in enumerate(site_titles):
+            site_correct = correct[test_sites[:len(calls)] == s]
+            if len(site_correct) == 0:
+                continue
+            print("{0}:{1}:{2}:{3} test accuracy.".format(title, site_title, i, np.mean(site_correct) * 100))
+            out_file.write("{0}\t{1}\n".format(site_title, np.mean(site_correct)))
+            scores[site_title].append(np.mean(site_correct))
+        print("{0}:{1}:{2} test accuracy.".format(title, i, (accuracy * 100)))
+
+        if accuracy > best_accuracy:
+            best_accuracy, best_model = accuracy, summary['best_model']
+
+        with metrics.timer("checkpoint"):
+            with open("{}test_probs.pkl".format(trained_model_dir), 'w') as probs_file:
+                cPickle.dump(zip(probs, test_targets, test_sites), probs_file)
+        if manifest is not None:
+            manifest.complete(key, title, i, accuracy, best_model=summary['best_model'], model_dir=trained_model_dir,
+                              files=[summary['best_model'], trained_model_dir + "test_probs.pkl"],
+                              site_accuracies=dict((site_title, site_scores[-1]) for site_title, site_scores
+                                                   in scores.items() if len(site_scores) == i + 1))
+        metrics.emit(metrics_file)
+        site_metrics.merge(metrics)
+        if store is not None:
+            # the accuracy of each site with test vectors in this iteration
+            site_accuracies = dict(("site_accuracy:{}".format(site_title), site_scores[-1])
+                                   for site_title, site_scores in scores.items() if len(site_scores) == i + 1)
+            site_accuracies.update(metrics.values())
+            store.record_iteration(run_id, i, accuracy, summary=summary,
+                                   artifacts=iteration_artifacts(trained_model_dir), metrics=site_accuracies)
+        accuracies.append(accuracy)
+
+    # copy the best model of all the iterations to where find_model_path looks for it
+    final_model = "{}multi_task_model.pkl".format(working_directory_path)
+    assert(best_model), "{0}: no iteration saved a model to keep (iterations={1}, test accuracies={2})".format(
+        title, iterations, accuracies)
+    shutil.copyfile(best_model, final_model)
+    with open("{}summary_stats.pkl".format(working_directory_path), 'w') as f:
+        cPickle.dump({"best_model": final_model, "site_titles": site_titles, "test_accuracy": best_accuracy}, f)
+
+    site_metrics.emit(metrics_file)
+    for site_title in site_titles:
+        if len(scores[site_title]) > 0:
+            print(">{motif}\t{accuracy}".format(motif=site_title, accuracy=np.mean(scores[site_title])),
+                  file=out_file)
+    if store is not None:
+        store.finish_run(run_id, np.mean(accuracies))
+        store.close()
+
+    return net
+
+
+def classify_with_recurrent_network(
+        # alignment files
+        group_1, group_2, group_3,  # group_3 can be None for 2-way classification
+        # which data to use
+        strand, motif_start_positions, preprocess, events_per_pos, feature_set, title,
+        # training params
+        learning_algorithm, train_test_split, iterations, epochs, max_samples, batch_size,
+        # model params
+        learning_rate, L1_reg, L2_reg, hidden_dim, model_type, model_dir=None, extra_args=None,
+        # record the run in a results database (see results_store.py)
+        results_db=None, experiment=None,
+        # skip the iterations that finished in an earlier run, see manifest.py
+        manifest_file=None, resume=True,
+        # output params
+        out_path="./"):
+    # the recurrent models use every event aligned to each motif, so events_per_pos is not used here, it's kept
+    # in the signature so the same arguments can be passed to all of the classify_with_network functions.
+    # learning_algorithm is ignored as well, there isn't an annealing routine for the recurrent models yet
+    groups = [g for g in (group_1, group_2, group_3) if g is not None]
+    assert(len(motif_start_positions) >= len(groups))
+    out_file = open(out_path + title + ".tsv", 'wa')
+    store, run_id = start_results_run(results_db, title, run_params(locals()), experiment=experiment,
+                                      model_type=model_type, out_path=out_path, command=" ".join(sys.argv))
+    manifest, key = open_manifest(manifest_file, resume=resume), manifest_key(locals())
+    # returned if every iteration finished in an earlier run
+    net = None
+    if model_dir is not None:
+        print("looking for model in {}".format(os.path.abspath(model_dir)))
+        model_file = find_model_path(os.path.abspath(model_dir), title)
+    else:
+        model_file = None
+
+    scores = []
+
+    collect_sequence_vectors_args = {
+        "portion": train_test_split,
+        "strand": strand,
+        "max_samples": max_samples,
+        "feature_set": feature_set,
+        "kmer_length": 6
+    }
+
+    site_metrics = PipelineMetrics(title=title, iteration="all")
+    metrics_file = out_path + title + "_metrics.jsonl"
+
+    for i in xrange(iterations):
+        done = resume_iteration(manifest, key, title, i, store, run_id)
+        if done is not None:
+            out_file.write("{}\n".format(done['accuracy']))
+            scores.append(done['accuracy'])
+            continue
+        metrics = PipelineMetrics(title=title, iteration=i)
+        list_of_datasets = []  # [((g1, g1l), (xg1, xg1l), (tg1, tg1l)), ... ]
+        for n, group in enumerate(groups):
+            list_of_datasets.append(collect_sequence_vectors(label=n,
+                                                             files=group,
+                                                             motif_starts=motif_start_positions[n],
+                                                             dataset_title=title + "_group{}".format(n),
+                                                             metrics=metrics,
+                                                             **collect_sequence_vectors_args))
+
+        # level each split so that the model gets equal exposure to each group, then stack them
+        leveled = []
+        for set_idx, set_name in enumerate(("training", "cross-training", "test")):
+            counts = [len(dataset[set_idx][0]) for dataset in list_of_datasets]
+            level = np.min(counts)
+            print("{motif}: got {counts} {name} sequences, leveled to {level}"
+                  .format(motif=title, counts=counts, name=set_name, level=level), file=sys.stderr)
+            sequences = list(chain(*[dataset[set_idx][0][:level] for dataset in list_of_datasets]))
+            targets = np.concatenate([dataset[set_idx][1][:level] for dataset in list_of_datasets])
+            leveled.append((sequences, targets))
+
+        (training_data, training_labels), (xtrain_data, xtrain_targets), (test_data, test_targets) = leveled
+        assert(len(training_data) > 0), "got zero training sequences"
+
+        with metrics.timer("preprocess"):
+            # each sequence is a chunk of the training events
+            normalizer = Normalizer.fit(training_data, preprocess=preprocess,
+                                        nb_features=get_nb_features(feature_set))
+            prc_train = normalizer.transform_sequences(training_data)
+            prc_xtrain = normalizer.transform_sequences(xtrain_data)
+
+        working_directory_path = "{outpath}/{title}_Models/".format(outpath=out_path, title=title)
+        if not os.path.exists(working_directory_path):
+            os.makedirs(working_directory_path)
+        trained_model_dir = "{workingdirpath}{iteration}/".format(workingdirpath=working_directory_path,
+                                                                  iteration=i)
+
+        net, summary = mini_batch_sgd_recurrent(motif=title,
+                                                train_data=prc_train,
+                                                labels=training_labels,
+                                                xTrain_data=prc_xtrain,
+                                                xTrain_targets=xtrain_targets,
+                                                learning_rate=learning_rate,
+                                                L1_reg=L1_reg,
+                                                L2_reg=L2_reg,
+                                                epochs=epochs,
+                                                batch_size=batch_size,
+                                                hidden_dim=hidden_dim,
+                                                model_type=model_type,
+                                                model_file=model_file,
+                                                trained_model_dir=trained_model_dir,
+                                                extra_args=extra_args,
+                                                normalization=normalizer.to_dict())
+        metrics.add_training(summary['timings'])
+
+        with metrics.timer("evaluate"):
+            errors, probs = predict_sequences(test_data, test_targets, batch_size, net,
+                                              model_file=summary['best_model'])
+        # the test batches aren't all the same size, so get the accuracy from the probabilities directly
+        errors = np.mean(np.argmax(probs, axis=1) == test_targets)
+        probs = zip(probs, test_targets)
+
+        print("{0}:{1}:{2} test accuracy.".format(title, i, (errors * 100)))
+        out_file.write("{}\n".format(errors))
+        scores.append(errors)
+
+        with metrics.timer("checkpoint"):
+            with open("{}test_probs.pkl".format(trained_model_dir), 'w') as probs_file:
+                cPickle.dump(probs, probs_file)
+        if manifest is not None:
+            manifest.complete(key, title, i, errors, best_model=summary['best_model'], model_dir=trained_model_dir,
+                              files=[summary['best_model'], trained_model_dir + "test_probs.pkl"])
+        metrics.emit(metrics_file)
+        site_metrics.merge(metrics)
+        if store is not None:
+            store.record_iteration(run_id, i, errors, summary=summary,
+                                   artifacts=iteration_artifacts(trained_model_dir), metrics=metrics.values())
+
+    print(">{motif}\t{accuracy}".format(motif=title, accuracy=np.mean(scores), end="\n"), file=out_file)
+    site_metrics.emit(metrics_file)
+    if store is not None:
+        store.finish_run(run_id, np.mean(scores))
+        store.close()
+
     return net
 
 
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Normalization of the feature vectors (run_nn.py's --preprocess). The mean (and standard deviation) of each
+feature are computed from the training vectors in one pass over chunks, so the training matrix doesn't have to be
+in memory, and are written in the model file so predict and the predictors apply the same transform to new reads
+"""
+from __future__ import print_function
+import numpy as np
+from online_stats import NanRunningMoments
+
+PREPROCESS_OPTIONS = [None, "center", "normalize"]
+CHUNK_SIZE = 10000
+
+
+def row_chunks(vectors, chunk_size=CHUNK_SIZE):
+    for k in xrange(0, len(vectors), chunk_size):
+        yield vectors[k:k + chunk_size]
+
+
+class Normalizer(object):
+    """Centers ("center") or standardizes ("normalize") the first len(mean) features of a vector and sets NaNs to
+    0, with preprocess=None only the NaNs are set to 0
+    """
+    def __init__(self, preprocess=None, mean=None, std=None):
+        assert(preprocess in PREPROCESS_OPTIONS), "preprocess options are {}".format(PREPROCESS_OPTIONS)
+        assert((mean is None) == (preprocess is None)), "{} needs the feature means".format(preprocess)
+        assert((std is None) == (preprocess != "normalize")), "normalize needs the feature standard deviations"
+        self.preprocess = preprocess
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        self.std = None if std is None else np.asarray(std, dtype=np.float64)
+
+    @classmethod
+    def fit(cls, chunks, preprocess=None, nb_features=None):
+        """Fit the statistics on chunks, an iterable of (k, dim) arrays (eg. row_chunks of the training vectors, or
+        the vectors of each alignment file as they're read). NaNs are left out, only the first nb_features columns
+        are used (default all of them). Features with no variance are only centered
+        """
+        if preprocess is None:
+            return cls()
+        moments = None
+        for chunk in chunks:
+            chunk = np.asarray(chunk)[:, :nb_features]
+            if moments is None:
+                moments = NanRunningMoments(chunk.shape[1])
+            moments.push(chunk)
+        assert(moments is not None), "no training vectors to fit the normalization to"
+        std = None
+        if preprocess == "normalize":
+            std = np.sqrt(moments.variance(ddof=0))
+            std[std == 0] = 1.0
+        return cls(preprocess=preprocess, mean=moments.mean, std=std)
+
+    def transform(self, x, dtype=None):
+        """Normalized copy of x, (n, dim) vectors or a (nb_events, dim) sequence. Columns after the first len(mean)
+        (eg. the multi-task site one-hot) only have their NaNs set to 0
+        """
+        x = np.array(x, dtype=dtype)
+        if self.mean is not None:
+            assert(x.shape[-1] >= len(self.mean)), "data has {0} features, the normalization is for {1}".format(
+                x.shape[-1], len(self.mean))
+            x[..., :len(self.mean)] -= self.mean
+            if self.std is not None:
+                x[..., :len(self.mean)] /= self.std
+        return np.nan_to_num(x)
+
+    def transform_sequences(self, sequences, dtype=None):
+        return [self.transform(sequence, dtype=dtype) for sequence in sequences]
+
+    def to_dict(self):
+        # what's kept in the model file, plain arrays so the file doesn't depend on this class
+        return {"preprocess": self.preprocess, "mean": self.mean, "std": self.std}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls() if d is None else cls(preprocess=d['preprocess'], mean=d['mean'], std=d['std'])
+
+
+def model_normalizer(model):
+    """The Normalizer of a model dict (as written by Model.write), models written before the statistics were kept
+    get one that only sets NaNs to 0
+    """
+    return Normalizer.from_dict(model.get('normalization'))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""Online (one pass, constant memory) statistics for aggregating per-read calls into per-site summaries
+"""
+from __future__ import print_function
+import numpy as np
+
+
+class RunningMoments(object):
+    """Count, mean and variance of a stream of dim-dimensional vectors. Batches are folded in with the pairwise
+    update of Chan et al. so the result matches a two-pass computation without keeping the data
+    """
+    def __init__(self, dim=1):
+        self.n = 0
+        self.mean = np.zeros(dim)
+        self.m2 = np.zeros(dim)  # sum of squared differences from the mean
+
+    def merge_moments(self, n, mean, m2):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (float(n) / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (float(self.n) * n / total)
+        self.n = total
+
+    def push(self, x):
+        """Add a batch, x is (k, dim) (or a single vector)
+        """
+        x = np.atleast_2d(np.asarray(x, dtype=np.float64))
+        if len(x) == 0:
+            return
+        mean = x.mean(axis=0)
+        self.merge_moments(len(x), mean, ((x - mean) ** 2).sum(axis=0))
+
+    def merge(self, other):
+        self.merge_moments(other.n, other.mean, other.m2)
+
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.zeros_like(self.m2)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+
+class NanRunningMoments(RunningMoments):
+    """RunningMoments that skips NaNs, each dimension keeps its own count of the values it has seen
+    """
+    def __init__(self, dim=1):
+        super(NanRunningMoments, self).__init__(dim)
+        self.n = np.zeros(dim, dtype=np.int64)
+
+    def merge_moments(self, n, mean, m2):
+        total = self.n + n
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.where(total > 0, self.mean + delta * n / total.astype(np.float64), 0.0)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta ** 2 * self.n * n / total.astype(np.float64), 0.0)
+        self.n = total
+
+    def push(self, x):
+        x = np.atleast_2d(np.asarray(x, dtype=np.float64))
+        if len(x) == 0:
+            return
+        count = np.sum(~np.isnan(x), axis=0)
+        mean = np.nansum(x, axis=0) / np.maximum(count, 1)
+        self.merge_moments(count, mean, np.nansum((x - mean) ** 2, axis=0))
+
+    def variance(self, ddof=1):
+        return np.where(self.n > ddof, self.m2 / np.maximum(self.n - ddof, 1), 0.0)
+
+
+class SiteStats(object):
+    """Coverage, probability moments and call counts for one site
+    """
+    def __init__(self, n_classes):
+        self.moments = RunningMoments(n_classes)
+        self.calls = np.zeros(n_classes, dtype=np.int64)
+
+    def push(self, probs):
+        self.moments.push(probs)
+        self.calls += np.bincount(np.argmax(probs, axis=1), minlength=len(self.calls))
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.calls += other.calls
+
+    @property
+    def coverage(self):
+        return self.moments.n
+
+
+class SiteAggregator(object):
+    """Merges per-read probabilities into per-site coverage, mean (and standard deviation of the) probability of
+    each class and the fraction of reads called as each class. Memory grows with the number of sites, not reads.
+    Sites are keyed by (title, motif_start)
+    """
+    def __init__(self, n_classes):
+        self.n_classes = n_classes
+        self.sites = {}
+
+    def site(self, key):
+        if key not in self.sites:
+            self.sites[key] = SiteStats(self.n_classes)
+        return self.sites[key]
+
+    def add(self, titles, motif_starts, probs):
+        """Add a batch of per-read probabilities, titles and motif_starts give the site of each row of probs. A single
+        title can be given for the whole batch
+        """
+        probs = np.asarray(probs)
+        assert(probs.ndim == 2 and probs.shape[1] == self.n_classes), "expected probabilities for {} classes".format(
+            self.n_classes)
+        if isinstance(titles, basestring):
+            titles = [titles] * len(probs)
+        rows = {}
+        for i, key in enumerate(zip(titles, motif_starts)):
+            rows.setdefault(key, []).append(i)
+        for key, index in rows.iteritems():
+            self.site(key).push(probs[index])
+
+    def merge(self, other):
+        assert(other.n_classes == self.n_classes), "can't merge aggregators with different numbers of classes"
+        for key, stats in other.sites.iteritems():
+            self.site(key).merge(stats)
+
+    def header(self):
+        classes = xrange(self.n_classes)
+        return "\t".join(["site", "motif_start", "coverage"] + ["mean_p_{}".format(c) for c in classes] +
+                         ["sd_p_{}".format(c) for c in classes] + ["call_fraction_{}".format(c) for c in classes])
+
+    def rows(self):
+        for (title, motif_start) in sorted(self.sites.keys()):
+            stats = self.sites[(title, motif_start)]
+            yield [title, motif_start, stats.coverage] + list(stats.moments.mean) + list(stats.moments.std()) + \
+                list(stats.calls / float(stats.coverage))
+
+    def write(self, out):
+        out.write(self.header() + "\n")
+        for row in self.rows():
+            out.write("\t".join([row[0], str(row[1]), str(row[2])] + ["{:.6f}".format(v) for v in row[3:]]) + "\n")
+
+
+class PositionStats(object):
+    """Count, mean, variance, min and max of a feature at each of a fixed set of reference positions, kept in arrays
+    indexed like positions. With bin_edges each position also gets a histogram that approximate quantiles are read
+    from, histograms with the same edges merge by adding them
+    """
+    def __init__(self, positions, bin_edges=None):
+        self.positions = np.asarray(positions, dtype=np.int64)
+        nb_positions = len(self.positions)
+        self.count = np.zeros(nb_positions, dtype=np.int64)
+        self.mean = np.zeros(nb_positions)
+        self.m2 = np.zeros(nb_positions)
+        self.min = np.full(nb_positions, np.inf)
+        self.max = np.full(nb_positions, -np.inf)
+        self.bin_edges = None if bin_edges is None else np.asarray(bin_edges, dtype=np.float64)
+        self.histogram = None if bin_edges is None else np.zeros((nb_positions, len(bin_edges) - 1), dtype=np.int64)
+
+    def index(self, positions):
+        index = np.searchsorted(self.positions, positions)
+        assert(np.all(self.positions[np.minimum(index, len(self.positions) - 1)] == positions)), \
+            "got positions that aren't being collected"
+        return index
+
+    def merge_moments(self, index, count, mean, m2):
+        # the same pairwise update as RunningMoments, for the positions in index
+        total = self.count[index] + count
+        delta = mean - self.mean[index]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean[index] = np.where(total > 0, self.mean[index] + delta * count / total, 0.0)
+            self.m2[index] = np.where(total > 0, self.m2[index] + m2 + delta ** 2 * self.count[index] * count / total,
+                                      0.0)
+        self.count[index] = total
+
+    def push(self, positions, values):
+        """Add the values observed at positions (one value per entry), grouped by position with one sort
+        """
+        positions, values = np.asarray(positions), np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        order = np.argsort(positions, kind='mergesort')
+        positions, values = positions[order], values[order]
+        unique, starts, count = np.unique(positions, return_index=True, return_counts=True)
+        sums = np.add.reduceat(values, starts)
+        mean = sums / count
+        m2 = np.add.reduceat((values - np.repeat(mean, count)) ** 2, starts)
+        index = self.index(unique)
+        self.merge_moments(index, count, mean, m2)
+        self.min[index] = np.minimum(self.min[index], np.minimum.reduceat(values, starts))
+        self.max[index] = np.maximum(self.max[index], np.maximum.reduceat(values, starts))
+        if self.histogram is not None:
+            # values outside of the edges go in the first and last bins
+            bins = np.clip(np.searchsorted(self.bin_edges, values, side='right') - 1, 0, self.histogram.shape[1] - 1)
+            np.add.at(self.histogram, (self.index(positions), bins), 1)
+
+    def merge(self, other):
+        assert(np.array_equal(self.positions, other.positions)), "can't merge stats for different positions"
+        index = np.arange(len(self.positions))
+        self.merge_moments(index, other.count, other.mean, other.m2)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        if self.histogram is not None:
+            assert(np.array_equal(self.bin_edges, other.bin_edges)), "can't merge histograms with different bins"
+            self.histogram += other.histogram
+
+    def variance(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), 0.0)
+
+    def quantiles(self, q):
+        """(nb_positions, len(q)) approximate quantiles from the histograms, interpolated within a bin
+        """
+        assert(self.histogram is not None), "quantiles need histograms, give bin_edges"
+        q = np.atleast_1d(q)
+        cumulative = np.cumsum(self.histogram, axis=1)
+        result = np.full((len(self.positions), len(q)), np.nan)
+        for i in np.flatnonzero(self.count > 0):
+            # the fraction of the way through the observations, placed along the bin edges
+            result[i] = np.interp(q * cumulative[i, -1], np.concatenate([[0], cumulative[i]]), self.bin_edges)
+        return result
+
+    def arrays(self):
+        """Dict of arrays, what motif_stats_collector writes
+        """
+        arrays = {"positions": self.positions, "count": self.count, "mean": self.mean, "variance": self.variance(),
+                  "min": self.min, "max": self.max}
+        if self.histogram is not None:
+            arrays["bin_edges"] = self.bin_edges
+            arrays["histogram"] = self.histogram
+        return arrays
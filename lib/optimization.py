@@ -1,23 +1,57 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import os, sys
+import time
 import cPickle
 import theano
 import theano.tensor as T
 import numpy as np
-from utils import shared_dataset, get_network
+from utils import shared_dataset, get_network, bucket_sequences
+from profiling import theano_profile
+
+
+def compile_function(timings, *args, **kwargs):
+    # theano.function, adding the time it took to timings["compile_seconds"], profiled under profile_call
+    kwargs.setdefault("profile", theano_profile(kwargs.get("name")))
+    start = time.time()
+    function = theano.function(*args, **kwargs)
+    timings["compile_seconds"] += time.time() - start
+    return function
+
+
+def finish_timings(timings, steps, samples):
+    # the rates are over the time spent in the update steps, not the accuracy checks
+    timings["steps"] = steps
+    timings["samples"] = samples
+    timings["steps_per_sec"] = steps / timings["train_seconds"] if timings["train_seconds"] > 0 else None
+    timings["samples_per_sec"] = samples / timings["train_seconds"] if timings["train_seconds"] > 0 else None
+    return timings
 
 
 def mini_batch_sgd(motif, train_data, labels, xTrain_data, xTrain_targets,
                    learning_rate, L1_reg, L2_reg, epochs,
                    batch_size,
                    hidden_dim, model_type, model_file=None,
-                   trained_model_dir=None, verbose=True, extra_args=None
-                   ):
+                   trained_model_dir=None, verbose=True, extra_args=None,
+                   update_masks=None, soft_targets=None, transfer_model=None, freeze_transferred=False,
+                   normalization=None):
+    # update_masks is an optional dict of parameter name to a 0/1 array with the parameter's shape, the updates are
+    # multiplied by the mask so masked out entries (eg. pruned weights) keep their initial value.
+    # soft_targets is an optional (n_train_samples, n_classes) array of class probabilities (eg. from a teacher
+    # network), when it's given the network is trained on the cross-entropy with them instead of with the labels,
+    # the labels are still used for the training accuracy.
+    # transfer_model is a model file to initialize the hidden layers from (see Model.transfer_from_file), with
+    # freeze_transferred the transferred params aren't updated and only the softmax layer is trained.
+    # normalization is the Normalizer.to_dict() the data was normalized with, it's written in the model files
     # Preamble #
+    # loading model_file would overwrite the transferred params
+    assert(model_file is None or transfer_model is None), "give a model_file to continue from or a transfer_model"
+    timings = {"graph_seconds": 0.0, "compile_seconds": 0.0, "train_seconds": 0.0, "eval_seconds": 0.0,
+               "checkpoint_seconds": 0.0}
+    start = time.time()
     # determine dimensionality of data and number of classes
     n_train_samples, data_dim = train_data.shape
-    n_classes = len(set(labels))
+    n_classes = len(set(labels)) if soft_targets is None else soft_targets.shape[1]
 
     # compute number of mini-batches for training, validation and testing
     train_set_x, train_set_y = shared_dataset(train_data, labels, True)
@@ -37,41 +71,68 @@ def mini_batch_sgd(motif, train_data, labels, xTrain_data, xTrain_targets,
     if net is False:
         return False
 
-    # cost function
-    cost = (net.negative_log_likelihood(labels=y) + L1_reg * net.L1 + (L2_reg / n_train_samples) * net.L2_sq)
+    # warm start, the frozen params are left out of the updates
+    transferred = net.transfer_from_file(file_path=transfer_model) if transfer_model is not None else []
+    trainable = [param for param in net.params if not (freeze_transferred and "{}".format(param) in transferred)]
 
-    xtrain_fcn = theano.function(inputs=[batch_index],
-                                 outputs=net.errors(y),
-                                 givens={
-                                     x: xtrain_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
-                                     y: xtrain_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
-                                 })
+    # cost function
+    train_givens = {
+        x: train_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
+        y: train_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
+    }
+    if soft_targets is None:
+        cost = (net.negative_log_likelihood(labels=y) + L1_reg * net.L1 + (L2_reg / n_train_samples) * net.L2_sq)
+    else:
+        t = T.matrix('t')
+        train_set_t = theano.shared(np.asarray(soft_targets, dtype=theano.config.floatX), borrow=True)
+        cost = (-T.mean(T.sum(t * T.log(net.output), axis=1)) + L1_reg * net.L1 +
+                (L2_reg / n_train_samples) * net.L2_sq)
+        train_givens = {
+            x: train_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
+            t: train_set_t[batch_index * batch_size: (batch_index + 1) * batch_size]
+        }
+
+    xtrain_fcn = compile_function(timings, name="xtrain",
+                                  inputs=[batch_index],
+                                  outputs=net.errors(y),
+                                  givens={
+                                      x: xtrain_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
+                                      y: xtrain_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
+                                  })
 
     # gradients
-    nambla_params = [T.grad(cost, param) for param in net.params]
+    nambla_params = [T.grad(cost, param) for param in trainable]
+
+    if update_masks is not None:
+        nambla_params = [nambla_param * np.asarray(update_masks["{}".format(param)], dtype=theano.config.floatX)
+                         if "{}".format(param) in update_masks else nambla_param
+                         for param, nambla_param in zip(trainable, nambla_params)]
 
     # update tuple
     updates = [(param, param - learning_rate * nambla_param)
-               for param, nambla_param in zip(net.params, nambla_params)]
+               for param, nambla_param in zip(trainable, nambla_params)]
 
     # main function? could make this an attribute and reduce redundant code
-    train_fcn = theano.function(inputs=[batch_index],
-                                outputs=cost,
-                                updates=updates,
-                                givens={
-                                    x: train_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
-                                    y: train_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
-                                })
-
-    train_error_fcn = theano.function(inputs=[batch_index],
-                                      outputs=net.errors(y),
-                                      givens={
-                                          x: train_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
-                                          y: train_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
-                                      })
+    train_fcn = compile_function(timings, name="train",
+                                 inputs=[batch_index],
+                                 outputs=cost,
+                                 updates=updates,
+                                 givens=train_givens)
+
+    train_error_fcn = compile_function(timings, name="train_error",
+                                       inputs=[batch_index],
+                                       outputs=net.errors(y),
+                                       givens={
+                                           x: train_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
+                                           y: train_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
+                                       })
 
     if model_file is not None:  # TODO fix the path here
         net.load_from_file(file_path=model_file, careful=True)
+    if normalization is not None:
+        net.normalization = normalization
+
+    timings["graph_seconds"] = time.time() - start - timings["compile_seconds"]
 
     # do the actual training
     batch_costs = [np.inf]
@@ -84,10 +145,12 @@ def mini_batch_sgd(motif, train_data, labels, xTrain_data, xTrain_targets,
 
     best_xtrain_accuracy = -np.inf
     best_model = ''
+    best_epoch = None
 
-    check_frequency = int(epochs / 10)
+    check_frequency = max(1, int(epochs / 10))
 
     for epoch in xrange(0, epochs):
+        eval_start = time.time()
         if epoch % check_frequency == 0:
             # get the accuracy on the cross-train data
             xtrain_errors = [xtrain_fcn(_) for _ in xrange(n_xtrain_batches)]
@@ -114,8 +177,16 @@ def mini_batch_sgd(motif, train_data, labels, xTrain_data, xTrain_targets,
                 # update the best accuracy and best model
                 best_xtrain_accuracy = avg_xtrain_accuracy
                 best_model = "{0}model{1}.pkl".format(trained_model_dir, epoch)
+                best_epoch = epoch
+                checkpoint_start = time.time()
                 net.write(best_model)
+                checkpoint_seconds = time.time() - checkpoint_start
+                timings["checkpoint_seconds"] += checkpoint_seconds
+                # so it's left out of the accuracy check time
+                eval_start += checkpoint_seconds
 
+        train_start = time.time()
+        timings["eval_seconds"] += train_start - eval_start
         for i in xrange(n_train_batches):
             batch_avg_cost = train_fcn(i)
             try:
@@ -123,6 +194,7 @@ def mini_batch_sgd(motif, train_data, labels, xTrain_data, xTrain_targets,
                     add_to_batch_costs(float(batch_avg_cost))
             except ZeroDivisionError:
                 pass
+        timings["train_seconds"] += time.time() - train_start
 
     # pickle the summary stats for the training
     summary = {
@@ -130,7 +202,12 @@ def mini_batch_sgd(motif, train_data, labels, xTrain_data, xTrain_targets,
         "xtrain_accuracies": xtrain_accuracies,
         "train_accuracies": train_accuracies,
         "xtrain_errors": xtrain_costs_bin,
-        "best_model": best_model
+        "best_model": best_model,
+        "best_epoch": best_epoch,
+        "epochs": epochs,
+        "transferred_params": transferred,
+        "frozen_params": [p for p in transferred if freeze_transferred],
+        "timings": finish_timings(timings, n_train_batches * epochs, n_train_batches * batch_size * epochs),
     }
     if trained_model_dir is not None:
         with open("{}summary_stats.pkl".format(trained_model_dir), 'w') as f:
@@ -143,8 +220,14 @@ def mini_batch_sgd_with_annealing(motif, train_data, labels, xTrain_data, xTrain
                                   learning_rate, L1_reg, L2_reg, epochs,
                                   batch_size,
                                   hidden_dim, model_type, model_file=None,
-                                  trained_model_dir=None, verbose=True, extra_args=None):
+                                  trained_model_dir=None, verbose=True, extra_args=None, transfer_model=None,
+                                  freeze_transferred=False, normalization=None):
     # Preamble #
+    # loading model_file would overwrite the transferred params
+    assert(model_file is None or transfer_model is None), "give a model_file to continue from or a transfer_model"
+    timings = {"graph_seconds": 0.0, "compile_seconds": 0.0, "train_seconds": 0.0, "eval_seconds": 0.0,
+               "checkpoint_seconds": 0.0}
+    start = time.time()
     # determine dimensionality of data and number of classes
     n_train_samples, data_dim = train_data.shape
     n_classes = len(set(labels))
@@ -167,43 +250,54 @@ def mini_batch_sgd_with_annealing(motif, train_data, labels, xTrain_data, xTrain
     if net is False:
         return False
 
+    # warm start, the frozen params are left out of the updates
+    transferred = net.transfer_from_file(file_path=transfer_model) if transfer_model is not None else []
+    trainable = [param for param in net.params if not (freeze_transferred and "{}".format(param) in transferred)]
+
     # cost function
     cost = (net.negative_log_likelihood(labels=y) + L1_reg * net.L1 + (L2_reg / n_train_samples) * net.L2_sq)
 
-    xtrain_fcn = theano.function(inputs=[batch_index],
-                                 outputs=net.errors(y),
-                                 givens={
-                                     x: xtrain_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
-                                     y: xtrain_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
-                                 })
+    xtrain_fcn = compile_function(timings, name="xtrain",
+                                  inputs=[batch_index],
+                                  outputs=net.errors(y),
+                                  givens={
+                                      x: xtrain_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
+                                      y: xtrain_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
+                                  })
 
     # gradients
-    nambla_params = [T.grad(cost, param) for param in net.params]
+    nambla_params = [T.grad(cost, param) for param in trainable]
 
     # update tuple
     dynamic_learning_rate = T.as_tensor_variable(learning_rate)
 
     # dynamic_learning_rate = learning_rate
     updates = [(param, param - dynamic_learning_rate * nambla_param)
-               for param, nambla_param in zip(net.params, nambla_params)]
+               for param, nambla_param in zip(trainable, nambla_params)]
 
     # main function? could make this an attribute and reduce redundant code
-    train_fcn = theano.function(inputs=[batch_index],
-                                outputs=cost,
-                                updates=updates,
-                                givens={
-                                    x: train_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
-                                    y: train_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
-                                })
-    train_error_fcn = theano.function(inputs=[batch_index],
-                                      outputs=net.errors(y),
-                                      givens={
-                                          x: train_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
-                                          y: train_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
-                                      })
+    train_fcn = compile_function(timings, name="train",
+                                 inputs=[batch_index],
+                                 outputs=cost,
+                                 updates=updates,
+                                 givens={
+                                     x: train_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
+                                     y: train_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
+                                 })
+    train_error_fcn = compile_function(timings, name="train_error",
+                                       inputs=[batch_index],
+                                       outputs=net.errors(y),
+                                       givens={
+                                           x: train_set_x[batch_index * batch_size: (batch_index + 1) * batch_size],
+                                           y: train_set_y[batch_index * batch_size: (batch_index + 1) * batch_size]
+                                       })
 
     if model_file is not None:
         net.load_from_file(file_path=model_file, careful=True)
+    if normalization is not None:
+        net.normalization = normalization
+
+    timings["graph_seconds"] = time.time() - start - timings["compile_seconds"]
 
     # do the actual training
     batch_costs = [np.inf]
@@ -217,10 +311,12 @@ def mini_batch_sgd_with_annealing(motif, train_data, labels, xTrain_data, xTrain
 
     best_xtrain_accuracy = -np.inf
     best_model = ''
-    check_frequency = int(epochs / 10)
+    best_epoch = None
+    check_frequency = max(1, int(epochs / 10))
 
     for epoch in xrange(0, epochs):
         # evaluation of training progress and summary stat collection
+        eval_start = time.time()
         if epoch % check_frequency == 0:
             # get the accuracy on the cross-train data
             xtrain_errors = [xtrain_fcn(_) for _ in xrange(n_xtrain_batches)]
@@ -247,14 +343,24 @@ def mini_batch_sgd_with_annealing(motif, train_data, labels, xTrain_data, xTrain
                 # update the best accuracy and best model
                 best_xtrain_accuracy = avg_xtrain_accuracy
                 best_model = "{0}model{1}.pkl".format(trained_model_dir, epoch)
+                best_epoch = epoch
+                checkpoint_start = time.time()
                 net.write(best_model)
+                checkpoint_seconds = time.time() - checkpoint_start
+                timings["checkpoint_seconds"] += checkpoint_seconds
+                # so it's left out of the accuracy check time
+                eval_start += checkpoint_seconds
 
+        train_start = time.time()
+        timings["eval_seconds"] += train_start - eval_start
         for i in xrange(n_train_batches):
             batch_avg_cost = train_fcn(i)
             if i % (n_train_batches / 10) == 0:
                 add_to_batch_costs(float(batch_avg_cost))
+        timings["train_seconds"] += time.time() - train_start
 
         # annealing protocol
+        anneal_start = time.time()
         mean_xtrain_cost = np.mean([xtrain_fcn(_) for _ in xrange(n_xtrain_batches)])
         if mean_xtrain_cost / prev_xtrain_cost < 1.0:
             dynamic_learning_rate *= 0.9
@@ -262,6 +368,138 @@ def mini_batch_sgd_with_annealing(motif, train_data, labels, xTrain_data, xTrain
         if mean_xtrain_cost > prev_xtrain_cost:
             dynamic_learning_rate *= 1.05
         prev_xtrain_cost = mean_xtrain_cost
+        timings["eval_seconds"] += time.time() - anneal_start
+
+    # pickle the summary stats for the training
+    summary = {
+        "batch_costs": batch_costs,
+        "xtrain_accuracies": xtrain_accuracies,
+        "train_accuracies": train_accuracies,
+        "xtrain_errors": xtrain_costs_bin,
+        "best_model": best_model,
+        "best_epoch": best_epoch,
+        "epochs": epochs,
+        "transferred_params": transferred,
+        "frozen_params": [p for p in transferred if freeze_transferred],
+        "timings": finish_timings(timings, n_train_batches * epochs, n_train_batches * batch_size * epochs),
+    }
+    if trained_model_dir is not None:
+        with open("{}summary_stats.pkl".format(trained_model_dir), 'w') as f:
+            cPickle.dump(summary, f)
+
+    return net, summary
+
+
+def mini_batch_sgd_recurrent(motif, train_data, labels, xTrain_data, xTrain_targets,
+                             learning_rate, L1_reg, L2_reg, epochs,
+                             batch_size,
+                             hidden_dim, model_type, model_file=None,
+                             trained_model_dir=None, verbose=True, extra_args=None, normalization=None):
+    # Same as mini_batch_sgd, but train_data and xTrain_data are lists of (nb_events, nb_features) sequences.
+    # The sequences are bucketed by length so each mini-batch is only padded to its own longest sequence
+    timings = {"graph_seconds": 0.0, "compile_seconds": 0.0, "train_seconds": 0.0, "eval_seconds": 0.0,
+               "checkpoint_seconds": 0.0}
+    start = time.time()
+    n_train_samples = len(train_data)
+    data_dim = train_data[0].shape[1]
+    n_classes = len(set(labels))
+
+    train_batches = bucket_sequences(train_data, labels, batch_size)
+    xtrain_batches = bucket_sequences(xTrain_data, xTrain_targets, batch_size, shuffle_batches=False)
+
+    # containers to hold mini-batches
+    x = T.tensor3('x')
+    y = T.ivector('y')
+
+    net = get_network(x=x, in_dim=data_dim, n_classes=n_classes, hidden_dim=hidden_dim, model_type=model_type,
+                      extra_args=extra_args)
+
+    if net is False:
+        return False
+
+    # cost function
+    cost = (net.negative_log_likelihood(labels=y) + L1_reg * net.L1 + (L2_reg / n_train_samples) * net.L2_sq)
+
+    # gradients
+    nambla_params = [T.grad(cost, param) for param in net.params]
+
+    # update tuple
+    updates = [(param, param - learning_rate * nambla_param)
+               for param, nambla_param in zip(net.params, nambla_params)]
+
+    train_fcn = compile_function(timings, name="train",
+                                 inputs=[x, net.mask, y],
+                                 outputs=cost,
+                                 updates=updates)
+
+    error_fcn = compile_function(timings, name="error",
+                                 inputs=[x, net.mask, y],
+                                 outputs=net.errors(y))
+
+    if model_file is not None:
+        net.load_from_file(file_path=model_file, careful=True)
+    if normalization is not None:
+        net.normalization = normalization
+
+    def batch_errors(batches):
+        # batches can have different sizes, so weight each one by the number of sequences in it
+        errors = [error_fcn(b_x, b_mask, b_y) for b_x, b_mask, b_y, _ in batches]
+        return errors, np.average(errors, weights=[len(b[2]) for b in batches])
+
+    timings["graph_seconds"] = time.time() - start - timings["compile_seconds"]
+
+    # do the actual training
+    batch_costs = [np.inf]
+    add_to_batch_costs = batch_costs.append
+    xtrain_accuracies = []
+    add_to_xtrain_acc = xtrain_accuracies.append
+    train_accuracies = []
+    add_to_train_acc = train_accuracies.append
+    xtrain_costs_bin = []
+
+    best_xtrain_accuracy = -np.inf
+    best_model = ''
+
+    n_train_batches = len(train_batches)
+    check_frequency = max(1, int(epochs / 10))
+    cost_frequency = max(1, int(n_train_batches / 10))
+
+    for epoch in xrange(0, epochs):
+        eval_start = time.time()
+        if epoch % check_frequency == 0:
+            xtrain_errors, avg_xtrain_errors = batch_errors(xtrain_batches)
+            avg_xtrain_accuracy = 100 * (1 - avg_xtrain_errors)
+            _, avg_training_errors = batch_errors(train_batches)
+            avg_train_accuracy = 100 * (1 - avg_training_errors)
+            # collect for tracking progress
+            add_to_xtrain_acc(avg_xtrain_accuracy)
+            add_to_train_acc(avg_train_accuracy)
+            xtrain_costs_bin += xtrain_errors
+
+            if verbose:
+                print("{0}: epoch {1}, batch cost {2}, train accuracy {3}, cross-train accuracy {4}"
+                      .format(motif, epoch, batch_costs[-1], avg_train_accuracy, avg_xtrain_accuracy), file=sys.stderr)
+
+            if avg_xtrain_accuracy >= best_xtrain_accuracy and trained_model_dir is not None:
+                if not os.path.exists(trained_model_dir):
+                    os.makedirs(trained_model_dir)
+                best_xtrain_accuracy = avg_xtrain_accuracy
+                best_model = "{0}model{1}.pkl".format(trained_model_dir, epoch)
+                checkpoint_start = time.time()
+                net.write(best_model)
+                checkpoint_seconds = time.time() - checkpoint_start
+                timings["checkpoint_seconds"] += checkpoint_seconds
+                # so it's left out of the accuracy check time
+                eval_start += checkpoint_seconds
+
+        np.random.shuffle(train_batches)
+        train_start = time.time()
+        timings["eval_seconds"] += train_start - eval_start
+        for i, (b_x, b_mask, b_y, _) in enumerate(train_batches):
+            batch_avg_cost = train_fcn(b_x, b_mask, b_y)
+            if i % cost_frequency == 0:
+                add_to_batch_costs(float(batch_avg_cost))
+        timings["train_seconds"] += time.time() - train_start
 
     # pickle the summary stats for the training
     summary = {
@@ -269,7 +507,8 @@ def mini_batch_sgd_with_annealing(motif, train_data, labels, xTrain_data, xTrain
         "xtrain_accuracies": xtrain_accuracies,
         "train_accuracies": train_accuracies,
         "xtrain_errors": xtrain_costs_bin,
-        "best_model": best_model
+        "best_model": best_model,
+        "timings": finish_timings(timings, n_train_batches * epochs, n_train_samples * epochs),
     }
     if trained_model_dir is not None:
         with open("{}summary_stats.pkl".format(trained_model_dir), 'w') as f:
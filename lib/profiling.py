@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Profiling for the run_nn workers: each site's classify call runs under cProfile with Theano's op-level profiling
+on for the functions it compiles (the ones compiled with profile=theano_profile(name)). The dumps go in a profiles
+directory in the output location, and hotspot_report merges them into one report of the top functions and Theano ops
+"""
+from __future__ import print_function
+import os
+import json
+import glob
+import pstats
+import cProfile
+from collections import defaultdict
+from theano.compile.profiling import ProfileStats
+
+# the ProfileStats of the functions compiled during profile_call, None when nothing is being profiled
+ACTIVE_PROFILES = None
+
+
+def profile_dir(out_path):
+    return os.path.join(out_path, "profiles")
+
+
+def theano_profile(name):
+    """The profile argument for theano.function. During profile_call it's a ProfileStats that profile_call reports
+    on (and Theano doesn't print at exit), otherwise None so the function isn't profiled
+    """
+    if ACTIVE_PROFILES is None:
+        return None
+    stats = ProfileStats(atexit_print=False, message=name)
+    ACTIVE_PROFILES.append(stats)
+    return stats
+
+
+def theano_op_times(profiles):
+    """Seconds in each Theano op and in each compiled function (by name) over the ProfileStats
+    """
+    ops, functions = defaultdict(float), defaultdict(lambda: defaultdict(float))
+    for stats in profiles:
+        for op, seconds in stats.op_time().items():
+            ops[str(op)] += seconds
+        function = functions[str(stats.message)]
+        function["calls"] += stats.fct_callcount
+        function["call_seconds"] += stats.fct_call_time
+        function["compile_seconds"] += stats.compile_time
+    return {"ops": dict(ops), "functions": dict((name, dict(f)) for name, f in functions.items())}
+
+
+def profile_call(f, kwargs, out_dir, title, n_ops=20):
+    """Run f(**kwargs) under cProfile with Theano profiling on for the functions compiled with theano_profile.
+    Writes {title}.prof (cProfile), {title}_theano.txt (Theano's summary of each compiled function) and
+    {title}_theano_ops.json (for hotspot_report) to out_dir
+    """
+    global ACTIVE_PROFILES
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    ACTIVE_PROFILES = []
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(f, **kwargs)
+    finally:
+        profiler.dump_stats(os.path.join(out_dir, title + ".prof"))
+        profiles = [p for p in ACTIVE_PROFILES if p.fct_callcount > 0]
+        ACTIVE_PROFILES = None
+        with open(os.path.join(out_dir, title + "_theano.txt"), 'w') as report:
+            for stats in profiles:
+                stats.summary(file=report, n_ops_to_print=n_ops, n_apply_to_print=n_ops)
+        with open(os.path.join(out_dir, title + "_theano_ops.json"), 'w') as ops_file:
+            json.dump(theano_op_times(profiles), ops_file, indent=1, sort_keys=True)
+
+
+def hotspot_report(out_dir, top=30, report_file=None):
+    """Merge the profiles in out_dir into a report of the top functions by cumulative and by own time, and the top
+    Theano ops, written to report_file (default hotspots.txt in out_dir)
+    """
+    prof_files = sorted(glob.glob(os.path.join(out_dir, "*.prof")))
+    assert(len(prof_files) > 0), "no profiles in {}".format(out_dir)
+    report_file = report_file if report_file is not None else os.path.join(out_dir, "hotspots.txt")
+    ops, functions = defaultdict(float), defaultdict(lambda: defaultdict(float))
+    for ops_file in sorted(glob.glob(os.path.join(out_dir, "*_theano_ops.json"))):
+        times = json.load(open(ops_file))
+        for op, seconds in times["ops"].items():
+            ops[op] += seconds
+        for name, function in times["functions"].items():
+            for key, value in function.items():
+                functions[name][key] += value
+
+    with open(report_file, 'w') as report:
+        print("Merged profiles: {}".format(", ".join(os.path.basename(f) for f in prof_files)), file=report)
+        stats = pstats.Stats(*prof_files, stream=report)
+        stats.strip_dirs()
+        for sort, name in [("cumulative", "cumulative"), ("tottime", "own")]:
+            print("\nTop {0} functions by {1} time".format(top, name), file=report)
+            stats.sort_stats(sort).print_stats(top)
+        print("Theano functions\ncalls\tcall s\tcompile s\tname", file=report)
+        for name, function in sorted(functions.items(), key=lambda x: -x[1]["call_seconds"]):
+            print("{0:.0f}\t{1:.3f}\t{2:.3f}\t{3}".format(function["calls"], function["call_seconds"],
+                                                       function["compile_seconds"], name), file=report)
+        total = sum(ops.values())
+        print("\nTop {} Theano ops\nseconds\t%\top".format(top), file=report)
+        for op, seconds in sorted(ops.items(), key=lambda x: -x[1])[:top]:
+            print("{0:.3f}\t{1:.1f}\t{2}".format(seconds, 100.0 * seconds / total if total > 0 else 0.0, op),
+                  file=report)
+    return report_file
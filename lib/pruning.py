@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""Magnitude pruning of the feed-forward models and sparse inference for the pruned layers
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import cPickle
+import numpy as np
+from itertools import izip
+from scipy import sparse
+from normalization import model_normalizer
+from inference import HIDDEN_ACTIVATIONS, MODEL_TYPES, layer_ids, load_model_dict, softmax
+from optimization import mini_batch_sgd
+
+# layers with a smaller fraction of non-zero weights than this are multiplied as sparse matrices
+SPARSE_DENSITY_THRESHOLD = 0.25
+
+
+def threshold_for_density(model, density, per_layer=False):
+    """Magnitude threshold that leaves about `density` of all the weights in a model dict non-zero. With per_layer
+    a list with one threshold for each layer is returned instead, so every layer is left with the same density
+    """
+    assert(0.0 < density <= 1.0), "density needs to be in (0, 1]"
+    magnitudes = [np.abs(model[layer_id + 'weights']).ravel() for layer_id in layer_ids(model)]
+    if per_layer is True:
+        return [np.percentile(m, 100 * (1.0 - density)) for m in magnitudes]
+    return np.percentile(np.concatenate(magnitudes), 100 * (1.0 - density))
+
+
+def prune_model(model, threshold):
+    """Copy of a model dict with the weights smaller than threshold (in magnitude) set to zero, the biases are
+    left alone. threshold can also be a list with one threshold per layer. Returns the pruned model and a dict of
+    the weight masks keyed by parameter name
+    """
+    ids = layer_ids(model)
+    thresholds = threshold if isinstance(threshold, (list, tuple)) else [threshold] * len(ids)
+    assert(len(thresholds) == len(ids)), "need one threshold for each of the {} layers".format(len(ids))
+    pruned = dict(model)
+    masks = {}
+    for layer_id, layer_threshold in izip(ids, thresholds):
+        key = layer_id + 'weights'
+        masks[key] = (np.abs(model[key]) >= layer_threshold).astype(model[key].dtype)
+        pruned[key] = model[key] * masks[key]
+    return pruned, masks
+
+
+def layer_densities(model):
+    return [np.count_nonzero(model[layer_id + 'weights']) / float(model[layer_id + 'weights'].size)
+            for layer_id in layer_ids(model)]
+
+
+def fine_tune_pruned_model(pruned_model, masks, train_data, labels, xtrain_data, xtrain_targets,
+                           learning_rate, epochs, batch_size, L1_reg=0.0, L2_reg=0.0, verbose=False):
+    """Continue training a pruned model dict with mini_batch_sgd, the pruned weights are masked out of the updates
+    so they stay at zero. The data is normalized with the model's statistics, which the fine-tuned model keeps.
+    Returns the best (by cross-train accuracy) fine-tuned model dict
+    """
+    normalizer = model_normalizer(pruned_model)
+    train_data, xtrain_data = normalizer.transform(train_data), normalizer.transform(xtrain_data)
+    working_dir = tempfile.mkdtemp()
+    try:
+        model_file = os.path.join(working_dir, "pruned.pkl")
+        with open(model_file, 'w') as f:
+            cPickle.dump(pruned_model, f)
+        net, summary = mini_batch_sgd(motif="fine-tune", train_data=train_data, labels=labels,
+                                      xTrain_data=xtrain_data, xTrain_targets=xtrain_targets,
+                                      learning_rate=learning_rate, L1_reg=L1_reg, L2_reg=L2_reg, epochs=epochs,
+                                      batch_size=batch_size, hidden_dim=pruned_model['hidden_dim'],
+                                      model_type=MODEL_TYPES[pruned_model['model']], model_file=model_file,
+                                      trained_model_dir=working_dir + "/", verbose=verbose, update_masks=masks)
+        fine_tuned = load_model_dict(summary['best_model'])
+    finally:
+        shutil.rmtree(working_dir)
+    return fine_tuned
+
+
+def sparse_model(model):
+    """Convert a (pruned) model dict to the sparse format, each layer's weights are stored transposed in CSR form,
+    one row per output unit
+    """
+    sparse_layers = []
+    for layer_id in layer_ids(model):
+        sparse_layers.append((sparse.csr_matrix(np.asarray(model[layer_id + 'weights'], dtype=np.float32).T),
+                              np.asarray(model[layer_id + 'biases'], dtype=np.float32)))
+    return {
+        "model": model['model'],
+        "in_dim": model['in_dim'],
+        "n_classes": model['n_classes'],
+        "hidden_dim": model['hidden_dim'],
+        "normalization": model.get('normalization'),
+        "layers": sparse_layers,
+    }
+
+
+def write_sparse_model(sparse_model_dict, file_path):
+    with open(file_path, 'w') as f:
+        cPickle.dump(sparse_model_dict, f, cPickle.HIGHEST_PROTOCOL)
+
+
+def load_sparse_model(file_path):
+    with open(file_path, 'r') as f:
+        return cPickle.load(f)
+
+
+class SparsePredictor(object):
+    """Runs a sparse model dict (see sparse_model), layers with density below density_threshold are multiplied as
+    CSR matrices and the rest are densified once when the predictor is made
+    """
+    def __init__(self, sparse_model_dict, density_threshold=SPARSE_DENSITY_THRESHOLD):
+        self.in_dim = sparse_model_dict['in_dim']
+        self.n_classes = sparse_model_dict['n_classes']
+        self.activations = HIDDEN_ACTIVATIONS[sparse_model_dict['model']]
+        self.normalizer = model_normalizer(sparse_model_dict)
+        self.layers = []
+        for weights_t, biases in sparse_model_dict['layers']:
+            density = weights_t.nnz / float(np.prod(weights_t.shape))
+            if density < density_threshold:
+                self.layers.append((True, weights_t, biases))
+            else:
+                self.layers.append((False, np.ascontiguousarray(weights_t.toarray().T), biases))
+
+    @staticmethod
+    def layer_dot(x, is_sparse, weights, biases):
+        if is_sparse:
+            # (out, in) CSR times (in, n) dense, transposed back to (n, out)
+            z = np.ascontiguousarray(weights.dot(x.T).T)
+        else:
+            z = np.dot(x, weights)
+        z += biases
+        return z
+
+    def predict_proba(self, x):
+        activation = self.normalizer.transform(x, dtype=np.float32)
+        for (is_sparse, weights, biases), f in izip(self.layers[:-1], self.activations):
+            activation = f(self.layer_dot(activation, is_sparse, weights, biases))
+        return softmax(self.layer_dot(activation, *self.layers[-1]))
+
+    def predict(self, x):
+        return np.argmax(self.predict_proba(x), axis=1)
+
+    def nbytes(self):
+        total = 0
+        for is_sparse, weights, biases in self.layers:
+            if is_sparse:
+                total += weights.data.nbytes + weights.indices.nbytes + weights.indptr.nbytes
+            else:
+                total += weights.nbytes
+            total += biases.nbytes
+        return total
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Post-training int8 quantization of the feed-forward models
+"""
+from __future__ import print_function
+import cPickle
+import numpy as np
+from itertools import izip
+from normalization import model_normalizer
+from inference import HIDDEN_ACTIVATIONS, NumpyPredictor, model_layers, softmax, accuracy, throughput
+
+# above this many inputs an int8 dot product can overflow the 24 bit float32 mantissa, see QuantizedPredictor
+EXACT_FLOAT32_DIM = (2 ** 24) / (127 * 127)
+
+
+def quantize_weights(weights):
+    """Symmetric per output channel (column) quantization, returns the int8 weights and the float32 scale of each
+    column, weights ~= int8_weights * scales
+    """
+    scales = np.abs(weights).max(axis=0) / 127.
+    scales[scales == 0] = 1.
+    int8_weights = np.clip(np.round(weights / scales), -127, 127).astype(np.int8)
+    return int8_weights, scales.astype(np.float32)
+
+
+def quantize_model(model):
+    """Make a quantized version of a model dict (as written by Model.write), the biases are kept in float32
+    """
+    quantized = {
+        "model": model['model'],
+        "in_dim": model['in_dim'],
+        "n_classes": model['n_classes'],
+        "hidden_dim": model['hidden_dim'],
+        "normalization": model.get('normalization'),
+        "layers": [],
+    }
+    for weights, biases in model_layers(model):
+        int8_weights, scales = quantize_weights(np.asarray(weights, dtype=np.float64))
+        quantized['layers'].append((int8_weights, scales, np.asarray(biases, dtype=np.float32)))
+    return quantized
+
+
+def write_quantized_model(quantized_model, file_path):
+    with open(file_path, 'w') as f:
+        cPickle.dump(quantized_model, f, cPickle.HIGHEST_PROTOCOL)
+
+
+def load_quantized_model(file_path):
+    with open(file_path, 'r') as f:
+        return cPickle.load(f)
+
+
+class QuantizedPredictor(object):
+    """Runs a quantized model. The input to each layer is quantized to int8 per row on the fly and multiplied
+    with the int8 weights, then rescaled by the row and column scales. When the layer is small enough that the
+    integer dot products can't overflow float32's mantissa the int8 matrices are multiplied as float32 (exact, and
+    it goes through BLAS), otherwise they are accumulated in int32
+    """
+    def __init__(self, quantized_model):
+        self.in_dim = quantized_model['in_dim']
+        self.n_classes = quantized_model['n_classes']
+        self.layers = quantized_model['layers']
+        self.activations = HIDDEN_ACTIVATIONS[quantized_model['model']]
+        self.normalizer = model_normalizer(quantized_model)
+
+    @staticmethod
+    def quantized_dot(x, int8_weights, scales):
+        x_scales = np.abs(x).max(axis=1) / 127.
+        x_scales[x_scales == 0] = 1.
+        int8_x = np.round(x / x_scales[:, None])
+        if int8_weights.shape[0] <= EXACT_FLOAT32_DIM:
+            z = np.dot(int8_x.astype(np.float32), int8_weights.astype(np.float32))
+        else:
+            z = np.dot(int8_x.astype(np.int32), int8_weights.astype(np.int32)).astype(np.float32)
+        z *= x_scales[:, None].astype(np.float32)
+        z *= scales
+        return z
+
+    def predict_proba(self, x):
+        activation = self.normalizer.transform(x, dtype=np.float32)
+        for (int8_weights, scales, biases), f in izip(self.layers[:-1], self.activations):
+            z = self.quantized_dot(activation, int8_weights, scales)
+            z += biases
+            activation = f(z)
+        int8_weights, scales, biases = self.layers[-1]
+        z = self.quantized_dot(activation, int8_weights, scales)
+        z += biases
+        return softmax(z)
+
+    def predict(self, x):
+        return np.argmax(self.predict_proba(x), axis=1)
+
+    def nbytes(self):
+        return sum(w.nbytes + s.nbytes + b.nbytes for w, s, b in self.layers)
+
+
+def quantization_report(model, test_data, labels, batch_size=10000):
+    """Compare a model dict with its quantized version on held-out data, returns a dict with the accuracy of each,
+    their samples/sec and the memory taken by their parameters
+    """
+    float_predictor = NumpyPredictor(model, dtype=np.float32)
+    quantized_predictor = QuantizedPredictor(quantize_model(model))
+
+    float_accuracy = accuracy(float_predictor, test_data, labels, batch_size)
+    quantized_accuracy = accuracy(quantized_predictor, test_data, labels, batch_size)
+    float_throughput = throughput(float_predictor, test_data, batch_size)
+    quantized_throughput = throughput(quantized_predictor, test_data, batch_size)
+
+    sample = test_data[:batch_size]
+    max_prob_delta = np.abs(float_predictor.predict_proba(sample) - quantized_predictor.predict_proba(sample)).max()
+
+    return {
+        "float32_accuracy": float_accuracy,
+        "int8_accuracy": quantized_accuracy,
+        "accuracy_delta": quantized_accuracy - float_accuracy,
+        "max_probability_delta": max_prob_delta,
+        "float32_samples_per_sec": float_throughput,
+        "int8_samples_per_sec": quantized_throughput,
+        "speedup": quantized_throughput / float_throughput,
+        "float32_bytes": float_predictor.nbytes(),
+        "int8_bytes": quantized_predictor.nbytes(),
+        "memory_reduction": float(float_predictor.nbytes()) / quantized_predictor.nbytes(),
+    }
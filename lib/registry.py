@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Cache of resolved model paths, loaded models and predictors so repeatedly scoring the same sites only pays the
+load (and compile) cost once
+"""
+from __future__ import print_function
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from utils import find_model_path
+from inference import NumpyPredictor, load_model_dict
+from ensemble import EnsemblePredictor, site_model_files
+from results_store import params_json
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+ENGINES = ["numpy", "theano"]
+
+
+def file_signature(paths):
+    """(path, mtime, size) of each file, a cache entry is stale when this changes
+    """
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((path, stat.st_mtime, stat.st_size))
+    return tuple(signature)
+
+
+def model_nbytes(model):
+    return sum(v.nbytes for v in model.values() if isinstance(v, np.ndarray))
+
+
+class RegistryEntry(object):
+    def __init__(self, value, dependencies, nbytes):
+        self.value = value
+        self.dependencies = dependencies
+        self.signature = file_signature(dependencies)
+        self.nbytes = nbytes
+
+    def is_stale(self):
+        try:
+            return file_signature(self.dependencies) != self.signature
+        except OSError:
+            return True
+
+
+class ModelRegistry(object):
+    """LRU cache keyed by what was asked for ((model_dir, title) for sites, the file path for model files). Entries
+    are dropped when the files they were loaded from change, and the least recently used entries are evicted when
+    the cached models and predictors take more than max_bytes
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def cached(self, key, load):
+        """Get the value for key, calling load() -> (value, dependency files, nbytes) if it isn't cached or is stale
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry.is_stale():
+                self.counts["invalidations"] += 1
+                entry = None
+            if entry is None:
+                self.counts["misses"] += 1
+                entry = RegistryEntry(*load())
+            else:
+                self.counts["hits"] += 1
+            self.entries[key] = entry  # most recently used go at the end
+            self.evict()
+            return entry.value
+
+    def evict(self):
+        # the most recently used entry is kept even if it's over the cap on its own
+        while self.nbytes() > self.max_bytes and len(self.entries) > 1:
+            self.entries.popitem(last=False)
+            self.counts["evictions"] += 1
+
+    def nbytes(self):
+        return sum(entry.nbytes for entry in self.entries.values())
+
+    def model_path(self, model_dir, title):
+        """find_model_path, cached until the summary file changes
+        """
+        summary = "{modelDir}/{title}_Models/summary_stats.pkl".format(modelDir=model_dir, title=title)
+
+        def load():
+            return find_model_path(model_dir, title), [summary], 0
+        return self.cached(("path", model_dir, title), load)
+
+    def model(self, model_file):
+        """The dict written by Model.write
+        """
+        def load():
+            model = load_model_dict(model_file)
+            return model, [model_file], model_nbytes(model)
+        return self.cached(("model", model_file), load)
+
+    def predictor(self, model_file, engine="numpy", model_type=None, extra_args=None):
+        """NumpyPredictor or compiled TheanoPredictor for a model file, a network compiled with other extra_args (eg.
+        ConvNet3's batch_size and data_shape) is a different entry
+        """
+        assert(engine in ENGINES), "engine needs to be one of {}".format(ENGINES)
+
+        def load():
+            if engine == "numpy":
+                predictor = NumpyPredictor(self.model(model_file))
+            else:
+                # neural_network imports this module
+                from neural_network import TheanoPredictor
+                predictor = TheanoPredictor.from_file(model_file, model_type=model_type, extra_args=extra_args)
+            return predictor, [model_file], predictor.nbytes()
+        return self.cached(("predictor", model_file, engine, model_type, params_json(extra_args)), load)
+
+    def site_predictor(self, model_dir, title, engine="numpy", ensemble=False):
+        """Predictor for a site's model in model_dir, or an EnsemblePredictor of all of the site's iterations
+        """
+        if ensemble is False:
+            return self.predictor(self.model_path(model_dir, title), engine=engine)
+        assert(engine == "numpy"), "ensembles only run with NumPy"
+
+        def load():
+            model_files = site_model_files(model_dir, title)
+            models_dir = "{outpath}/{title}_Models".format(outpath=model_dir, title=title)
+            summaries = [os.path.join(os.path.dirname(f), "summary_stats.pkl") for f in model_files]
+            predictor = EnsemblePredictor([self.model(f) for f in model_files])
+            # the directory's mtime changes when a new iteration is added
+            return predictor, [models_dir] + summaries + model_files, predictor.nbytes()
+        return self.cached(("ensemble", model_dir, title), load)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats["entries"] = len(self.entries)
+            stats["bytes"] = self.nbytes()
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_default_registry = None
+
+
+def default_registry():
+    """Registry shared by everything in the process
+    """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = ModelRegistry()
+    return _default_registry
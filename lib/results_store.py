@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""SQLite store of training results, one database for all the runs in an output directory
+
+A run is one classify call (one site, or all the sites for a multi-task model), it has a set of hyperparameters
+(shared by the runs that were started with the same ones), and iterations. Each iteration has its test accuracy,
+the metric histories from training (cross-train and train accuracies, batch costs) and the paths of the files it
+wrote. Everything an iteration records goes in one transaction, so the workers of a run_nn job can write to the same
+database.
+
+The database is in WAL mode on local disks. WAL needs shared memory between the processes, which a network
+filesystem (eg. the NFS output location of a run_nn --queue job) can't give, so there the rollback journal is used.
+That relies on the filesystem's POSIX locks, and if the NFS lock daemon is unreliable it's safer to give run_nn.py a
+--results_db on local disk
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS param_sets (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    params TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    experiment TEXT,
+    title TEXT NOT NULL,
+    param_set_id INTEGER REFERENCES param_sets(id),
+    model_type TEXT,
+    out_path TEXT,
+    command TEXT,
+    started REAL,
+    finished REAL,
+    mean_accuracy REAL,
+    status TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS iterations (
+    run_id INTEGER REFERENCES runs(id),
+    iteration INTEGER,
+    test_accuracy REAL,
+    best_model TEXT,
+    best_epoch INTEGER,
+    PRIMARY KEY (run_id, iteration)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER REFERENCES runs(id),
+    iteration INTEGER,
+    name TEXT,
+    step INTEGER,
+    value REAL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    run_id INTEGER REFERENCES runs(id),
+    iteration INTEGER,
+    kind TEXT,
+    path TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_title ON runs (title);
+CREATE INDEX IF NOT EXISTS runs_experiment ON runs (experiment);
+CREATE INDEX IF NOT EXISTS runs_param_set ON runs (param_set_id);
+CREATE INDEX IF NOT EXISTS metrics_run ON metrics (run_id, name);
+CREATE INDEX IF NOT EXISTS artifacts_run ON artifacts (run_id, kind);
+"""
+
+# training summary (from mini_batch_sgd) entries that are recorded as metric histories
+SUMMARY_METRICS = ["xtrain_accuracies", "train_accuracies", "batch_costs"]
+# columns added to runs since the first version of the schema, for older databases
+RUN_COLUMNS = [("status", "TEXT"), ("error", "TEXT")]
+# (database, run id) of the runs this process started and hasn't finished, see fail_open_runs
+OPEN_RUNS = {}
+# filesystem types (from /proc/mounts) that SQLite's WAL mode doesn't work on
+NETWORK_FILESYSTEMS = ["nfs", "nfs4", "cifs", "smbfs", "smb3", "lustre", "gpfs", "ceph", "glusterfs",
+                       "fuse.glusterfs", "fuse.sshfs", "beegfs", "9p"]
+
+
+def network_filesystem(path, mounts_file="/proc/mounts"):
+    """Whether path is on a network filesystem, from the type of the mount it's under. False if the mounts can't be
+    read (eg. not on Linux)
+    """
+    path = os.path.realpath(os.path.dirname(os.path.abspath(path)))
+    try:
+        with open(mounts_file, 'r') as mounts:
+            # mount points have spaces and such escaped as octal
+            entries = [(fields[1].decode('string_escape'), fields[2]) for fields in (line.split() for line in mounts)
+                       if len(fields) >= 3]
+    except IOError:
+        return False
+    matching = [(mount_point, fs_type) for mount_point, fs_type in entries
+                if path == mount_point or path.startswith(mount_point.rstrip("/") + "/")]
+    if len(matching) == 0:
+        return False
+    # the innermost mount, the last one mounted wins if there are several on the same point
+    _, fs_type = max(reversed(matching), key=lambda m: len(m[0]))
+    return fs_type in NETWORK_FILESYSTEMS
+
+
+def params_json(params):
+    # anything that isn't JSON (eg. numpy numbers in a config) is written as its string
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+class ResultsStore(object):
+    def __init__(self, path, timeout=60.0):
+        # the timeout is how long to wait for another process's transaction
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode={}".format("DELETE" if network_filesystem(path) else "WAL"))
+        self.create_schema()
+
+    def create_schema(self, attempts=10):
+        # the workers of a run can all open a new database at once, the ones that find the schema changing under
+        # them try again
+        for attempt in xrange(attempts):
+            try:
+                with self.connection:
+                    self.connection.executescript(SCHEMA)
+                    columns = [row[1] for row in self.connection.execute("PRAGMA table_info(runs)")]
+                    for name, column_type in RUN_COLUMNS:
+                        if name not in columns:
+                            self.connection.execute("ALTER TABLE runs ADD COLUMN {0} {1}".format(name, column_type))
+                return
+            except sqlite3.OperationalError:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def param_set(self, params):
+        params = params_json(params)
+        key = hashlib.sha1(params).hexdigest()
+        self.connection.execute("INSERT OR IGNORE INTO param_sets (key, params) VALUES (?, ?)", (key, params))
+        return self.connection.execute("SELECT id FROM param_sets WHERE key = ?", (key,)).fetchone()[0]
+
+    def start_run(self, title, params, experiment=None, model_type=None, out_path=None, command=None):
+        """Record a run and its hyperparameters (a dict that can be written as JSON), returns the run id
+        """
+        with self.connection:
+            param_set_id = self.param_set(params)
+            cursor = self.connection.execute(
+                "INSERT INTO runs (experiment, title, param_set_id, model_type, out_path, command, started, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 'running')",
+                (experiment, title, param_set_id, model_type,
+                 None if out_path is None else os.path.abspath(out_path), command, time.time()))
+            return cursor.lastrowid
+
+    def record_iteration(self, run_id, iteration, test_accuracy, summary=None, artifacts=None, metrics=None):
+        """Record an iteration's test accuracy, the metric histories in its training summary (and the extra
+        metrics, a dict of name to a value or a list of values) and artifacts, a dict of kind to file path
+        """
+        summary = {} if summary is None else summary
+        histories = dict((name, summary[name]) for name in SUMMARY_METRICS if name in summary)
+        histories.update(metrics or {})
+        metric_rows = [(run_id, iteration, name, step, float(value))
+                       for name, values in histories.items()
+                       for step, value in enumerate(values if isinstance(values, (list, tuple)) else [values])]
+        artifact_rows = [(run_id, iteration, kind, os.path.abspath(path))
+                         for kind, path in (artifacts or {}).items() if path]
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO iterations (run_id, iteration, test_accuracy, best_model, best_epoch) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run_id, iteration, float(test_accuracy),
+                 os.path.abspath(summary['best_model']) if summary.get('best_model') else None,
+                 summary.get('best_epoch')))
+            self.connection.executemany("INSERT INTO metrics VALUES (?, ?, ?, ?, ?)", metric_rows)
+            self.connection.executemany("INSERT INTO artifacts VALUES (?, ?, ?, ?)", artifact_rows)
+
+    def finish_run(self, run_id, mean_accuracy):
+        with self.connection:
+            self.connection.execute("UPDATE runs SET finished = ?, mean_accuracy = ?, status = 'done' WHERE id = ?",
+                                    (time.time(), float(mean_accuracy), run_id))
+        OPEN_RUNS.pop((self.path, run_id), None)
+
+    def fail_run(self, run_id, error):
+        # a failed run isn't finished, so it's left out of the accuracy queries
+        with self.connection:
+            self.connection.execute("UPDATE runs SET status = 'failed', error = ? WHERE id = ?", (error, run_id))
+        OPEN_RUNS.pop((self.path, run_id), None)
+
+    def query(self, sql, args=()):
+        return self.connection.execute(sql, args).fetchall()
+
+    def site_accuracies(self, experiment=None, title=None, finished=True):
+        """(run id, experiment, title, mean test accuracy, number of iterations, hyperparameters) of each run,
+        newest first
+        """
+        where, args = [], []
+        if experiment is not None:
+            where.append("runs.experiment = ?")
+            args.append(experiment)
+        if title is not None:
+            where.append("runs.title = ?")
+            args.append(title)
+        if finished is True:
+            where.append("runs.finished IS NOT NULL")
+        rows = self.query(
+            "SELECT runs.id, runs.experiment, runs.title, runs.mean_accuracy, "
+            "(SELECT COUNT(*) FROM iterations WHERE iterations.run_id = runs.id), param_sets.params "
+            "FROM runs LEFT JOIN param_sets ON runs.param_set_id = param_sets.id" +
+            ("" if len(where) == 0 else " WHERE " + " AND ".join(where)) + " ORDER BY runs.id DESC", args)
+        return [row[:5] + (json.loads(row[5]) if row[5] is not None else None,) for row in rows]
+
+    def latest_accuracies(self, experiment=None):
+        """(title, mean test accuracy, run id) of the latest finished run of each site
+        """
+        return self.query(
+            "SELECT title, mean_accuracy, id FROM runs WHERE id IN (SELECT MAX(id) FROM runs WHERE finished IS NOT "
+            "NULL" + ("" if experiment is None else " AND experiment = ?") + " GROUP BY title) ORDER BY title",
+            () if experiment is None else (experiment,))
+
+    def param_set_accuracies(self, experiment=None):
+        """(param set id, number of runs, mean and best of the runs' accuracies, hyperparameters) for each set of
+        hyperparameters, best first
+        """
+        rows = self.query(
+            "SELECT param_sets.id, COUNT(*), AVG(runs.mean_accuracy), MAX(runs.mean_accuracy), param_sets.params "
+            "FROM runs JOIN param_sets ON runs.param_set_id = param_sets.id WHERE runs.finished IS NOT NULL" +
+            ("" if experiment is None else " AND runs.experiment = ?") +
+            " GROUP BY param_sets.id ORDER BY AVG(runs.mean_accuracy) DESC",
+            () if experiment is None else (experiment,))
+        return [row[:4] + (json.loads(row[4]),) for row in rows]
+
+    def metric_history(self, run_id, name, iteration=0):
+        return [value for value, in self.query("SELECT value FROM metrics WHERE run_id = ? AND iteration = ? AND "
+                                               "name = ? ORDER BY step", (run_id, iteration, name))]
+
+    def artifacts(self, run_id, kind=None):
+        if kind is None:
+            return self.query("SELECT iteration, kind, path FROM artifacts WHERE run_id = ? ORDER BY iteration",
+                              (run_id,))
+        return self.query("SELECT iteration, kind, path FROM artifacts WHERE run_id = ? AND kind = ? "
+                          "ORDER BY iteration", (run_id, kind))
+
+
+def start_results_run(results_db, title, params, **kwargs):
+    """(store, run id) for a classify run, or (None, None) without a database
+    """
+    if results_db is None:
+        return None, None
+    store = ResultsStore(results_db)
+    run_id = store.start_run(title, params, **kwargs)
+    OPEN_RUNS[(results_db, run_id)] = store
+    return store, run_id
+
+
+def fail_open_runs(error):
+    """Record the runs this process started and didn't finish as failed (eg. when a classify call raised, before
+    it's retried), returns their ids
+    """
+    failed = []
+    for (_, run_id), store in OPEN_RUNS.items():
+        store.fail_run(run_id, error)
+        store.close()
+        failed.append(run_id)
+    return failed
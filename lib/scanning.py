@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Score every reference position a read covers instead of only the motif starts in a config
+"""
+from __future__ import print_function
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from utils import read_alignment_table, motif_features, get_nb_features
+
+WINDOW_LENGTH = 6  # positions in a vector, same as the motif vectors
+
+
+def position_blocks(motif_table, first, nb_positions, events_per_pos, nb_event_features):
+    """(nb_positions, events_per_pos * nb_event_features) array, row i has the features of the top events aligned to
+    reference position first + i (NaN where there are fewer events). motif_table is from motif_features so the events
+    are already sorted by position and then by descending posterior
+    """
+    ref_pos = motif_table['ref_pos'].values
+    values = motif_table.drop(['ref_pos', 'strand'], 1).values
+    # rank of each event among the events at its position
+    rank = np.arange(len(ref_pos)) - np.searchsorted(ref_pos, ref_pos, side='left')
+    keep = rank < events_per_pos
+    blocks = np.full((nb_positions, events_per_pos, nb_event_features), np.nan)
+    blocks[ref_pos[keep] - first, rank[keep]] = values[keep]
+    return blocks.reshape(nb_positions, events_per_pos * nb_event_features)
+
+
+def sliding_windows(blocks, window_length=WINDOW_LENGTH):
+    """View of every window_length consecutive rows of blocks as one vector, (nb_positions - window_length + 1,
+    window_length * block width). Nothing is copied, the windows overlap in memory
+    """
+    blocks = np.ascontiguousarray(blocks)
+    nb_windows = len(blocks) - window_length + 1
+    if nb_windows < 1:
+        return np.empty((0, window_length * blocks.shape[1]), dtype=blocks.dtype)
+    return as_strided(blocks, shape=(nb_windows, window_length * blocks.shape[1]),
+                      strides=(blocks.strides[0], blocks.strides[1]))
+
+
+def read_windows(data, events_per_pos, strand, feature_set=None, min_covered=1):
+    """Window start positions and vectors for every window of a read's alignment table (from read_alignment_table)
+    with at least min_covered of its positions covered by an event. The vectors are laid out like the single strand
+    motif vectors from collect_data_vectors2, they only differ where an event aligned to more than one position is
+    dropped as a duplicate from a position in a different window
+    """
+    assert(strand in ["t", "c"]), "scanning only works on one strand"
+    positions = data['ref_pos'][data['strand'] == strand]
+    if len(positions) == 0:
+        return np.empty(0, dtype=np.int64), None
+    first, last = positions.min(), positions.max()
+    nb_positions = last - first + 1
+    # a "motif" covering the whole read
+    motif_table = motif_features(data, [first], strand, feature_set=feature_set, kmer_length=nb_positions)
+    if motif_table is False or len(motif_table) == 0:
+        return np.empty(0, dtype=np.int64), None
+    blocks = position_blocks(motif_table, first, nb_positions, events_per_pos, get_nb_features(feature_set))
+    windows = sliding_windows(blocks)
+    # number of covered positions in each window, from a running sum over the positions
+    covered = np.concatenate([[0], np.cumsum(~np.all(np.isnan(blocks), axis=1))])
+    window_coverage = covered[WINDOW_LENGTH:] - covered[:-WINDOW_LENGTH]
+    keep = np.flatnonzero(window_coverage >= min_covered)
+    return first + keep, windows[keep]
+
+
+def scan_vectors(tsv, sites, events_per_pos, strand, feature_set=None, kmer_length=6, min_covered=1):
+    """Like scoring.read_vectors but with a vector for every window of the read. The windows are the same for each
+    of the sites (models), sites is a list of (title, _) so it can be used in place of read_vectors
+    """
+    try:
+        data = read_alignment_table(tsv)
+        starts, windows = read_windows(data, events_per_pos, strand, feature_set=feature_set,
+                                       min_covered=min_covered)
+    except Exception:
+        return tsv, None
+    if len(starts) == 0:
+        return tsv, []
+    return tsv, [(title, starts, windows) for title, _ in sites]
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Runs the run_nn tasks (one for each site) in worker processes. The biggest tasks are started first, a task that
+raises is retried and then reported without stopping the worker's other tasks, and each worker's BLAS/OpenMP
+threads are pinned so that workers x threads matches the cores
+"""
+from __future__ import print_function
+import os
+import sys
+import glob
+import time
+import ctypes
+import traceback
+from multiprocessing import Process, Manager, cpu_count
+
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS",
+                    "NUMEXPR_NUM_THREADS"]
+# runtime setters in the thread pool libraries, for ones that were loaded before the variables were set
+THREAD_SETTERS = [("openblas", "openblas_set_num_threads"), ("mkl_rt", "MKL_Set_Num_Threads"),
+                  ("gomp", "omp_set_num_threads"), ("iomp5", "omp_set_num_threads")]
+
+
+def threads_per_worker(workers, cores=None):
+    cores = cpu_count() if cores is None else cores
+    return max(1, cores / max(1, workers))
+
+
+def loaded_libraries():
+    try:
+        with open("/proc/self/maps", 'r') as maps:
+            return set(line.split()[-1] for line in maps if "/" in line and ".so" in line)
+    except IOError:
+        return set()
+
+
+def pin_threads(threads):
+    """Limit BLAS and OpenMP to threads in this process: sets the environment variables (for libraries loaded from
+    now on and for child processes) and calls the setters of the libraries already loaded. Returns the setters
+    that were called
+    """
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    called = []
+    for library in sorted(loaded_libraries()):
+        for name, setter in THREAD_SETTERS:
+            if not os.path.basename(library).startswith("lib" + name):
+                continue
+            try:
+                getattr(ctypes.CDLL(library), setter)(threads)
+                called.append(setter)
+            except (OSError, AttributeError):
+                pass
+    return called
+
+
+def estimated_size(task):
+    """Relative size of a run_nn task: the bytes of alignment files it will read (at most max_samples files from
+    each group) times the number of motifs and iterations
+    """
+    nb_bytes = 0
+    for group in [task.get("group_1"), task.get("group_2"), task.get("group_3")]:
+        if group is None:
+            continue
+        sizes = [os.stat(f).st_size for f in glob.glob(group)]
+        if len(sizes) > 0:
+            nb_bytes += sum(sizes) * min(1.0, float(task.get("max_samples", len(sizes))) / len(sizes))
+    if "sites" in task:
+        nb_motifs = sum(len(site['motif_start_position']) for site in task['sites'])
+    else:
+        nb_motifs = len(task.get("motif_start_positions", [None]))
+    return nb_bytes * nb_motifs * task.get("iterations", 1)
+
+
+def worker(run_task, task_queue, done_queue, threads, retries):
+    if threads is not None:
+        pin_threads(threads)
+    for index, task, attempts in iter(task_queue.get, 'STOP'):
+        start, error = time.time(), None
+        while attempts <= retries:
+            attempts += 1
+            try:
+                run_task(task)
+                error = None
+                break
+            except Exception:
+                error = traceback.format_exc()
+                print("{0} failed on attempt {1}:\n{2}".format(task.get("title", index), attempts, error),
+                      file=sys.stderr)
+        done_queue.put({"index": index, "status": "failed" if error is not None else "done", "attempts": attempts,
+                        "seconds": time.time() - start, "error": error, "pid": os.getpid()})
+
+
+def run_tasks(run_task, tasks, jobs, threads=None, retries=0, size=estimated_size, poll_seconds=0.5):
+    """Run run_task(task) for each task in jobs worker processes, longest first. threads is the BLAS/OpenMP
+    threads for each worker (default is the cores shared between the workers). A worker that dies is replaced and
+    the task it was on is queued again, a death counts as an attempt. Returns a record for each task, in the order
+    they were given, with its status ("done", "failed", or "lost" if its workers died on every attempt), attempts,
+    wall time and estimated size
+    """
+    workers = max(1, min(jobs, len(tasks)))
+    threads = threads_per_worker(workers) if threads is None else threads
+    manager = Manager()
+    done_queue = manager.Queue()
+    sizes = [size(task) for task in tasks]
+    pending = sorted(xrange(len(tasks)), key=lambda i: sizes[i], reverse=True)
+
+    def start_worker():
+        # each worker has its own queue and is given one task at a time, so the parent always knows which task a
+        # worker had when it died, even if it died before starting it
+        task_queue = manager.Queue()
+        p = Process(target=worker, args=(run_task, task_queue, done_queue, threads, retries))
+        p.start()
+        return p, task_queue
+
+    records = [None] * len(tasks)
+    # the task given to each worker, and the attempts used up by the workers that died on a task
+    running, deaths = {}, [0] * len(tasks)
+
+    def collect_records():
+        while not done_queue.empty():
+            record = done_queue.get()
+            records[record["index"]] = record
+            running.pop(record["pid"], None)
+
+    processes = [start_worker() for _ in xrange(workers)]
+    while any(record is None for record in records):
+        collect_records()
+        for p, task_queue in list(processes):
+            if p.is_alive():
+                continue
+            p.join()
+            processes.remove((p, task_queue))
+            # it may have finished its task just before it died
+            collect_records()
+            index = running.pop(p.pid, None)
+            if index is not None and records[index] is None:
+                deaths[index] += 1
+                print("{0}: worker {1} died with code {2}".format(tasks[index].get("title", index), p.pid,
+                                                                 p.exitcode), file=sys.stderr)
+                if deaths[index] <= retries:
+                    pending.append(index)
+                else:
+                    records[index] = {"index": index, "status": "lost", "attempts": deaths[index], "seconds": None,
+                                      "error": "worker died with code {}".format(p.exitcode)}
+            if any(record is None for record in records):
+                processes.append(start_worker())
+        for p, task_queue in processes:
+            if p.pid not in running and len(pending) > 0:
+                index = pending.pop(0)
+                running[p.pid] = index
+                task_queue.put((index, tasks[index], deaths[index]))
+        time.sleep(poll_seconds)
+    for p, task_queue in processes:
+        task_queue.put('STOP')
+    for p, _ in processes:
+        p.join()
+
+    for record in records:
+        record["title"] = tasks[record['index']].get("title", record['index'])
+        record["estimated_size"] = sizes[record['index']]
+        record["threads"] = threads
+    return records
+
+
+def task_report(records):
+    lines = ["title\tstatus\tattempts\tseconds\testimated size"]
+    for record in sorted(records, key=lambda r: -r["estimated_size"]):
+        lines.append("{0}\t{1}\t{2}\t{3}\t{4:.3g}".format(
+            record["title"], record["status"], "-" if record["attempts"] is None else record["attempts"],
+            "-" if record["seconds"] is None else "{:.1f}".format(record["seconds"]), record["estimated_size"]))
+    return "\n".join(lines)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""Score alignment files with trained models, streaming per-read, per-site probabilities to a file
+"""
+from __future__ import print_function
+import os
+import sys
+import glob
+import cPickle
+import numpy as np
+from collections import deque
+from itertools import chain
+from multiprocessing import Pool
+from utils import read_alignment_table, motif_features, motif_table_vectors, get_nb_features
+from ensemble import EnsemblePredictor
+from inference import SiteConditionedPredictor
+from registry import default_registry
+from scanning import scan_vectors
+
+
+def site_motif_starts(site):
+    """All of the motif starts for a site in the config, from every group
+    """
+    return sorted(set(chain(*site['motif_start_position'])))
+
+
+def site_predictor(title, model_file=None, model_dir=None, ensemble=False, registry=None):
+    """Predictor for a site, from a model file, the site's model in model_dir (found with find_model_path) or an
+    EnsemblePredictor of the best models of all the site's iterations in model_dir. The predictors come from the
+    registry (default_registry if it isn't given) so they're only loaded once
+    """
+    assert((model_file is None) != (model_dir is None)), "need one of a model file or a model directory"
+    registry = default_registry() if registry is None else registry
+    if model_file is not None:
+        assert(ensemble is False), "ensembles are made from the models in a model directory"
+        return registry.predictor(model_file)
+    return registry.site_predictor(model_dir, title, ensemble=ensemble)
+
+
+def multi_task_predictors(model_dir, title, registry=None):
+    """A predictor for each site of a multi-task model trained by classify_multi_task under title, keyed by site
+    title. They all share the one model
+    """
+    registry = default_registry() if registry is None else registry
+    site_titles = cPickle.load(open("{0}/{1}_Models/site_titles.pkl".format(model_dir, title), 'r'))
+    predictor = registry.site_predictor(model_dir, title)
+    return dict((site_title, SiteConditionedPredictor(predictor, s, len(site_titles)))
+                for s, site_title in enumerate(site_titles))
+
+
+def alignment_files(files):
+    return sorted(x for x in glob.glob(files) if os.stat(x).st_size != 0)
+
+
+def read_vectors(tsv, sites, events_per_pos, strand, feature_set=None, kmer_length=6):
+    """Feature vectors for one alignment file. The file is only read once, then the features are selected for each
+    site the same way collect_data_vectors2 does it. sites is a list of (title, motif_starts), returns the file name
+    and a list of (title, motif_starts, vectors) or None if the file couldn't be used
+    """
+    # any error skips the file, like cull_motif_features4 does in training, instead of ending the run
+    try:
+        data = read_alignment_table(tsv)
+        nb_event_features = get_nb_features(feature_set)
+        site_vectors = []
+        for title, motif_starts in sites:
+            motif_table = motif_features(data, motif_starts, strand, feature_set=feature_set,
+                                         kmer_length=kmer_length)
+            if motif_table is False:
+                continue
+            vectors = np.asarray(motif_table_vectors(motif_table, motif_starts, events_per_pos, strand,
+                                                     nb_event_features))
+            site_vectors.append((title, motif_starts, vectors))
+    except Exception:
+        return tsv, None
+    return tsv, site_vectors
+
+
+class SiteBuffer(object):
+    """Holds the vectors for one site until there are enough for a batch
+    """
+    def __init__(self, title, predictor):
+        self.title = title
+        self.predictor = predictor
+        self.ensemble = isinstance(predictor, EnsemblePredictor)
+        self.rows = []
+        self.vectors = []
+
+    def add(self, read, motif_starts, vectors):
+        self.rows += [(read, start) for start in motif_starts]
+        self.vectors.append(vectors)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def flush(self, out, aggregator=None):
+        if len(self.rows) == 0:
+            return
+        data = np.vstack(self.vectors)
+        if self.ensemble:
+            probs, disagreement, _ = self.predictor.score(data)
+        else:
+            probs, disagreement = self.predictor.predict_proba(data), None
+        for i, (read, start) in enumerate(self.rows):
+            fields = [read, self.title, str(start)] + ["{:.6f}".format(p) for p in probs[i]]
+            if disagreement is not None:
+                fields.append("{:.4f}".format(disagreement[i]))
+            out.write("\t".join(fields) + "\n")
+        if aggregator is not None:
+            aggregator.add(self.title, [start for _, start in self.rows], probs)
+        self.rows, self.vectors = [], []
+
+
+def score_header(n_classes, ensemble=False):
+    return "\t".join(["read", "site", "motif_start"] + ["p_{}".format(c) for c in xrange(n_classes)] +
+                     (["disagreement"] if ensemble else [])) + "\n"
+
+
+def score_alignments(files, sites, predictors, events_per_pos, strand, out, feature_set=None, batch_size=10000,
+                     jobs=4, kmer_length=6, max_pending=None, aggregator=None, scan=False, min_covered=1):
+    """Score every alignment file in the glob `files` for each site and write a row for each read, site and motif
+    start to the open file `out`. Feature extraction runs in a pool of `jobs` processes while the main process runs
+    the predictors, at most `max_pending` (default 2 * jobs) files are extracted ahead of inference so memory use
+    doesn't grow with the number of files. sites is a list of (title, motif_starts) and predictors is a dict of
+    predictors (NumpyPredictor, EnsemblePredictor, ...) keyed by title. The probabilities are also added to the
+    SiteAggregator `aggregator` if there is one. With scan, every window of at least min_covered covered positions
+    along each read is scored instead of the sites' motif starts (see scanning.py). Returns a dict of counts
+    """
+    # checked before the pool starts, scan_vectors would only fail in the workers
+    assert(not scan or strand in ["t", "c"]), "scanning only works on one strand"
+    vector_size = events_per_pos * get_nb_features(feature_set) * 6 * (1 if strand in ["t", "c"] else 2)
+    for title, predictor in predictors.items():
+        assert(predictor.in_dim == vector_size), "the model for {0} takes {1} features, the vectors have {2}, " \
+                                                 "check --events, --strand and --feature_set".format(
+                                                     title, predictor.in_dim, vector_size)
+    n_classes = set(p.n_classes for p in predictors.values())
+    assert(len(n_classes) == 1), "all the models need the same number of classes to share an output file"
+    buffers = dict((title, SiteBuffer(title, predictors[title])) for title, _ in sites)
+    ensemble = any(b.ensemble for b in buffers.values())
+    assert(all(b.ensemble == ensemble for b in buffers.values())), "can't mix ensembles and single models"
+    out.write(score_header(n_classes.pop(), ensemble))
+
+    if scan is True:
+        extract, extract_args = scan_vectors, {"feature_set": feature_set, "min_covered": min_covered}
+    else:
+        extract, extract_args = read_vectors, {"feature_set": feature_set, "kmer_length": kmer_length}
+    max_pending = 2 * jobs if max_pending is None else max_pending
+    tsvs = iter(alignment_files(files))
+    counts = {"files": 0, "skipped_files": 0, "vectors": 0, "uncovered": 0}
+    pool = Pool(processes=jobs)
+    pending = deque()
+    try:
+        while True:
+            for tsv in tsvs:
+                pending.append(pool.apply_async(extract, (tsv, sites, events_per_pos, strand), extract_args))
+                if len(pending) >= max_pending:
+                    break
+            if len(pending) == 0:
+                break
+            tsv, site_vectors = pending.popleft().get()
+            counts["files"] += 1
+            if site_vectors is None:
+                counts["skipped_files"] += 1
+                continue
+            read = os.path.basename(tsv)
+            for title, motif_starts, vectors in site_vectors:
+                # motif starts the read doesn't have any events for aren't scored
+                covered = ~np.all(np.isnan(vectors), axis=1)
+                counts["uncovered"] += int(np.sum(~covered))
+                counts["vectors"] += int(np.sum(covered))
+                buffers[title].add(read, [s for s, c in zip(motif_starts, covered) if c], vectors[covered])
+                if len(buffers[title]) >= batch_size:
+                    buffers[title].flush(out, aggregator)
+        for buf in buffers.values():
+            buf.flush(out, aggregator)
+    finally:
+        pool.terminate()
+    print("scored {vectors} vectors from {files} files, skipped {skipped_files} files and {uncovered} motifs "
+          "without events".format(**counts), file=sys.stderr)
+    return counts
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""Local inference server, keeps models loaded and batches concurrent requests together
+
+The protocol is one JSON object per line in each direction, over a Unix socket or a TCP port on localhost:
+    {"op": "predict", "model": name, "vectors": [[...], ...]}  -> {"ok": true, "probs": [[...], ...]}
+    {"op": "score_file", "model": name, "file": path}          -> {"ok": true, "motif_starts": [...], "probs": [...]}
+    {"op": "models"}                                           -> {"ok": true, "models": {name: {...}}}
+    {"op": "stats"}                                            -> {"ok": true, "stats": {...}}
+errors come back as {"ok": false, "error": message}. See client.py for a client
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import threading
+import SocketServer
+import numpy as np
+from Queue import Queue, Empty
+from collections import deque
+from scoring import read_vectors
+
+
+class PendingRequest(object):
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.arrival = time.time()
+        self.done = threading.Event()
+        self.probs = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """Runs a predictor on batches made from the requests queued for it. A batch is run when it has max_batch_size
+    vectors or when its oldest request has waited max_latency seconds
+    """
+    def __init__(self, predictor, max_batch_size=1000, max_latency=0.005, nb_latencies=10000):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=nb_latencies)  # seconds from arrival to result for recent requests
+        self.counts = {"requests": 0, "vectors": 0, "batches": 0, "errors": 0, "busy_seconds": 0.0}
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def predict_proba(self, vectors, timeout=None):
+        request = PendingRequest(vectors)
+        self.queue.put(request)
+        assert(request.done.wait(timeout) is not False), "timed out waiting for the model"
+        if request.error is not None:
+            raise request.error
+        return request.probs
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        nb_vectors = len(batch[0].vectors)
+        deadline = batch[0].arrival + self.max_latency
+        while nb_vectors < self.max_batch_size:
+            wait = deadline - time.time()
+            try:
+                request = self.queue.get(timeout=wait) if wait > 0 else self.queue.get_nowait()
+            except Empty:
+                break
+            batch.append(request)
+            nb_vectors += len(request.vectors)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            start = time.time()
+            try:
+                probs = self.predictor.predict_proba(np.vstack([request.vectors for request in batch]))
+                for request, request_probs in zip(batch, np.split(probs, np.cumsum([len(r.vectors)
+                                                                                     for r in batch])[:-1])):
+                    request.probs = request_probs
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finished = time.time()
+            with self.lock:
+                self.counts["batches"] += 1
+                self.counts["busy_seconds"] += finished - start
+                for request in batch:
+                    self.counts["requests"] += 1
+                    self.counts["vectors"] += len(request.vectors)
+                    self.counts["errors"] += request.error is not None
+                    self.latencies.append(finished - request.arrival)
+            for request in batch:
+                request.done.set()
+
+    def stats(self, elapsed):
+        with self.lock:
+            stats = dict(self.counts)
+            latencies = np.array(self.latencies) * 1000
+        # vectors_per_sec is over the server's uptime, vectors_per_busy_sec only counts time spent in the model
+        stats["vectors_per_sec"] = stats["vectors"] / elapsed if elapsed > 0 else 0.0
+        stats["vectors_per_busy_sec"] = stats["vectors"] / stats["busy_seconds"] if stats["busy_seconds"] > 0 else 0.0
+        stats["mean_batch_size"] = stats["vectors"] / float(stats["batches"]) if stats["batches"] > 0 else 0.0
+        for percentile in [50, 90, 99]:
+            stats["latency_ms_p{}".format(percentile)] = \
+                float(np.percentile(latencies, percentile)) if len(latencies) > 0 else 0.0
+        return stats
+
+
+class ServedModel(object):
+    """A predictor and what's needed to make vectors for it from alignment files
+    """
+    def __init__(self, name, predictor, motif_starts=None, events_per_pos=None, strand=None, feature_set=None,
+                 max_batch_size=1000, max_latency=0.005):
+        self.name = name
+        self.motif_starts = motif_starts
+        self.events_per_pos = events_per_pos
+        self.strand = strand
+        self.feature_set = feature_set
+        self.in_dim = predictor.in_dim
+        self.n_classes = predictor.n_classes
+        self.batcher = MicroBatcher(predictor, max_batch_size=max_batch_size, max_latency=max_latency)
+
+    def info(self):
+        return {"in_dim": self.in_dim, "n_classes": self.n_classes, "motif_starts": self.motif_starts,
+                "events_per_pos": self.events_per_pos, "strand": self.strand, "feature_set": self.feature_set}
+
+    def predict_proba(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        assert(vectors.ndim == 2 and vectors.shape[1] == self.in_dim), \
+            "{0} takes vectors with {1} features".format(self.name, self.in_dim)
+        return self.batcher.predict_proba(vectors)
+
+    def score_file(self, tsv):
+        assert(self.motif_starts is not None), "{} wasn't loaded with a site, can't score files".format(self.name)
+        assert(os.path.exists(tsv)), "didn't find {}".format(tsv)
+        _, site_vectors = read_vectors(tsv, [(self.name, self.motif_starts)], self.events_per_pos, self.strand,
+                                       feature_set=self.feature_set)
+        assert(site_vectors is not None), "couldn't read alignments from {}".format(tsv)
+        if len(site_vectors) == 0:
+            return [], []
+        _, motif_starts, vectors = site_vectors[0]
+        covered = ~np.all(np.isnan(vectors), axis=1)
+        return [s for s, c in zip(motif_starts, covered) if c], self.predict_proba(vectors[covered])
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if line.strip() == '':
+                continue
+            try:
+                response = self.server.inference.respond(json.loads(line))
+                response["ok"] = True
+            except Exception as e:
+                response = {"ok": False, "error": "{0}: {1}".format(type(e).__name__, e)}
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+
+class ThreadedUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadedTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class InferenceServer(object):
+    """Serves a dict of ServedModels keyed by name on a Unix socket (socket_path) or a localhost TCP port
+    """
+    def __init__(self, models, socket_path=None, port=None):
+        assert((socket_path is None) != (port is None)), "need one of socket_path or port"
+        self.models = models
+        self.start_time = time.time()
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.server = ThreadedUnixServer(socket_path, RequestHandler)
+        else:
+            self.server = ThreadedTCPServer(("127.0.0.1", port), RequestHandler)
+        self.server.inference = self
+        self.address = self.server.server_address
+
+    def get_model(self, name):
+        assert(name in self.models), "no model named {0}, have {1}".format(name, sorted(self.models.keys()))
+        return self.models[name]
+
+    def stats(self):
+        elapsed = time.time() - self.start_time
+        return {"uptime": elapsed,
+                "models": dict((name, model.batcher.stats(elapsed)) for name, model in self.models.items())}
+
+    def respond(self, request):
+        op = request.get("op")
+        if op == "predict":
+            return {"probs": self.get_model(request["model"]).predict_proba(request["vectors"]).tolist()}
+        elif op == "score_file":
+            motif_starts, probs = self.get_model(request["model"]).score_file(request["file"])
+            return {"motif_starts": motif_starts, "probs": np.asarray(probs).tolist()}
+        elif op == "models":
+            return {"models": dict((name, model.info()) for name, model in self.models.items())}
+        elif op == "stats":
+            return {"stats": self.stats()}
+        raise ValueError("unknown op {}".format(op))
+
+    def serve_forever(self):
+        print("serving {0} models on {1}".format(len(self.models), self.address), file=sys.stderr)
+        self.server.serve_forever()
+
+    def start(self):
+        """Serve from a background thread
+        """
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
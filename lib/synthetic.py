@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Synthetic alignment files in the 14 column layout that read_alignment_table (and cull_motif_features4) reads:
+    contig, ref_pos, ref_kmer, read_pos, strand, event_idx, event_mean, event_noise, read_kmer, aligned_kmer,
+    E_mean, E_noise, posterior, descaled_mean
+for tests and benchmarks
+"""
+from __future__ import print_function
+import os
+import numpy as np
+from utils import get_motif_range
+
+EXPECTED_MEAN = 80.0
+EXPECTED_NOISE = 1.0
+
+
+def write_alignment(tsv, ref_positions, rng, events_per_pos=(1, 3), strands=("t", "c"), shift_positions=(),
+                    shift=0.0):
+    """Write a read aligned to ref_positions, each position gets between events_per_pos[0] and events_per_pos[1]
+    events on each strand. The event means at shift_positions are moved by shift, like a modified base would
+    """
+    shift_positions = set(shift_positions)
+    with open(tsv, 'w') as f:
+        event_idx = 0
+        for position in ref_positions:
+            for strand in strands:
+                for _ in xrange(rng.randint(events_per_pos[0], events_per_pos[1] + 1)):
+                    mean = EXPECTED_MEAN + rng.randn() + (shift if position in shift_positions else 0.0)
+                    f.write("\t".join(map(str, ["ref", position, "ACGTAC", 0, strand, event_idx, mean,
+                                                rng.uniform(0.5, 1.5), "ACGTAC", "x", EXPECTED_MEAN, EXPECTED_NOISE,
+                                                rng.uniform(), mean + rng.randn()])) + "\n")
+                    event_idx += 1
+
+
+def read_start(rng, motif_starts, reference_length, read_length, hit, kmer_length=6, max_tries=1000):
+    """Start of a read of read_length that covers one of the motifs (hit) or none of them
+    """
+    if hit:
+        motif = motif_starts[rng.randint(len(motif_starts))]
+        low, high = max(0, motif + kmer_length - read_length), min(motif, reference_length - read_length)
+        assert(low <= high), "reads are too short to cover a motif"
+        return rng.randint(low, high + 1)
+    motif_positions = set(get_motif_range(motif_starts, kmer_length=kmer_length))
+    for _ in xrange(max_tries):
+        start = rng.randint(0, reference_length - read_length + 1)
+        if motif_positions.isdisjoint(xrange(start, start + read_length)):
+            return start
+    raise AssertionError("couldn't place a read of length {} between the motifs".format(read_length))
+
+
+def write_reads(directory, nb_reads, motif_starts, reference_length=1000, read_length=(100, 300),
+                motif_hit_fraction=1.0, events_per_pos=(1, 3), strands=("t", "c"), shift=0.0, kmer_length=6,
+                seed=0, prefix="read"):
+    """Write nb_reads synthetic alignment files to directory, motif_hit_fraction of them cover one of the motifs.
+    The read lengths are drawn uniformly from read_length, with shift the motif positions are modified (use a
+    different shift for each group of a dataset). Returns the file paths
+    """
+    rng = np.random.RandomState(seed)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    motif_positions = get_motif_range(motif_starts, kmer_length=kmer_length)
+    files = []
+    for i in xrange(nb_reads):
+        length = rng.randint(read_length[0], read_length[1] + 1)
+        start = read_start(rng, motif_starts, reference_length, length, rng.uniform() < motif_hit_fraction,
+                           kmer_length=kmer_length)
+        files.append(os.path.join(directory, "{0}{1}.tsv".format(prefix, i)))
+        write_alignment(files[-1], xrange(start, start + length), rng, events_per_pos=events_per_pos,
+                        strands=strands, shift_positions=motif_positions, shift=shift)
+    return files
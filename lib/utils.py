@@ -11,94 +11,130 @@ import pandas as pd
 import numpy as np
 import theano.tensor as T
 from itertools import chain
+from pandas.io.common import EmptyDataError
+from instrumentation import PipelineMetrics
+from normalization import Normalizer, row_chunks
 from model import NeuralNetwork, ThreeLayerNetwork, ReLUThreeLayerNetwork, \
-    FourLayerNetwork, FourLayerReLUNetwork, ConvolutionalNetwork3
+    FourLayerNetwork, FourLayerReLUNetwork, ConvolutionalNetwork3, GRUNetwork, LSTMNetwork
 from random import shuffle
 
 
+# models that take (time steps, batch, event features) sequences instead of flat vectors
+RECURRENT_MODELS = ["GRU", "LSTM"]
+
+# where a vector came from, the alignment file (read) and the motif start (reference position) of the site
+PROVENANCE_DTYPE = [('read', object), ('motif_start', np.int64)]
+
+
 def get_motif_range(motifs, kmer_length=6):
     return list(chain(*[range(s, s+kmer_length) for s in motifs]))
 
 
-def cull_motif_features4(motif, tsv, strand, feature_set=None, kmer_length=6):
-    try:
-        data = pd.read_table(tsv, usecols=(1, 4, 5, 6, 7, 10, 11, 12, 13),
-                             dtype={'ref_pos': np.int32,
-                                    'event_idx': np.int32,
-                                    'strand': np.str,
-                                    'event_mean': np.float64,
-                                    'event_noise': np.float64,
-                                    'prob': np.float64,
-                                    'E_mean': np.float64,
-                                    'E_noise': np.float64,
-                                    'descaled_mean': np.float64},
-                             header=None,
-                             names=['ref_pos', 'strand', 'event_idx', 'event_mean',
-                                    'event_noise', 'E_mean', 'E_noise', 'prob', 'descaled_mean']
-                             )
-
-        motif_events = get_motif_range(motif, kmer_length=kmer_length)
-
-        if strand in ["t", "c"]:
-            motif_rows = data.ix[(data['ref_pos'].isin(motif_events)) & (data['strand'] == strand)]
-        else:
-            motif_rows = data.ix[(data['ref_pos'].isin(motif_events))]
-
-        if feature_set == "dmean":
-            features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
-                                     "delta_mean": motif_rows['event_mean'] - motif_rows['E_mean'],
-                                     "strand": motif_rows['strand']}
-                                    )
-
-            f = features.sort_values(['ref_pos', 'strand'], ascending=[True, False])\
-                .drop_duplicates(subset='delta_mean')
-            return f
-        elif feature_set == "mean":
-            features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
-                                     "delta_mean": motif_rows['descaled_mean'],
-                                     "posterior": motif_rows['prob'],
-                                     "strand": motif_rows['strand']}
-                                    )
-
-            f = features.sort_values(['ref_pos', 'strand'], ascending=[True, False])\
-                .drop_duplicates(subset='delta_mean')
-            return f
-        elif feature_set == "all":
-            features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
-                                     "delta_mean": motif_rows['event_mean'] - motif_rows['E_mean'],
-                                     "delta_noise": motif_rows['event_noise'] - motif_rows['E_noise'],
-                                     "posterior": motif_rows['prob'],
-                                     "strand": motif_rows['strand']}
-                                    )
-
-        elif feature_set == "noise":
-            features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
-                                     "delta_mean": motif_rows['event_mean'] - motif_rows['E_mean'],
-                                     "delta_noise": motif_rows['event_noise'] - motif_rows['E_noise'],
-                                     "strand": motif_rows['strand']}
-                                    )
-
-            f = features.sort_values(['ref_pos', 'strand'], ascending=[True, False])\
-                .drop_duplicates(subset='delta_mean')
-            return f
-
-        else:
-            features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
-                                     "delta_mean": motif_rows['event_mean'] - motif_rows['E_mean'],
-                                     "posterior": motif_rows['prob'],
-                                     "strand": motif_rows['strand']}
-                                    )
-
-        if features.empty:
-            return False
-
-        f = features.sort_values(['ref_pos', 'strand', 'posterior'], ascending=[True, False, False])\
+def read_alignment_table(tsv):
+    """Read the columns of an alignment tsv that the features are made from
+    """
+    return pd.read_table(tsv, usecols=(1, 4, 5, 6, 7, 10, 11, 12, 13),
+                         dtype={'ref_pos': np.int32,
+                                'event_idx': np.int32,
+                                'strand': np.str,
+                                'event_mean': np.float64,
+                                'event_noise': np.float64,
+                                'prob': np.float64,
+                                'E_mean': np.float64,
+                                'E_noise': np.float64,
+                                'descaled_mean': np.float64},
+                         header=None,
+                         names=['ref_pos', 'strand', 'event_idx', 'event_mean',
+                                'event_noise', 'E_mean', 'E_noise', 'prob', 'descaled_mean']
+                         )
+
+
+def motif_features(data, motif, strand, feature_set=None, kmer_length=6):
+    motif_events = get_motif_range(motif, kmer_length=kmer_length)
+
+    if strand in ["t", "c"]:
+        motif_rows = data.ix[(data['ref_pos'].isin(motif_events)) & (data['strand'] == strand)]
+    else:
+        motif_rows = data.ix[(data['ref_pos'].isin(motif_events))]
+
+    if feature_set == "dmean":
+        features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
+                                 "delta_mean": motif_rows['event_mean'] - motif_rows['E_mean'],
+                                 "strand": motif_rows['strand']}
+                                )
+
+        f = features.sort_values(['ref_pos', 'strand'], ascending=[True, False])\
+            .drop_duplicates(subset='delta_mean')
+        return f
+    elif feature_set == "mean":
+        features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
+                                 "delta_mean": motif_rows['descaled_mean'],
+                                 "posterior": motif_rows['prob'],
+                                 "strand": motif_rows['strand']}
+                                )
+
+        f = features.sort_values(['ref_pos', 'strand'], ascending=[True, False])\
+            .drop_duplicates(subset='delta_mean')
+        return f
+    elif feature_set == "all":
+        features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
+                                 "delta_mean": motif_rows['event_mean'] - motif_rows['E_mean'],
+                                 "delta_noise": motif_rows['event_noise'] - motif_rows['E_noise'],
+                                 "posterior": motif_rows['prob'],
+                                 "strand": motif_rows['strand']}
+                                )
+
+    elif feature_set == "noise":
+        features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
+                                 "delta_mean": motif_rows['event_mean'] - motif_rows['E_mean'],
+                                 "delta_noise": motif_rows['event_noise'] - motif_rows['E_noise'],
+                                 "strand": motif_rows['strand']}
+                                )
+
+        f = features.sort_values(['ref_pos', 'strand'], ascending=[True, False])\
             .drop_duplicates(subset='delta_mean')
         return f
 
-    except:
+    else:
+        features = pd.DataFrame({"ref_pos": motif_rows['ref_pos'],
+                                 "delta_mean": motif_rows['event_mean'] - motif_rows['E_mean'],
+                                 "posterior": motif_rows['prob'],
+                                 "strand": motif_rows['strand']}
+                                )
+
+    if features.empty:
         return False
 
+    f = features.sort_values(['ref_pos', 'strand', 'posterior'], ascending=[True, False, False])\
+        .drop_duplicates(subset='delta_mean')
+    return f
+
+
+def cull_motif_features4(motif, tsv, strand, feature_set=None, kmer_length=6, metrics=None):
+    # returns False for files that can't be used, the reason is counted in metrics (see instrumentation.py)
+    metrics = PipelineMetrics() if metrics is None else metrics
+    try:
+        with metrics.timer("parse"):
+            data = read_alignment_table(tsv)
+    except (IOError, OSError):
+        return metrics.skip(tsv, "unreadable")
+    except EmptyDataError:
+        return metrics.skip(tsv, "empty")
+    except ValueError:
+        # rows with the wrong number of columns or values that aren't numbers
+        return metrics.skip(tsv, "malformed")
+    except Exception as e:
+        return metrics.skip(tsv, "error ({})".format(type(e).__name__))
+    metrics.count("rows_parsed", len(data))
+    try:
+        with metrics.timer("features"):
+            motif_table = motif_features(data, motif, strand, feature_set=feature_set, kmer_length=kmer_length)
+    except Exception as e:
+        return metrics.skip(tsv, "error ({})".format(type(e).__name__))
+    if motif_table is False:
+        return metrics.skip(tsv, "no motif events")
+    return motif_table
+
 
 def get_nb_features(feature_set):
     assert(feature_set in ['all', 'dmean', 'noise', 'mean', None]), "invalid feature set"
@@ -110,24 +146,14 @@ def get_nb_features(feature_set):
         return 3
 
 
-def collect_data_vectors2(events_per_pos, label, portion, files, strand,
-                          motif_starts, dataset_title,
-                          max_samples,
-                          feature_set=None, kmer_length=6, split_dataset=True):
-    assert(portion < 1.0 and max_samples >= 1)
-    # collect the files
-    tsvs = [x for x in glob.glob(files) if os.stat(x).st_size != 0]
-    shuffle(tsvs)
-
-    if max_samples < len(tsvs):
-        tsvs = tsvs[:max_samples]
-
+def motif_table_vectors(motif_table, motif_starts, events_per_pos, strand, nb_event_features):
+    """Make the feature vector for each motif start from a table made by motif_features
+    """
     # container for feature vectors
     # for the echelon alignments, we allow for a defined number of aligned events, there are 6 positions,
     # so for each read (set of observations) we need:
     # (nb_events * nb_event_features * positions) * number_of_strands
     nb_events_per_column = events_per_pos
-    nb_event_features = get_nb_features(feature_set)
     nb_positions = 6
 
     strands = [strand] if strand == "t" or strand == "c" else ["t", "c"]
@@ -137,9 +163,70 @@ def collect_data_vectors2(events_per_pos, label, portion, files, strand,
     vector_size = (nb_events_per_column * nb_event_features * nb_positions) * nb_strands
     position_idx_offset = nb_events_per_column * nb_event_features
 
+    vectors = []
+    for motif_start in motif_starts:
+        vect = np.full(shape=vector_size, fill_value=np.nan)
+        for idx, position in enumerate(xrange(motif_start, motif_start + nb_positions)):
+            # this giant thing takes the DataFrame which has all of the events aligned to the portion we're looking
+            # at, gets only the ones aligned to 'position', removes the ref_position column, takes only the highest
+            # events_per_pos events, turns it into a list of lists, then chains it into one long list. in case you
+            # forgot, the table comes pre-sorted, so when you take the top n events, they are already sorted
+            # in descending posterior match prob
+            events = []
+            for o, s in enumerate(strands):
+                events += list(chain(
+                    *motif_table.ix[(motif_table['ref_pos'] == position) & (motif_table['strand'] == s)]
+                    .drop(['ref_pos', 'strand'], 1)[:events_per_pos].values.tolist()))
+                # add them to the feature vector
+                for _ in xrange(len(events)):
+                    vect[((idx * position_idx_offset) * (o + 1)) + _] = events[_]
+        vectors.append(vect)
+    return vectors
+
+
+def glob_alignment_files(files, metrics):
+    """Alignment files matching the glob files, empty files are skipped
+    """
+    with metrics.timer("glob"):
+        tsvs = glob.glob(files)
+        sizes = [os.stat(x).st_size for x in tsvs]
+    metrics.count("files_found", len(tsvs))
+    for tsv, size in zip(tsvs, sizes):
+        if size == 0:
+            metrics.skip(tsv, "empty")
+    return [tsv for tsv, size in zip(tsvs, sizes) if size != 0]
+
+
+def count_vectors(metrics, vectors):
+    # vectors is a list of feature vectors (or sequences), missing events are NaNs
+    values = np.concatenate([np.ravel(v) for v in vectors]) if len(vectors) > 0 else np.zeros(0)
+    metrics.count("vectors_built", len(vectors))
+    metrics.count("vector_values", values.size)
+    metrics.count("nan_values", int(np.isnan(values).sum()))
+
+
+def collect_data_vectors2(events_per_pos, label, portion, files, strand,
+                          motif_starts, dataset_title,
+                          max_samples,
+                          feature_set=None, kmer_length=6, split_dataset=True, return_provenance=False,
+                          metrics=None):
+    # with return_provenance, each set also gets an array of the (read, motif_start) each vector came from, see
+    # PROVENANCE_DTYPE
+    assert(portion < 1.0 and max_samples >= 1)
+    metrics = PipelineMetrics() if metrics is None else metrics
+    # collect the files
+    tsvs = glob_alignment_files(files, metrics)
+    shuffle(tsvs)
+
+    if max_samples < len(tsvs):
+        tsvs = tsvs[:max_samples]
+
+    nb_event_features = get_nb_features(feature_set)
+
     # containers
     dataset = []
     dataset_append = dataset.append
+    provenance = []
 
     print("{0}: Getting vectors from {1}, collecting {2} features per site".format(dataset_title,
                                                                                    files, nb_event_features),
@@ -148,44 +235,163 @@ def collect_data_vectors2(events_per_pos, label, portion, files, strand,
     for i, f in enumerate(tsvs):
         # get the dataFrame of all features for all motif positions for this file
         motif_table = cull_motif_features4(motif=motif_starts, tsv=f, feature_set=feature_set,
-                                           strand=strand, kmer_length=kmer_length)
+                                           strand=strand, kmer_length=kmer_length, metrics=metrics)
 
         if motif_table is False:
             continue
-        for motif_start in motif_starts:
-            vect = np.full(shape=vector_size, fill_value=np.nan)
-            for idx, position in enumerate(xrange(motif_start, motif_start + nb_positions)):
-                # this giant thing takes the DataFrame which has all of the events aligned to the portion we're looking
-                # at, gets only the ones aligned to 'position', removes the ref_position column, takes only the highest
-                # events_per_pos events, turns it into a list of lists, then chains it into one long list. in case you
-                # forgot, the table comes pre-sorted, so when you take the top n events, they are already sorted
-                # in descending posterior match prob
-                events = []
-                for o, s in enumerate(strands):
-                    events += list(chain(
-                        *motif_table.ix[(motif_table['ref_pos'] == position) & (motif_table['strand'] == s)]
-                        .drop(['ref_pos', 'strand'], 1)[:events_per_pos].values.tolist()))
-                    # add them to the feature vector
-                    for _ in xrange(len(events)):
-                        vect[((idx * position_idx_offset) * (o + 1)) + _] = events[_]
+        metrics.count("files_read")
+        with metrics.timer("vectors"):
+            vectors = motif_table_vectors(motif_table, motif_starts, events_per_pos, strand, nb_event_features)
+        for motif_start, vect in zip(motif_starts, vectors):
             dataset_append(vect)
+            provenance.append((os.path.basename(f), motif_start))
 
     total_vectors = len(dataset)
+    count_vectors(metrics, dataset)
     labels = np.full(shape=[1, total_vectors], fill_value=label, dtype=np.int32)
+    provenance = np.array(provenance, dtype=PROVENANCE_DTYPE)
 
     if split_dataset is True:
         train_split = int(portion * total_vectors)
         xtrain_split = int(train_split + 0.5 * ((1 - portion) * total_vectors))
 
-        np.random.shuffle(dataset)
-
-        return (np.asarray(dataset[:train_split]), labels[0][:train_split]), \
-               (np.asarray(dataset[train_split:xtrain_split]), labels[0][train_split:xtrain_split]), \
-               (np.asarray(dataset[xtrain_split:]), labels[0][xtrain_split:])
+        # shuffle the vectors and their provenance together
+        order = np.random.permutation(total_vectors)
+        dataset = np.asarray(dataset)[order]
+        provenance = provenance[order]
+
+        sets = ((dataset[:train_split], labels[0][:train_split], provenance[:train_split]),
+                (dataset[train_split:xtrain_split], labels[0][train_split:xtrain_split],
+                 provenance[train_split:xtrain_split]),
+                (dataset[xtrain_split:], labels[0][xtrain_split:], provenance[xtrain_split:]))
+        return sets if return_provenance is True else tuple(s[:2] for s in sets)
+    elif return_provenance is True:
+        return np.asarray(dataset), labels[0], provenance
     else:
         return np.asarray(dataset), labels[0]
 
 
+def collect_group_vectors(groups, motif_start_positions, events_per_pos, strand, max_samples, dataset_title,
+                          feature_set=None, kmer_length=6, metrics=None):
+    """Collect the (unsplit) vectors for each group of alignment files and stack them, the label of each vector
+    is the index of its group. Groups that are None are skipped
+    """
+    datasets, labels = [], []
+    for n, group in enumerate(groups):
+        if group is None:
+            continue
+        dataset, group_labels = collect_data_vectors2(events_per_pos=events_per_pos, label=n, portion=0.0,
+                                                      files=group, strand=strand,
+                                                      motif_starts=motif_start_positions[n],
+                                                      dataset_title=dataset_title + "_group{}".format(n),
+                                                      max_samples=max_samples, feature_set=feature_set,
+                                                      kmer_length=kmer_length, split_dataset=False,
+                                                      metrics=metrics)
+        if len(dataset) == 0:
+            continue
+        datasets.append(dataset)
+        labels.append(group_labels)
+    assert(len(datasets) > 0), "didn't get any vectors for {}".format(dataset_title)
+    return np.vstack(datasets), np.concatenate(labels)
+
+
+def get_nb_sequence_features(feature_set, nb_positions=6):
+    # each event in a sequence has its features, a one-hot of its position in the motif and a strand flag
+    return get_nb_features(feature_set) + nb_positions + 1
+
+
+def motif_event_sequences(motif_table, motif_starts, nb_positions=6):
+    """Make one (nb_events, nb_sequence_features) array for each motif start with every event aligned to the
+    motif. The table from cull_motif_features4 is sorted by position first, so the events come out in reference
+    order. Motifs without any aligned events are left out.
+    """
+    event_features = motif_table.drop(['ref_pos', 'strand'], 1).values.astype(np.float64)
+    ref_positions = motif_table['ref_pos'].values
+    strand_flags = (motif_table['strand'].values == "c").astype(np.float64)
+
+    sequences = []
+    for motif_start in motif_starts:
+        in_motif = (ref_positions >= motif_start) & (ref_positions < motif_start + nb_positions)
+        nb_events = np.count_nonzero(in_motif)
+        if nb_events == 0:
+            continue
+        one_hot_positions = np.zeros((nb_events, nb_positions))
+        one_hot_positions[np.arange(nb_events), ref_positions[in_motif] - motif_start] = 1
+        sequences.append(np.hstack((event_features[in_motif], one_hot_positions, strand_flags[in_motif][:, None])))
+
+    return sequences
+
+
+def collect_sequence_vectors(label, portion, files, strand, motif_starts, dataset_title, max_samples,
+                             feature_set=None, kmer_length=6, split_dataset=True, metrics=None):
+    """Same as collect_data_vectors2, but keeps every event aligned to each motif as a variable length sequence
+    instead of truncating to events_per_pos and padding with NaNs
+    """
+    assert(portion < 1.0 and max_samples >= 1)
+    metrics = PipelineMetrics() if metrics is None else metrics
+    tsvs = glob_alignment_files(files, metrics)
+    shuffle(tsvs)
+
+    if max_samples < len(tsvs):
+        tsvs = tsvs[:max_samples]
+
+    print("{0}: Getting sequences from {1}, collecting {2} features per event".format(
+        dataset_title, files, get_nb_sequence_features(feature_set)), end='\n', file=sys.stderr)
+
+    dataset = []
+    for f in tsvs:
+        motif_table = cull_motif_features4(motif=motif_starts, tsv=f, feature_set=feature_set,
+                                           strand=strand, kmer_length=kmer_length, metrics=metrics)
+        if motif_table is False:
+            continue
+        metrics.count("files_read")
+        with metrics.timer("vectors"):
+            dataset += motif_event_sequences(motif_table, motif_starts)
+
+    total_sequences = len(dataset)
+    count_vectors(metrics, dataset)
+    labels = np.full(shape=[total_sequences], fill_value=label, dtype=np.int32)
+
+    if split_dataset is True:
+        train_split = int(portion * total_sequences)
+        xtrain_split = int(train_split + 0.5 * ((1 - portion) * total_sequences))
+
+        shuffle(dataset)
+
+        return (dataset[:train_split], labels[:train_split]), \
+               (dataset[train_split:xtrain_split], labels[train_split:xtrain_split]), \
+               (dataset[xtrain_split:], labels[xtrain_split:])
+    else:
+        return dataset, labels
+
+
+def bucket_sequences(sequences, labels, batch_size, shuffle_batches=True):
+    """Sort the sequences by length and cut them into mini-batches so that each batch is only padded to the
+    longest sequence in it. Returns a list of (x, mask, y, index) tuples where x is (time steps, batch, features),
+    mask marks the real events and index holds the position of each batch member in the input list
+    """
+    assert(len(sequences) == len(labels))
+    labels = np.asarray(labels, dtype=np.int32)
+    lengths = np.asarray([len(s) for s in sequences])
+    order = np.argsort(lengths, kind='mergesort')
+
+    batches = []
+    for k in xrange(0, len(order), batch_size):
+        index = order[k:k + batch_size]
+        max_length = lengths[index].max()
+        x = np.zeros((max_length, len(index), sequences[index[0]].shape[1]), dtype=theano.config.floatX)
+        mask = np.zeros((max_length, len(index)), dtype=theano.config.floatX)
+        for j, i in enumerate(index):
+            x[:lengths[i], j] = sequences[i]
+            mask[:lengths[i], j] = 1
+        batches.append((x, mask, labels[index], index))
+
+    if shuffle_batches is True:
+        shuffle(batches)
+
+    return batches
+
+
 def shuffle_and_maintain_labels(data, labels):
     assert len(data) == len(labels)
     dataset = zip(data, labels)
@@ -197,24 +403,19 @@ def shuffle_and_maintain_labels(data, labels):
 
 
 def preprocess_data(training_vectors, xtrain_vectors, test_vectors, preprocess=None):
+    # the statistics are fitted on the training vectors (see Normalizer), the arrays given aren't changed
     assert(len(training_vectors.shape) == 2 and len(xtrain_vectors.shape) == 2 and len(test_vectors.shape) == 2)
-    if preprocess == "center" or preprocess == "normalize":
-        training_mean_vector = np.nanmean(training_vectors, axis=0)
-        training_vectors -= training_mean_vector
-        xtrain_vectors -= training_mean_vector
-        test_vectors -= training_mean_vector
-
-        if preprocess == "normalize":
-            training_std_vector = np.nanstd(training_vectors, axis=0)
-            training_vectors /= training_std_vector
-            xtrain_vectors /= training_std_vector
-            test_vectors /= training_std_vector
+    normalizer = Normalizer.fit(row_chunks(training_vectors), preprocess=preprocess)
+    return normalizer.transform(training_vectors), normalizer.transform(xtrain_vectors), \
+        normalizer.transform(test_vectors)
 
-    prc_training_vectors = np.nan_to_num(training_vectors)
-    prc_xtrain_vectors = np.nan_to_num(xtrain_vectors)
-    prc_test_vectors = np.nan_to_num(test_vectors)
 
-    return prc_training_vectors, prc_xtrain_vectors, prc_test_vectors
+def append_site_one_hot(vectors, site_indices, nb_sites):
+    """Append a one-hot encoding of the site of each vector, for the multi-task models
+    """
+    one_hot = np.zeros((len(vectors), nb_sites), dtype=vectors.dtype)
+    one_hot[np.arange(len(vectors)), site_indices] = 1
+    return np.hstack((vectors, one_hot))
 
 
 def get_network(x, in_dim, n_classes, hidden_dim, model_type, extra_args=None):
@@ -231,6 +432,10 @@ def get_network(x, in_dim, n_classes, hidden_dim, model_type, extra_args=None):
     if model_type == "ConvNet3":
         return ConvolutionalNetwork3(x=x, in_dim=in_dim, n_classes=n_classes, hidden_dim=hidden_dim,
                                      **extra_args)
+    if model_type == "GRU":
+        return GRUNetwork(x=x, in_dim=in_dim, n_classes=n_classes, hidden_dim=hidden_dim)
+    if model_type == "LSTM":
+        return LSTMNetwork(x=x, in_dim=in_dim, n_classes=n_classes, hidden_dim=hidden_dim)
     else:
         print("Invalid model type", file=sys.stderr)
         return False
@@ -88,6 +88,20 @@ for m in [747, 354, 147, 796, 289, 363, 755, 626, 813, 653, 525, 80, 874]:
     j['sites'].append(d)
 cPickle.dump(j, open("./configs/indivCytosineZymo_conv.pkl", 'w'))
 ###############################################################################
+j = {
+    "experiment_name": "individual cytosine motif classification GRU",
+    "hidden_dim": [50],
+    "model_type": "GRU",
+    "sites": []
+}
+for m in [747, 354, 147, 796, 289, 363, 755, 626, 813, 653, 525, 80, 874]:
+    m_list = [m]
+    d = dict()
+    d['motif_start_position'] = [m_list, m_list, m_list]
+    d['title'] = str(m)
+    j['sites'].append(d)
+cPickle.dump(j, open("./configs/indivCytosineZymo_GRU.pkl", 'w'))
+###############################################################################
 j = {
     "experiment_name": "indvidual null motif classification",
     "hidden_dim": [50, 10],
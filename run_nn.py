@@ -1,11 +1,23 @@
 #!/usr/bin/env python
 """Run a Neural Network on collected alignment data
 """
+import os
 import sys
+import time
 import cPickle
-from lib.neural_network import classify_with_network3, classify_with_network2
+import traceback
+from lib.neural_network import classify_with_network3, classify_with_network2, classify_with_recurrent_network, \
+    classify_multi_task, manifest_key
+from lib.manifest import Manifest, MANIFEST_FILE
+from lib.results_store import fail_open_runs
+from lib.utils import RECURRENT_MODELS
+from lib.profiling import profile_dir, profile_call, hotspot_report
+from lib.scheduler import run_tasks, task_report, estimated_size, threads_per_worker, pin_threads
+from lib.fs_queue import TaskQueue, run_worker
 from argparse import ArgumentParser
-from multiprocessing import Process, current_process, Manager
+from functools import partial
+from inspect import getcallargs
+from multiprocessing import Process
 
 
 def parse_args():
@@ -31,6 +43,10 @@ def parse_args():
                         default=50, type=int, help="maximum number of reads to use")
     parser.add_argument('--jobs', '-j', action='store', dest='jobs', required=False,
                         default=4, type=int, help="number of jobs to run concurrently")
+    parser.add_argument('--threads', action='store', dest='threads', required=False, default=None, type=int,
+                        help="BLAS/OpenMP threads for each job, default is the cores divided between the jobs")
+    parser.add_argument('--retries', action='store', dest='retries', required=False, default=0, type=int,
+                        help="number of times to retry a site that fails")
     parser.add_argument('--iter', '-i', action='store', dest='iter', required=False,
                         default=1, type=int, help="number of iterations to do")
     parser.add_argument('--learning_algorithm', '-a', dest='learning_algo', required=False,
@@ -53,28 +69,117 @@ def parse_args():
                         type=str, default=None, help="pick features: all, mean, noise, default: mean with"
                                                      " posteriors")
     parser.add_argument('--events', '-ev', action='store', required=True, dest='events', type=int,
-                        help='number of events per alignment column to use')
+                        help='number of events per alignment column to use, the recurrent models (GRU, LSTM) '
+                             'use all of the events')
+    parser.add_argument('--multi_task', action='store_true', dest='multi_task', default=False,
+                        help="train one network for all of the sites instead of one for each site")
+    parser.add_argument('--transfer_from', action='store', dest='transfer_from', required=False, type=str,
+                        default=None, help="base model file to initialize the hidden layers from, eg. the "
+                                           "multi_task_model.pkl from a --multi_task run, the softmax layer is reset")
+    parser.add_argument('--freeze_hidden', action='store_true', dest='freeze_hidden', default=False,
+                        help="with --transfer_from, only train the softmax layer")
+    parser.add_argument('--fine_tune_epochs', action='store', dest='fine_tune_epochs', required=False, type=int,
+                        default=None, help="with --transfer_from, number of epochs to fine-tune for instead of "
+                                           "--epochs, default is a tenth of --epochs")
+    parser.add_argument('--results_db', action='store', dest='results_db', required=False, type=str, default=None,
+                        help="SQLite database to record the runs in, default is results.db in the output location. "
+                             "On a network filesystem it uses the rollback journal instead of WAL, which needs "
+                             "working NFS locks, a database on local disk is safer there")
+    parser.add_argument('--restart', action='store_true', dest='restart', default=False,
+                        help="train every site and iteration again instead of skipping the ones in the output "
+                             "location's manifest that finished with the same settings and input files")
+    parser.add_argument('--queue', action='store', dest='queue', required=False, type=str, default=None,
+                        help="directory on a shared filesystem to queue the sites in, --jobs workers here and "
+                             "run_nn_worker.py on other nodes work on them, the output location has to be on the "
+                             "shared filesystem too")
+    parser.add_argument('--lease', action='store', dest='lease', required=False, type=float, default=600.0,
+                        help="with --queue, seconds without a word from a worker before its site is queued again, "
+                             "a site is given up on after its worker dies 3 times")
+    parser.add_argument('--profile', action='store_true', dest='profile', default=False,
+                        help="profile each site with cProfile and Theano's op profiling, the dumps and a merged "
+                             "hotspot report go in profiles/ in the output location")
+    parser.add_argument('--profile_top', action='store', dest='profile_top', required=False, type=int, default=30,
+                        help="number of functions and ops in the hotspot report")
     parser.add_argument('--output_location', '-o', action='store', dest='out',
                         required=True, type=str, default=None,
                         help="directory to put results")
     args = parser.parse_args()
+    assert(args.transfer_from is not None or (args.fine_tune_epochs is None and args.freeze_hidden is False)), \
+        "--freeze_hidden and --fine_tune_epochs need --transfer_from"
+    assert(args.transfer_from is None or not args.multi_task), "--transfer_from is for fine-tuning single sites"
+    assert(args.transfer_from is None or args.model_file is None), \
+        "--transfer_from starts from a base model, it can't be used with --model_dir"
     return args
 
 
-def run_nn3(work_queue, done_queue):
+def classify(classifier, nn_args, profile):
+    # profile is the directory for the profile dumps, or None
     try:
-        for f in iter(work_queue.get, 'STOP'):
-            n = classify_with_network3(**f)
+        if profile is None:
+            return classifier(**nn_args)
+        return profile_call(classifier, nn_args, profile, nn_args['title'])
     except Exception:
-        done_queue.put("%s failed" % current_process().name)
+        # a retry starts a new run, this one is closed as failed
+        fail_open_runs(traceback.format_exc())
+        raise
 
 
-def run_nn2(work_queue, done_queue):
-    try:
-        for f in iter(work_queue.get, 'STOP'):
-            n = classify_with_network2(**f)
-    except Exception:
-        done_queue.put("%s failed" % current_process().name)
+CLASSIFIERS = dict((f.__name__, f) for f in [classify_with_network3, classify_with_network2, classify_multi_task,
+                                             classify_with_recurrent_network])
+
+
+def run_queued_task(task):
+    # a task from the --queue directory
+    classify(CLASSIFIERS[task['classifier']], task['nn_args'], task['profile'])
+    return task['nn_args']['title']
+
+
+def queue_worker(queue_dir, threads, poll_seconds):
+    if threads is not None:
+        pin_threads(threads)
+    run_worker(TaskQueue(queue_dir), run_queued_task, poll_seconds=poll_seconds)
+
+
+def start_queue_workers(queue_dir, jobs, threads=None, poll_seconds=5.0):
+    threads = threads_per_worker(jobs) if threads is None else threads
+    processes = [Process(target=queue_worker, args=(queue_dir, threads, poll_seconds)) for _ in xrange(jobs)]
+    for p in processes:
+        p.start()
+    return processes, threads
+
+
+def run_queued(classifier, tasks, keys, profile, jobs, args, poll_seconds=5.0):
+    """Put the tasks in the args.queue directory, biggest first, work on them with jobs workers here and wait until
+    every site in the queue has finished (other nodes can run run_nn_worker.py on the queue). Returns a
+    record for each task like run_tasks
+    """
+    # --retries is for sites that raise, a site whose worker died is queued again without using one up
+    queue = TaskQueue(args.queue, lease_seconds=args.lease, max_attempts=args.retries + 1)
+    sizes = [estimated_size(task) for task in tasks]
+    # sites with new settings or input files get new tasks
+    task_ids = ["{0}.{1}".format(task['title'], key[:12]) for task, key in zip(tasks, keys)]
+    # the key leaves out the iterations, so a site that was done in the queue is queued again when the manifest
+    # has iterations it still needs (more --iter, or outputs that were deleted)
+    manifest = Manifest(tasks[0]['manifest_file'], resume=not args.restart)
+    for priority, i in enumerate(sorted(xrange(len(tasks)), key=lambda i: sizes[i], reverse=True)):
+        replace = len(manifest.pending(keys[i], tasks[i]['iterations'])) > 0
+        queue.put(task_ids[i], {"classifier": classifier.__name__, "nn_args": tasks[i], "profile": profile},
+                  priority=priority, replace=replace)
+    processes, threads = start_queue_workers(args.queue, jobs, threads=args.threads, poll_seconds=poll_seconds)
+    while not queue.drained():
+        queue.requeue_expired()
+        time.sleep(poll_seconds)
+    for p in processes:
+        p.join()
+
+    results = queue.results()
+    records = []
+    for task, task_id, size in zip(tasks, task_ids, sizes):
+        state, result = results.get(task_id, ("lost", {}))
+        records.append({"title": task['title'], "status": state, "seconds": result.get("seconds"),
+                        "attempts": result.get("attempt", result.get("attempts")), "estimated_size": size,
+                        "threads": threads, "worker": result.get("worker")})
+    return records
 
 
 def main(args):
@@ -93,6 +198,12 @@ def main(args):
 
     assert(batch_size is not None), "You need to specify batch_size with a flag or have it in the config file"
 
+    if args.transfer_from is not None:
+        assert(config['model_type'] not in RECURRENT_MODELS), "can only transfer to the feed-forward models"
+        epochs = args.fine_tune_epochs if args.fine_tune_epochs is not None else max(1, args.epochs / 10)
+    else:
+        epochs = args.epochs
+
     start_message = """
 #    Starting Neural Net analysis for {title}
 #    Command line: {cmd}
@@ -108,22 +219,26 @@ def main(args):
 #    Non-default feature set: {feature_set}
 #    Iterations: {iter}.
 #    Epochs: {epochs}
+#    Transfer from: {transfer}
+#    Frozen hidden layers: {freeze}
 #    Data pre-processing: {center}
 #    Train/test split: {train_test}
 #    L1 reg: {L1}
 #    L2 reg: {L2}
 #    Output to: {out}""".format(nbFiles=args.nb_files, strand=args.strand, iter=args.iter,
-                                train_test=args.split, out=args.out, epochs=args.epochs, center=args.preprocess,
+                                train_test=args.split, out=args.out, epochs=epochs, center=args.preprocess,
                                 L1=args.L1, L2=args.L2, type=config['model_type'], dims=config['hidden_dim'],
                                 nb_events=args.events,cmd=" ".join(sys.argv[:]), title=config['experiment_name'],
                                 batch=batch_size, algo=args.learning_algo, models=args.model_file,
-                                feature_set=args.features, config=args.config)
+                                feature_set=args.features, config=args.config, transfer=args.transfer_from,
+                                freeze=args.freeze_hidden)
 
     print >> sys.stdout, start_message
+    results_db = args.results_db if args.results_db is not None else os.path.join(args.out, "results.db")
     workers = args.jobs
-    work_queue = Manager().Queue()
-    done_queue = Manager().Queue()
-    jobs = []
+    tasks = []
+    manifest_file = os.path.join(args.out, MANIFEST_FILE)
+    profile = profile_dir(args.out) if args.profile is True else None
 
     for experiment in config['sites']:
         nn_args = {
@@ -139,7 +254,7 @@ def main(args):
             "learning_algorithm": args.learning_algo,
             "train_test_split": args.split,
             "iterations": args.iter,
-            "epochs": args.epochs,
+            "epochs": epochs,
             "max_samples": args.nb_files,
             "batch_size": batch_size,
             "learning_rate": args.learning_rate,
@@ -150,26 +265,72 @@ def main(args):
             "model_dir": args.model_file,
             "extra_args": extra_args,
             "out_path": args.out,
+            "results_db": results_db,
+            "experiment": config['experiment_name'],
+            "manifest_file": manifest_file,
+            "resume": not args.restart,
         }
+        if args.transfer_from is not None:
+            nn_args['transfer_model'] = args.transfer_from
+            nn_args['freeze_hidden'] = args.freeze_hidden
+        if args.multi_task is True:
+            # one job with all of the sites, named after the experiment
+            del nn_args['motif_start_positions']
+            nn_args['sites'] = config['sites']
+            nn_args['title'] = config['experiment_name']
+            tasks.append(nn_args)
+            break
         #classify_with_network3(**nn_args)  # activate for debugging
-        work_queue.put(nn_args)
+        tasks.append(nn_args)
 
-    for w in xrange(workers):
-        if args.group_3 is None:
-            p = Process(target=run_nn2, args=(work_queue, done_queue))
-        else:
-            p = Process(target=run_nn3, args=(work_queue, done_queue))
-        p.start()
-        jobs.append(p)
-        work_queue.put('STOP')
+    if args.multi_task is True:
+        assert(config['model_type'] not in RECURRENT_MODELS), "the multi-task option is for the feed-forward models"
+        workers = 1
+        classifier = classify_multi_task
+    elif config['model_type'] in RECURRENT_MODELS:
+        classifier = classify_with_recurrent_network
+    elif args.group_3 is None:
+        classifier = classify_with_network2
+    else:
+        classifier = classify_with_network3
 
-    for p in jobs:
-        p.join()
+    keys = [manifest_key(getcallargs(classifier, **task)) for task in tasks]
+    if args.restart is False:
+        # the sites that finished all of their iterations in an earlier run aren't scheduled
+        manifest = Manifest(manifest_file)
+        finished = [task['title'] for task, key in zip(tasks, keys)
+                    if len(manifest.pending(key, task['iterations'])) == 0]
+        tasks, keys = [task for task in tasks if task['title'] not in finished], \
+            [key for task, key in zip(tasks, keys) if task['title'] not in finished]
+        if len(finished) > 0:
+            print >> sys.stdout, "\n\tSkipping {0} sites that finished in an earlier run: {1}".format(
+                len(finished), ", ".join(finished))
+
+    if len(tasks) == 0:
+        records = []
+    elif args.queue is not None:
+        records = run_queued(classifier, tasks, keys, profile, workers, args)
+    else:
+        records = run_tasks(partial(classify, classifier, profile=profile), tasks, workers, threads=args.threads,
+                            retries=args.retries)
+    if len(records) > 0:
+        print >> sys.stdout, "\n\t{0} threads for each worker\n{1}".format(records[0]['threads'],
+                                                                           task_report(records))
+
+    if profile is not None and len(records) > 0:
+        print >> sys.stdout, "\n\tProfile hotspots in {}".format(hotspot_report(profile, top=args.profile_top))
 
-    done_queue.put('STOP')
+    if args.transfer_from is not None:
+        # only the sites fine-tuned in this run
+        fine_tuned = [record for record in records if record['status'] == "done"]
+        saved = (args.epochs - epochs) * args.iter * len(fine_tuned)
+        print >> sys.stdout, "\n\tFine-tuned for {0} epochs instead of {1}, saved {2} epochs over {3} sites and {4} " \
+                             "iterations".format(epochs, args.epochs, saved, len(fine_tuned), args.iter)
 
     print >> sys.stderr, "\n\tFinished Neural Net"
     print >> sys.stdout, "\n\tFinished Neural Net"
+    # a site that failed or whose worker died fails the run
+    return 0 if all(record['status'] == "done" for record in records) else 1
 
 
 if __name__ == "__main__":
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""Work on the sites in a run_nn.py --queue directory, run this on each node that shares the filesystem
+"""
+import sys
+from argparse import ArgumentParser
+from lib.fs_queue import TaskQueue
+from run_nn import start_queue_workers
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--queue', '-q', action='store', dest='queue', required=True, type=str,
+                        help="queue directory given to run_nn.py")
+    parser.add_argument('--jobs', '-j', action='store', dest='jobs', required=False, default=4, type=int,
+                        help="number of workers on this node")
+    parser.add_argument('--threads', action='store', dest='threads', required=False, default=None, type=int,
+                        help="BLAS/OpenMP threads for each worker, default is the cores divided between the workers")
+    parser.add_argument('--poll', action='store', dest='poll', required=False, default=5.0, type=float,
+                        help="seconds between looks at the queue while other nodes finish")
+    return parser.parse_args()
+
+
+def main(args):
+    args = parse_args()
+    processes, threads = start_queue_workers(args.queue, args.jobs, threads=args.threads, poll_seconds=args.poll)
+    print >> sys.stdout, "\t{0} workers with {1} threads each on {2}".format(args.jobs, threads, args.queue)
+    for p in processes:
+        p.join()
+    counts = TaskQueue(args.queue).counts()
+    print >> sys.stdout, "\t{0} sites done, {1} failed".format(counts['done'], counts['failed'])
+    return 1 if counts['failed'] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Score alignment files with trained models, writes the probabilities for each read and site
+"""
+import sys
+import cPickle
+from argparse import ArgumentParser
+from lib.scoring import site_motif_starts, site_predictor, multi_task_predictors, score_alignments
+from lib.online_stats import SiteAggregator
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--alignments', '-a', action='store', dest='alignments', required=True, type=str,
+                        help="alignment files to score (glob)")
+    parser.add_argument('--config_file', '-c', action='store', dest='config', required=False, type=str,
+                        default=None, help="config file (pickle) with the sites, can be left out with --scan and "
+                                           "--model")
+    parser.add_argument('--sites', action='store', dest='sites', required=False, type=str, nargs='+',
+                        default=None, help="titles of the sites to score, default is all of the sites in the config")
+    parser.add_argument('--model', '-m', action='store', dest='model', required=False, type=str, default=None,
+                        help="model file, used for all of the sites")
+    parser.add_argument('--model_dir', action='store', dest='model_dir', required=False, type=str, default=None,
+                        help="directory with models, each site's model is found with find_model_path")
+    parser.add_argument('--ensemble', action='store_true', dest='ensemble', default=False,
+                        help="with --model_dir, average the best models of all of each site's iterations")
+    parser.add_argument('--multi_task', action='store_true', dest='multi_task', default=False,
+                        help="with --model_dir, use the multi-task model trained for the config's experiment")
+    parser.add_argument('--strand', '-st', action='store', dest='strand', required=True, type=str,
+                        help="which strand to use, options = {t, c, both}")
+    parser.add_argument('--events', '-ev', action='store', dest='events', required=True, type=int,
+                        help="number of events per alignment column the models were trained with")
+    parser.add_argument('--feature_set', '-f', action='store', dest='features', required=False, type=str,
+                        default=None, help="feature set the models were trained with")
+    parser.add_argument('--batch_size', '-b', action='store', dest='batch_size', required=False, type=int,
+                        default=10000, help="number of vectors to score at once for each site")
+    parser.add_argument('--jobs', '-j', action='store', dest='jobs', required=False, type=int, default=4,
+                        help="number of feature extraction processes")
+    parser.add_argument('--output', '-o', action='store', dest='out', required=True, type=str,
+                        help="file to write the probabilities to")
+    parser.add_argument('--scan', action='store_true', dest='scan', default=False,
+                        help="score every 6 position window along each read instead of the sites' motif starts, "
+                             "single strand only")
+    parser.add_argument('--min_covered', action='store', dest='min_covered', required=False, type=int, default=1,
+                        help="with --scan, only score windows with at least this many positions covered by events")
+    parser.add_argument('--site_summary', action='store', dest='site_summary', required=False, type=str,
+                        default=None, help="file to write the coverage, mean probabilities and call fractions of "
+                                           "each site to")
+    args = parser.parse_args()
+    assert((args.model is None) != (args.model_dir is None)), "need one of --model or --model_dir"
+    assert(not args.ensemble or args.model_dir is not None), "--ensemble needs --model_dir"
+    assert(not args.multi_task or (args.model_dir is not None and args.config is not None and not args.ensemble)), \
+        "--multi_task needs --model_dir and --config_file"
+    assert(args.config is not None or (args.scan and args.model is not None)), \
+        "need --config_file, unless scanning with --model"
+    assert(not args.scan or args.strand in ["t", "c"]), "--scan only works on one strand, use --strand t or c"
+    return args
+
+
+def main(args):
+    args = parse_args()
+    if args.config is not None:
+        config = cPickle.load(open(args.config, 'r'))
+        sites = [site for site in config['sites'] if args.sites is None or site['title'] in args.sites]
+        assert(len(sites) > 0), "didn't find any of the sites in {}".format(args.config)
+    else:
+        # scanning with one model, the titles are only used to label the output
+        sites = [{"title": title, "motif_start_position": []} for title in (args.sites or ["scan"])]
+
+    print >> sys.stderr, "#    {0} {1} for {2} sites".format("Scanning" if args.scan else "Scoring", args.alignments,
+                                                              len(sites))
+    if args.multi_task is True:
+        shared = multi_task_predictors(args.model_dir, config['experiment_name'])
+        predictors = dict((site['title'], shared[site['title']]) for site in sites)
+    else:
+        predictors = dict((site['title'], site_predictor(site['title'], model_file=args.model,
+                                                         model_dir=args.model_dir, ensemble=args.ensemble))
+                          for site in sites)
+    aggregator = SiteAggregator(predictors.values()[0].n_classes) if args.site_summary is not None else None
+    with open(args.out, 'w') as out:
+        score_alignments(files=args.alignments, sites=[(site['title'], site_motif_starts(site)) for site in sites],
+                         predictors=predictors, events_per_pos=args.events, strand=args.strand, out=out,
+                         feature_set=args.features, batch_size=args.batch_size, jobs=args.jobs,
+                         aggregator=aggregator, scan=args.scan, min_covered=args.min_covered)
+    if aggregator is not None:
+        with open(args.site_summary, 'w') as summary:
+            aggregator.write(summary)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
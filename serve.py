@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Serve models from a local socket so other tools can score vectors and alignment files without loading them
+"""
+import sys
+import cPickle
+from argparse import ArgumentParser
+from lib.scoring import site_motif_starts, site_predictor, multi_task_predictors
+from lib.server import ServedModel, InferenceServer
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--config_file', '-c', action='store', dest='config', required=True, type=str,
+                        help="config file (pickle) with the sites, each site's model is served under its title")
+    parser.add_argument('--sites', action='store', dest='sites', required=False, type=str, nargs='+',
+                        default=None, help="titles of the sites to serve, default is all of the sites in the config")
+    parser.add_argument('--model', '-m', action='store', dest='model', required=False, type=str, default=None,
+                        help="model file, used for all of the sites")
+    parser.add_argument('--model_dir', action='store', dest='model_dir', required=False, type=str, default=None,
+                        help="directory with models, each site's model is found with find_model_path")
+    parser.add_argument('--ensemble', action='store_true', dest='ensemble', default=False,
+                        help="with --model_dir, average the best models of all of each site's iterations")
+    parser.add_argument('--multi_task', action='store_true', dest='multi_task', default=False,
+                        help="with --model_dir, use the multi-task model trained for the config's experiment")
+    parser.add_argument('--strand', '-st', action='store', dest='strand', required=True, type=str,
+                        help="strand used to make vectors from alignment files, options = {t, c, both}")
+    parser.add_argument('--events', '-ev', action='store', dest='events', required=True, type=int,
+                        help="number of events per alignment column the models were trained with")
+    parser.add_argument('--feature_set', '-f', action='store', dest='features', required=False, type=str,
+                        default=None, help="feature set the models were trained with")
+    parser.add_argument('--socket', action='store', dest='socket', required=False, type=str, default=None,
+                        help="path of the Unix socket to listen on")
+    parser.add_argument('--port', action='store', dest='port', required=False, type=int, default=None,
+                        help="TCP port to listen on (localhost only)")
+    parser.add_argument('--max_batch_size', action='store', dest='max_batch_size', required=False, type=int,
+                        default=1000, help="largest number of vectors to run through a model at once")
+    parser.add_argument('--max_latency_ms', action='store', dest='max_latency', required=False, type=float,
+                        default=5.0, help="longest a request waits for other requests to batch with")
+    args = parser.parse_args()
+    assert((args.model is None) != (args.model_dir is None)), "need one of --model or --model_dir"
+    assert((args.socket is None) != (args.port is None)), "need one of --socket or --port"
+    assert(not args.multi_task or (args.model_dir is not None and not args.ensemble)), "--multi_task needs --model_dir"
+    return args
+
+
+def main(args):
+    args = parse_args()
+    config = cPickle.load(open(args.config, 'r'))
+    sites = [site for site in config['sites'] if args.sites is None or site['title'] in args.sites]
+    assert(len(sites) > 0), "didn't find any of the sites in {}".format(args.config)
+
+    if args.multi_task is True:
+        shared = multi_task_predictors(args.model_dir, config['experiment_name'])
+    models = {}
+    for site in sites:
+        if args.multi_task is True:
+            predictor = shared[site['title']]
+        else:
+            predictor = site_predictor(site['title'], model_file=args.model, model_dir=args.model_dir,
+                                       ensemble=args.ensemble)
+        models[site['title']] = ServedModel(site['title'], predictor, motif_starts=site_motif_starts(site),
+                                            events_per_pos=args.events, strand=args.strand,
+                                            feature_set=args.features, max_batch_size=args.max_batch_size,
+                                            max_latency=args.max_latency / 1000.0)
+    server = InferenceServer(models, socket_path=args.socket, port=args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
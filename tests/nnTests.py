@@ -1,10 +1,45 @@
 #!/usr/bin/env python
+import os
 import sys
+import glob
+import shutil
+import tempfile
+import cPickle
+import signal
+import threading
 sys.path.append("../")
 import unittest
 import numpy as np
 from toy_datasets import load_digit_dataset
-from lib.optimization import mini_batch_sgd, mini_batch_sgd_with_annealing
+from itertools import izip
+from lib.model import VanillaNeuralNet, ReLUThreeLayerNetwork, tanh_activation
+from lib.optimization import mini_batch_sgd, mini_batch_sgd_with_annealing, mini_batch_sgd_recurrent
+from lib.neural_network import predict, evaluate_network, load_network, classify_multi_task, \
+    classify_with_network2
+from lib.inference import NumpyPredictor, SiteConditionedPredictor, load_model_dict
+from lib.quantization import QuantizedPredictor, quantize_model, quantize_weights
+from lib.pruning import prune_model, threshold_for_density, layer_densities, fine_tune_pruned_model, sparse_model, \
+    SparsePredictor
+from lib.distillation import distill, distillation_report
+from lib.ensemble import EnsemblePredictor, site_model_files
+from lib.utils import collect_data_vectors2, read_alignment_table, append_site_one_hot, PROVENANCE_DTYPE
+from lib.scanning import read_windows, sliding_windows, scan_vectors
+from lib.scoring import score_alignments, read_vectors
+from lib.server import ServedModel, InferenceServer
+from lib.client import InferenceClient
+from lib.registry import ModelRegistry
+from lib.normalization import Normalizer, row_chunks, model_normalizer
+from lib.online_stats import RunningMoments, SiteAggregator, PositionStats
+from lib.incremental import ReplayBuffer, update_site, load_state
+from lib.results_store import ResultsStore, network_filesystem, start_results_run, fail_open_runs
+from lib.manifest import Manifest, task_key
+from lib.fs_queue import TaskQueue, run_worker
+from lib.instrumentation import PipelineMetrics, read_metrics
+from lib.synthetic import write_alignment, write_reads
+from lib.profiling import profile_call, hotspot_report, theano_profile
+from lib.scheduler import run_tasks, pin_threads, threads_per_worker, estimated_size, loaded_libraries, \
+    THREAD_VARIABLES
+from multiprocessing import Pool, Process
 
 
 class skLearnDigitTest(unittest.TestCase):
@@ -75,6 +110,922 @@ class skLearnDigitTest(unittest.TestCase):
                                                      model_file=None, trained_model_dir=None, verbose=False)
         self.assertTrue(results['batch_costs'][1] > results['batch_costs'][-1])
         self.assertTrue(results['xtrain_accuracies'][1] < results['xtrain_accuracies'][-1])
+        timings = results['timings']
+        self.assertEqual(timings['steps'], 100 * (len(self.tr) / 10))
+        self.assertEqual(timings['samples'], timings['steps'] * 10)
+        self.assertTrue(timings['compile_seconds'] > 0 and timings['train_seconds'] > 0)
+        self.assertAlmostEqual(timings['samples_per_sec'], timings['samples'] / timings['train_seconds'])
+
+    def test_recurrentNetworks(self):
+        # treat the rows of each 8x8 digit as a sequence, dropping trailing blank rows to get different lengths
+        def to_sequences(data):
+            sequences = [x.reshape(8, 8) for x in data]
+            return [s[:max(1, np.nonzero(s.sum(axis=1))[0][-1] + 1)] for s in sequences]
+        for model_type in ["GRU", "LSTM"]:
+            net, results = mini_batch_sgd_recurrent(motif=model_type + "Test",
+                                                    train_data=to_sequences(self.tr), labels=self.tr_l,
+                                                    xTrain_data=to_sequences(self.xtr), xTrain_targets=self.xtr_l,
+                                                    learning_rate=0.01, L1_reg=0.0, L2_reg=0.0, epochs=10,
+                                                    batch_size=10, hidden_dim=[20], model_type=model_type,
+                                                    model_file=None, trained_model_dir=None, verbose=False)
+            self.assertTrue(results['batch_costs'][1] > results['batch_costs'][-1])
+            self.assertTrue(results['xtrain_accuracies'][0] < results['xtrain_accuracies'][-1])
+
+    def test_transferLearning(self):
+        model_dir = tempfile.mkdtemp()
+        try:
+            training_args = {"train_data": self.tr, "labels": self.tr_l, "xTrain_data": self.xtr,
+                             "xTrain_targets": self.xtr_l, "learning_rate": 0.01, "L1_reg": 0.0, "L2_reg": 0.0,
+                             "batch_size": 10, "hidden_dim": [20, 20], "model_type": "ReLUthreeLayer",
+                             "verbose": False}
+            _, summary = mini_batch_sgd(motif="base", epochs=50, trained_model_dir="{}/base/".format(model_dir),
+                                        **training_args)
+            base = load_model_dict(summary['best_model'])
+            # a base with extra inputs, like a multi-task model, only uses the weights of the first in_dim inputs
+            wide = dict(base)
+            wide['in_dim'] = base['in_dim'] + 2
+            wide['h0weights'] = np.vstack((base['h0weights'], np.ones((2, 20), dtype=base['h0weights'].dtype)))
+            wide_file = "{}/wide.pkl".format(model_dir)
+            cPickle.dump(wide, open(wide_file, 'w'))
+
+            transfer_dir = "{}/transfer/".format(model_dir)
+            net, summary = mini_batch_sgd(motif="transfer", epochs=5, trained_model_dir=transfer_dir,
+                                          transfer_model=wide_file, freeze_transferred=True, **training_args)
+            self.assertEqual(sorted(summary['frozen_params']), ['h0biases', 'h0weights', 'h1biases', 'h1weights'])
+            # the first checkpoint is written before any training, with the transferred and the reset params
+            initial = load_model_dict(transfer_dir + "model0.pkl")
+            trained = dict(("{}".format(param), param.get_value()) for param in net.params)
+            for key in summary['frozen_params']:
+                self.assertTrue(np.array_equal(initial[key], base[key]))
+                self.assertTrue(np.array_equal(trained[key], base[key]))
+            # only the softmax layer was trained
+            self.assertFalse(np.allclose(trained['s0weights'], initial['s0weights']))
+            errors, _ = predict(self.ts, self.ts_l, 10, net, model_file=summary['best_model'])
+            self.assertTrue(1 - np.mean(errors) > 0.8)
+
+            # loading a model to continue from would overwrite the transferred params
+            with self.assertRaises(AssertionError):
+                mini_batch_sgd(motif="both", epochs=1, model_file=wide_file, transfer_model=wide_file,
+                               **training_args)
+        finally:
+            shutil.rmtree(model_dir)
+
+
+class VanillaNeuralNetTest(unittest.TestCase):
+    def test_miniBatchMatchesBackprop(self):
+        # the vectorized mini-batch update should match summing the per-sample backprop gradients
+        rng = np.random.RandomState(1)
+        X, y = rng.randn(40, 7), rng.randint(0, 3, 40)
+        reference = VanillaNeuralNet(7, 3, [5, 4], tanh_activation)
+        for k in xrange(0, 40, 8):
+            grad_w = [np.zeros(w.shape) for w in reference.weights]
+            grad_b = [np.zeros(b.shape) for b in reference.biases]
+            for sample, label in zip(X[k:k + 8], y[k:k + 8]):
+                delta_w, delta_b = reference.backprop(sample=sample, label=label, lbda=0.01)
+                grad_w = [dw + d for dw, d in izip(grad_w, delta_w)]
+                grad_b = [db + d for db, d in izip(grad_b, delta_b)]
+            reference.update_parameters(grad_w, grad_b, epsilon=0.05)
+
+        for dtype, places in [(np.float64, 10), (np.float32, 5)]:
+            net = VanillaNeuralNet(7, 3, [5, 4], tanh_activation, dtype=dtype)
+            net.mini_batch_sgd(X, y, epochs=1, batch_size=8, epsilon=0.05, lbda=0.01)
+            for w, ref_w in izip(net.weights + net.biases, reference.weights + reference.biases):
+                self.assertEqual(w.dtype, dtype)
+                self.assertAlmostEqual(np.abs(w - ref_w).max(), 0.0, places=places)
+
+
+class InferenceEngineTest(unittest.TestCase):
+    def setUp(self):
+        tr_data, xtr_data, ts_data = load_digit_dataset(0.7)
+        self.tr = np.array([x[0] for x in tr_data])
+        self.tr_l = [x[1] for x in tr_data]
+        self.ts = np.array([x[0] for x in ts_data])
+        self.ts_l = np.array([x[1] for x in ts_data], dtype=np.int32)
+        self.model_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir)
+
+    def trainModel(self, model_type, hidden_dim):
+        net, summary = mini_batch_sgd(motif=model_type, train_data=self.tr, labels=self.tr_l,
+                                      xTrain_data=self.tr, xTrain_targets=self.tr_l,
+                                      learning_rate=0.01, L1_reg=0.0, L2_reg=0.0, epochs=50, batch_size=10,
+                                      hidden_dim=hidden_dim, model_type=model_type, model_file=None,
+                                      trained_model_dir="{0}/{1}/".format(self.model_dir, model_type), verbose=False)
+        return net, summary['best_model']
+
+    def test_numpyPredictor(self):
+        for model_type, hidden_dim in [("twoLayer", [10]), ("ReLUthreeLayer", [10, 10]), ("ReLUfourLayer", [10] * 3)]:
+            net, model_file = self.trainModel(model_type, hidden_dim)
+            _, probs = predict(self.ts, self.ts_l, len(self.ts), net, model_file=model_file)
+            numpy_probs = NumpyPredictor(load_model_dict(model_file), dtype=np.float64).predict_proba(self.ts)
+            self.assertAlmostEqual(np.abs(np.asarray(probs) - numpy_probs).max(), 0.0, places=5)
+
+    def test_quantizedPredictor(self):
+        weights = np.random.randn(64, 10)
+        int8_weights, scales = quantize_weights(weights)
+        self.assertEqual(int8_weights.dtype, np.int8)
+        self.assertTrue(np.all(np.abs(int8_weights * scales - weights) <= scales / 2 + 1e-6))
+
+        _, model_file = self.trainModel("threeLayer", [20, 20])
+        model = load_model_dict(model_file)
+        float_calls = NumpyPredictor(model).predict(self.ts)
+        quantized_calls = QuantizedPredictor(quantize_model(model)).predict(self.ts)
+        self.assertTrue(np.mean(float_calls == quantized_calls) > 0.95)
+
+    def test_pruning(self):
+        _, model_file = self.trainModel("threeLayer", [20, 20])
+        pruned, masks = prune_model(load_model_dict(model_file),
+                                    threshold_for_density(load_model_dict(model_file), 0.2, per_layer=True))
+        for density in layer_densities(pruned):
+            self.assertAlmostEqual(density, 0.2, delta=0.01)
+        # the sparse path should give the same answer as running the pruned weights densely
+        sparse_probs = SparsePredictor(sparse_model(pruned), density_threshold=1.0).predict_proba(self.ts)
+        dense_probs = NumpyPredictor(pruned).predict_proba(self.ts)
+        self.assertAlmostEqual(np.abs(sparse_probs - dense_probs).max(), 0.0, places=5)
+        # fine-tuning shouldn't bring back any of the pruned weights
+        fine_tuned = fine_tune_pruned_model(pruned, masks, self.tr, self.tr_l, self.tr, self.tr_l,
+                                            learning_rate=0.01, epochs=10, batch_size=10)
+        for key, mask in masks.items():
+            self.assertEqual(np.count_nonzero(fine_tuned[key][mask == 0]), 0)
+
+    def test_distillation(self):
+        _, teacher_file = self.trainModel("ReLUthreeLayer", [50, 50])
+        student, summary = distill(teacher_file, self.tr, self.tr, np.asarray(self.tr_l, dtype=np.int32),
+                                   student_type="twoLayer", student_hidden_dim=[10], learning_rate=0.01, epochs=50,
+                                   batch_size=10, trained_model_dir="{}/student/".format(self.model_dir),
+                                   verbose=False)
+        report = distillation_report(teacher_file, summary['best_model'], self.ts, self.ts_l)
+        self.assertTrue(report['agreement'] > 0.8)
+        self.assertTrue(report['student_bytes'] < report['teacher_bytes'])
+
+    def test_ensemble(self):
+        _, model_file = self.trainModel("ReLUthreeLayer", [20, 20])
+        model = load_model_dict(model_file)
+        # perturbed copies stand in for the best models of three classify iterations
+        for i in xrange(3):
+            iteration_dir = "{0}/site_Models/{1}".format(self.model_dir, i)
+            os.makedirs(iteration_dir)
+            noisy = dict(model)
+            for key in model.keys():
+                if isinstance(key, str) and key.endswith('weights'):
+                    noisy[key] = model[key] + 0.1 * np.random.randn(*model[key].shape)
+            cPickle.dump(noisy, open(iteration_dir + "/model.pkl", 'w'))
+            cPickle.dump({"best_model": "/moved/model.pkl"}, open(iteration_dir + "/summary_stats.pkl", 'w'))
+        model_files = site_model_files(self.model_dir, "site")
+        self.assertEqual(len(model_files), 3)
+
+        ensemble = EnsemblePredictor.from_files(model_files)
+        separate = [NumpyPredictor(load_model_dict(f)).predict_proba(self.ts) for f in model_files]
+        probs, disagreement, spread = ensemble.score(self.ts)
+        self.assertAlmostEqual(np.abs(probs - np.mean(separate, axis=0)).max(), 0.0, places=5)
+        self.assertAlmostEqual(np.abs(spread - np.std(separate, axis=0)).max(), 0.0, places=5)
+        self.assertTrue(np.all((disagreement >= 0) & (disagreement <= 1)))
+        self.assertTrue(np.all(ensemble.predict(self.ts) == np.argmax(probs, axis=1)))
+
+    def test_modelRegistry(self):
+        rng = np.random.RandomState(0)
+        models_dir = "{}/site_Models".format(self.model_dir)
+        os.makedirs(models_dir)
+        model_file = models_dir + "/model.pkl"
+
+        def write_model():
+            model = {"model": ReLUThreeLayerNetwork, "in_dim": 64, "n_classes": 10, "hidden_dim": [10, 10],
+                     "h0weights": rng.randn(64, 10), "h0biases": rng.randn(10), "h1weights": rng.randn(10, 10),
+                     "h1biases": rng.randn(10), "s0weights": rng.randn(10, 10), "s0biases": rng.randn(10)}
+            cPickle.dump(model, open(model_file, 'w'))
+        write_model()
+        cPickle.dump({"best_model": "/moved/model.pkl"}, open(models_dir + "/summary_stats.pkl", 'w'))
+
+        registry = ModelRegistry()
+        predictor = registry.site_predictor(self.model_dir, "site")
+        self.assertTrue(registry.site_predictor(self.model_dir, "site") is predictor)
+        self.assertEqual(registry.stats()['invalidations'], 0)
+        # a new model file with a different mtime replaces the cached predictor
+        write_model()
+        os.utime(model_file, (0, 0))
+        new_predictor = registry.site_predictor(self.model_dir, "site")
+        self.assertFalse(new_predictor is predictor)
+        self.assertTrue(registry.stats()['invalidations'] > 0)
+        self.assertFalse(np.allclose(new_predictor.predict_proba(self.ts), predictor.predict_proba(self.ts)))
+
+        # the compiled network is reused and gives the same answer as predict
+        errors, probs = evaluate_network(self.ts, self.ts_l, model_file, "ReLUthreeLayer", 10, registry=registry)
+        misses = registry.stats()['misses']
+        evaluate_network(self.ts, self.ts_l, model_file, "ReLUthreeLayer", 10, registry=registry)
+        self.assertEqual(registry.stats()['misses'], misses)
+        evaluate_network(self.ts, self.ts_l, model_file, "ReLUthreeLayer", 10, extra_args={"batch_size": 10},
+                         registry=registry)
+        self.assertEqual(registry.stats()['misses'], misses + 1)
+        predict_errors, predict_probs = predict(self.ts, self.ts_l, 10, load_network(model_file))
+        self.assertAlmostEqual(np.abs(np.asarray(probs) - np.asarray(predict_probs)).max(), 0.0, places=5)
+        self.assertAlmostEqual(np.mean(errors), np.mean(predict_errors), places=5)
+
+        # with a small cap only the most recent predictor is kept
+        registry.max_bytes = new_predictor.nbytes()
+        registry.predictor(model_file, engine="theano")
+        self.assertEqual(registry.stats()['entries'], 1)
+        self.assertTrue(registry.stats()['evictions'] > 0)
+
+    def test_multiTaskPredictor(self):
+        rng = np.random.RandomState(0)
+        nb_sites = 3
+        model = {"model": ReLUThreeLayerNetwork, "in_dim": 64 + nb_sites, "n_classes": 10, "hidden_dim": [10, 10],
+                 "h0weights": rng.randn(64 + nb_sites, 10), "h0biases": rng.randn(10),
+                 "h1weights": rng.randn(10, 10), "h1biases": rng.randn(10), "s0weights": rng.randn(10, 10),
+                 "s0biases": rng.randn(10)}
+        shared = NumpyPredictor(model)
+        site_indices = rng.randint(0, nb_sites, len(self.ts))
+        probs = shared.predict_proba(append_site_one_hot(self.ts.astype(np.float32), site_indices, nb_sites))
+        for i in xrange(nb_sites):
+            site = SiteConditionedPredictor(shared, i, nb_sites)
+            self.assertEqual(site.in_dim, 64)
+            self.assertAlmostEqual(np.abs(site.predict_proba(self.ts[site_indices == i]) -
+                                          probs[site_indices == i]).max(), 0.0, places=5)
+        # the site changes the prediction
+        self.assertFalse(np.allclose(SiteConditionedPredictor(shared, 0, nb_sites).predict_proba(self.ts),
+                                     SiteConditionedPredictor(shared, 1, nb_sites).predict_proba(self.ts)))
+
+    def test_normalization(self):
+        rng = np.random.RandomState(0)
+        train = self.tr + rng.randn(*self.tr.shape)
+        train[rng.rand(*train.shape) < 0.1] = np.nan
+        test = self.ts + rng.randn(*self.ts.shape)
+        test[rng.rand(*test.shape) < 0.1] = np.nan
+        # streaming over uneven chunks matches the statistics of the whole matrix
+        normalizer = Normalizer.fit(row_chunks(train, 97), preprocess="normalize")
+        self.assertTrue(np.allclose(normalizer.mean, np.nanmean(train, axis=0)))
+        self.assertTrue(np.allclose(normalizer.std, np.nanstd(train, axis=0)))
+        expected = np.nan_to_num((train - np.nanmean(train, axis=0)) / np.nanstd(train, axis=0))
+        self.assertTrue(np.allclose(normalizer.transform(train), expected))
+        # features with no variance are only centered
+        self.assertTrue(np.all(Normalizer.fit([np.ones((20, 3))], preprocess="normalize").transform(np.ones((5, 3)))
+                               == 0))
+        centered = Normalizer.fit(row_chunks(train, 50), preprocess="center", nb_features=10)
+        self.assertTrue(centered.std is None and len(centered.mean) == 10)
+        self.assertTrue(np.allclose(centered.transform(train)[:, 10:], np.nan_to_num(train[:, 10:])))
+
+        # the statistics go in the model file and every inference path takes the raw vectors
+        model_files = []
+        for i, train_rows in enumerate([slice(0, None), slice(0, len(train) / 2)]):
+            fitted = Normalizer.fit(row_chunks(train[train_rows]), preprocess="normalize")
+            net, summary = mini_batch_sgd(motif="normalized", train_data=fitted.transform(train[train_rows]),
+                                          labels=self.tr_l[train_rows], xTrain_data=fitted.transform(train),
+                                          xTrain_targets=self.tr_l, learning_rate=0.01, L1_reg=0.0, L2_reg=0.0,
+                                          epochs=10, batch_size=10, hidden_dim=[20, 20],
+                                          model_type="ReLUthreeLayer", verbose=False,
+                                          trained_model_dir="{0}/normalized{1}/".format(self.model_dir, i),
+                                          normalization=fitted.to_dict())
+            model_files.append(summary['best_model'])
+        model = load_model_dict(model_files[0])
+        stored = model_normalizer(model)
+        self.assertTrue(np.allclose(stored.mean, normalizer.mean) and np.allclose(stored.std, normalizer.std))
+        _, probs = predict(test, self.ts_l, len(test), load_network(model_files[0]))
+        numpy_probs = NumpyPredictor(model, dtype=np.float64).predict_proba(test)
+        self.assertAlmostEqual(np.abs(np.asarray(probs) - numpy_probs).max(), 0.0, places=5)
+        self.assertTrue(np.mean(np.argmax(numpy_probs, axis=1) == self.ts_l) > 0.7)
+        quantized_calls = QuantizedPredictor(quantize_model(model)).predict(test)
+        self.assertTrue(np.mean(quantized_calls == np.argmax(numpy_probs, axis=1)) > 0.95)
+        # models with different statistics in one ensemble
+        ensemble_probs = EnsemblePredictor.from_files(model_files, dtype=np.float64).predict_proba(test)
+        separate = [NumpyPredictor(load_model_dict(f), dtype=np.float64).predict_proba(test) for f in model_files]
+        self.assertAlmostEqual(np.abs(ensemble_probs - np.mean(separate, axis=0)).max(), 0.0, places=5)
+
+
+class MultiTaskTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        # two groups of reads that both cover the two sites, the second group's motif events are shifted
+        for n, shift in enumerate([0.0, 4.0]):
+            write_reads("{0}/group{1}".format(self.work_dir, n), 10, [95, 110], reference_length=200,
+                        read_length=(150, 200), events_per_pos=(2, 2), strands=("t",), shift=shift, seed=n)
+        self.args = {
+            "group_1": self.work_dir + "/group0/*.tsv", "group_2": self.work_dir + "/group1/*.tsv", "group_3": None,
+            "strand": "t", "sites": [{"title": "s1", "motif_start_position": [[95], [95]]},
+                                     {"title": "s2", "motif_start_position": [[110], [110]]}],
+            "preprocess": "normalize", "events_per_pos": 2, "feature_set": None, "title": "mt",
+            "learning_algorithm": None, "train_test_split": 0.5, "iterations": 2, "epochs": 5, "max_samples": 10,
+            "batch_size": 5, "learning_rate": 0.01, "L1_reg": 0.0, "L2_reg": 0.0, "hidden_dim": [10, 10],
+            "model_type": "ReLUthreeLayer", "out_path": self.work_dir + "/",
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_classifyMultiTask(self):
+        classify_multi_task(**self.args)
+        models_dir = self.work_dir + "/mt_Models/"
+        summary = cPickle.load(open(models_dir + "summary_stats.pkl"))
+        self.assertEqual(summary['site_titles'], ["s1", "s2"])
+        self.assertEqual(os.path.normpath(summary['best_model']), models_dir + "multi_task_model.pkl")
+        # the copy of the best iteration's model takes the raw vectors and the one-hot for the sites
+        model = load_model_dict(summary['best_model'])
+        self.assertEqual(model['in_dim'], len(model_normalizer(model).mean) + 2)
+        rows = [line.strip().split("\t") for line in open(self.work_dir + "/mt.tsv")]
+        self.assertEqual(sorted(row[0] for row in rows if not row[0].startswith(">")), ["s1", "s1", "s2", "s2"])
+        self.assertEqual(sorted(row[0] for row in rows if row[0].startswith(">")), [">s1", ">s2"])
+
+        # without an iteration there's no model to keep
+        self.args.update({"title": "none", "iterations": 0})
+        with self.assertRaises(AssertionError) as context:
+            classify_multi_task(**self.args)
+        self.assertTrue("no iteration saved a model" in str(context.exception))
+
+    def test_transferNormalization(self):
+        self.args["iterations"] = 1
+        classify_multi_task(**self.args)
+        base_file = self.work_dir + "/mt_Models/multi_task_model.pkl"
+        base = model_normalizer(load_model_dict(base_file))
+        site_args = dict((k, self.args[k]) for k in ["group_1", "group_2", "group_3", "strand", "preprocess",
+                                                     "events_per_pos", "feature_set", "learning_algorithm",
+                                                     "train_test_split", "epochs", "max_samples", "batch_size",
+                                                     "learning_rate", "L1_reg", "L2_reg", "hidden_dim", "model_type",
+                                                     "out_path"])
+        site_args.update({"motif_start_positions": [[95], [95]], "title": "s1", "iterations": 1,
+                          "batch_size": 2, "transfer_model": base_file, "freeze_hidden": True})
+        classify_with_network2(**site_args)
+        # the frozen layers get their inputs scaled like the base's training data, not with the site's statistics
+        model_files = glob.glob(self.work_dir + "/s1_Models/model*.pkl")
+        self.assertTrue(len(model_files) > 0)
+        for model_file in model_files:
+            tuned = model_normalizer(load_model_dict(model_file))
+            self.assertEqual(tuned.preprocess, "normalize")
+            self.assertTrue(np.array_equal(tuned.mean, base.mean) and np.array_equal(tuned.std, base.std))
+        with self.assertRaises(AssertionError) as context:
+            classify_with_network2(**dict(site_args, preprocess="center", title="centered"))
+        self.assertTrue("--preprocess normalize" in str(context.exception))
+
+
+def write_site_reads(work_dir, rng):
+    # five reads over both motif starts (100 and 110), one that doesn't cover the second and one that can't be parsed
+    for i in xrange(5):
+        write_alignment("{0}/read{1}.tsv".format(work_dir, i), range(90, 130), rng)
+    write_alignment("{}/short.tsv".format(work_dir), range(90, 105), rng)
+    with open("{}/bad.tsv".format(work_dir), 'w') as f:
+        f.write("not an alignment\n")
+
+
+class ScoringTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        write_site_reads(self.work_dir, rng)
+        model = {"model": ReLUThreeLayerNetwork, "in_dim": 24, "n_classes": 2, "hidden_dim": [10, 10],
+                 "h0weights": rng.randn(24, 10), "h0biases": rng.randn(10), "h1weights": rng.randn(10, 10),
+                 "h1biases": rng.randn(10), "s0weights": rng.randn(10, 2), "s0biases": rng.randn(2)}
+        self.predictor = NumpyPredictor(model)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_scoreAlignments(self):
+        files = self.work_dir + "/*.tsv"
+        out_file = self.work_dir + "/scores.out"
+        aggregator = SiteAggregator(2)
+        with open(out_file, 'w') as out:
+            counts = score_alignments(files, [("site", [100, 110])], {"site": self.predictor}, events_per_pos=2,
+                                      strand="t", out=out, batch_size=3, jobs=2, aggregator=aggregator)
+        self.assertEqual(aggregator.sites[("site", 100)].coverage, 6)
+        self.assertEqual(aggregator.sites[("site", 110)].coverage, 5)
+        self.assertEqual(counts['skipped_files'], 1)
+        self.assertEqual(counts['uncovered'], 1)
+        rows = [line.strip().split("\t") for line in open(out_file)][1:]
+        self.assertEqual(len(rows), counts['vectors'])
+        self.assertEqual(len(rows), 11)
+        # errors after the file is parsed skip it too
+        tsv = self.work_dir + "/read0.tsv"
+        self.assertEqual(read_vectors(tsv, [("site", [100])], 2, "t", feature_set="unknown"), (tsv, None))
+        self.assertEqual(scan_vectors(tsv, [("site", None)], 2, "both"), (tsv, None))
+
+        # the same vectors as training collects, less the motif the short read doesn't cover
+        vectors, _ = collect_data_vectors2(events_per_pos=2, label=0, portion=0.0, files=files, strand="t",
+                                           motif_starts=[100, 110], dataset_title="test", max_samples=10,
+                                           split_dataset=False)
+        vectors = vectors[~np.all(np.isnan(vectors), axis=1)]
+        expected = np.sort(self.predictor.predict_proba(vectors)[:, 0])
+        scored = np.sort(np.array([float(row[3]) for row in rows]))
+        self.assertAlmostEqual(np.abs(expected - scored).max(), 0.0, places=5)
+
+    def test_scanWindows(self):
+        blocks = np.arange(20.0).reshape(10, 2)
+        windows = sliding_windows(blocks, window_length=6)
+        self.assertEqual(windows.shape, (5, 12))
+        self.assertTrue(np.all(windows[1] == blocks[1:7].ravel()))
+
+        tsv = self.work_dir + "/read0.tsv"
+        starts, windows = read_windows(read_alignment_table(tsv), events_per_pos=2, strand="t")
+        self.assertEqual(list(starts), range(90, 125))
+        vectors, _ = collect_data_vectors2(events_per_pos=2, label=0, portion=0.0, files=tsv, strand="t",
+                                           motif_starts=[90, 100, 124], dataset_title="test", max_samples=1,
+                                           split_dataset=False)
+        for start, vector in zip([90, 100, 124], vectors):
+            window = windows[list(starts).index(start)]
+            self.assertTrue(np.array_equal(np.isnan(window), np.isnan(vector)))
+            self.assertAlmostEqual(np.abs(np.nan_to_num(window) - np.nan_to_num(vector)).max(), 0.0)
+
+        # the short read covers 90-104, which is 10 windows
+        starts, _ = read_windows(read_alignment_table(self.work_dir + "/short.tsv"), 2, "t", min_covered=6)
+        self.assertEqual(list(starts), range(90, 100))
+        out_file = self.work_dir + "/scan.out"
+        with open(out_file, 'w') as out:
+            counts = score_alignments(self.work_dir + "/*.tsv", [("scan", None)], {"scan": self.predictor},
+                                      events_per_pos=2, strand="t", out=out, jobs=2, scan=True)
+        self.assertEqual(counts['vectors'], 5 * 35 + 10)
+        with self.assertRaises(AssertionError) as context:
+            score_alignments(self.work_dir + "/*.tsv", [("scan", None)], {"scan": self.predictor}, events_per_pos=2,
+                             strand="both", out=open(os.devnull, 'w'), scan=True)
+        self.assertTrue("one strand" in str(context.exception))
+
+    def test_siteAggregator(self):
+        rng = np.random.RandomState(1)
+        data = rng.randn(1000, 3)
+        moments, other = RunningMoments(3), RunningMoments(3)
+        for batch in np.array_split(data[:600], 7):
+            moments.push(batch)
+        other.push(data[600:])
+        moments.merge(other)
+        self.assertEqual(moments.n, 1000)
+        self.assertAlmostEqual(np.abs(moments.mean - data.mean(axis=0)).max(), 0.0)
+        self.assertAlmostEqual(np.abs(moments.variance() - data.var(axis=0, ddof=1)).max(), 0.0)
+
+        probs = rng.dirichlet([1, 1, 1], size=1000)
+        starts = rng.choice([100, 200, 300], size=1000)
+        aggregator, first_half, second_half = SiteAggregator(3), SiteAggregator(3), SiteAggregator(3)
+        aggregator.add("site", starts, probs)
+        first_half.add("site", starts[:500], probs[:500])
+        second_half.add(["site"] * 500, starts[500:], probs[500:])
+        first_half.merge(second_half)
+        for start in [100, 200, 300]:
+            site_probs = probs[starts == start]
+            for stats in [aggregator.sites[("site", start)], first_half.sites[("site", start)]]:
+                self.assertEqual(stats.coverage, len(site_probs))
+                self.assertAlmostEqual(np.abs(stats.moments.mean - site_probs.mean(axis=0)).max(), 0.0)
+                self.assertTrue(np.all(stats.calls == np.bincount(np.argmax(site_probs, axis=1), minlength=3)))
+        rows = list(aggregator.rows())
+        self.assertEqual([row[1] for row in rows], [100, 200, 300])
+        self.assertAlmostEqual(sum(rows[0][-3:]), 1.0)
+
+    def test_inferenceServer(self):
+        socket_path = self.work_dir + "/server.sock"
+        model = ServedModel("site", self.predictor, motif_starts=[100, 110], events_per_pos=2, strand="t",
+                            max_batch_size=100, max_latency=0.05)
+        server = InferenceServer({"site": model}, socket_path=socket_path)
+        server.start()
+        try:
+            vectors = np.random.randn(40, 24)
+            results = [None] * 8
+
+            def request(i):
+                with InferenceClient(socket_path=socket_path) as client:
+                    results[i] = client.predict_proba("site", vectors[5 * i:5 * (i + 1)])
+
+            threads = [threading.Thread(target=request, args=(i,)) for i in xrange(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertAlmostEqual(np.abs(np.vstack(results) - self.predictor.predict_proba(vectors)).max(), 0.0,
+                                   places=5)
+
+            with InferenceClient(socket_path=socket_path) as client:
+                motif_starts, probs = client.score_file("site", self.work_dir + "/short.tsv")
+                self.assertEqual(motif_starts, [100])
+                self.assertEqual(len(probs), 1)
+                self.assertRaises(RuntimeError, client.predict_proba, "site", [[0.0, 1.0]])
+                self.assertRaises(RuntimeError, client.predict_proba, "other_site", vectors)
+                stats = client.stats()["models"]["site"]
+            # the concurrent requests should have been batched together
+            self.assertEqual(stats["vectors"], 41)
+            self.assertTrue(stats["batches"] < stats["requests"])
+        finally:
+            server.shutdown()
+
+
+class IncrementalUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.model = {"model": ReLUThreeLayerNetwork, "in_dim": 24, "n_classes": 2, "hidden_dim": [10, 10],
+                      "h0weights": rng.randn(24, 10), "h0biases": rng.randn(10), "h1weights": rng.randn(10, 10),
+                      "h1biases": rng.randn(10), "s0weights": rng.randn(10, 2), "s0biases": rng.randn(2)}
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_incrementalUpdate(self):
+        replay = ReplayBuffer.empty(4)
+        vectors, labels = replay.sample(3, dim=24)
+        self.assertEqual((vectors.shape, labels.shape, labels.dtype), ((0, 24), (0,), np.int32))
+        replay.add(np.ones((6, 24), dtype=np.float32), np.array([0] * 5 + [1]))
+        vectors, labels = replay.sample(3, dim=24)
+        self.assertEqual((vectors.shape, vectors.dtype, sorted(labels)), ((4, 24), np.float32, [0, 0, 0, 1]))
+
+        rng = np.random.RandomState(1)
+        groups = ["{0}/group{1}/*.tsv".format(self.work_dir, n) for n in xrange(2)]
+        for n in xrange(2):
+            os.makedirs("{0}/group{1}".format(self.work_dir, n))
+            for i in xrange(3):
+                write_alignment("{0}/group{1}/read{2}.tsv".format(self.work_dir, n, i), range(90, 130), rng)
+        # a classify iteration with the first read of each group as its test split
+        iteration_dir = "{}/site_Models/0/".format(self.work_dir)
+        os.makedirs(iteration_dir)
+        model_file = iteration_dir + "model0.pkl"
+        cPickle.dump(self.model, open(model_file, 'w'))
+        cPickle.dump({"best_model": model_file, "xtrain_accuracies": [50.0]},
+                     open(iteration_dir + "summary_stats.pkl", 'w'))
+        cPickle.dump(np.array([("read0.tsv", 100), ("read0.tsv", 110)], dtype=PROVENANCE_DTYPE),
+                     open(iteration_dir + "test_provenance.pkl", 'w'))
+        cPickle.dump([(np.array([0.5, 0.5]), 0), (np.array([0.5, 0.5]), 1)],
+                     open(iteration_dir + "test_probs.pkl", 'w'))
+
+        update_args = {"groups": groups, "motif_start_positions": [[100, 110]] * 2, "title": "site", "strand": "t",
+                       "events_per_pos": 2, "feature_set": None, "out_path": self.work_dir, "learning_rate": 0.01,
+                       "L1_reg": 0.0, "L2_reg": 0.0, "epochs": 2, "batch_size": 2, "hidden_dim": [10, 10],
+                       "model_type": "ReLUthreeLayer", "replay_size": 6}
+        # nothing new since the model was trained
+        self.assertTrue(update_site(**update_args) is None)
+        state = load_state(self.work_dir, "site")
+        self.assertEqual(len(state['test_labels']), 2)
+        # the test vectors are left out of the replay buffer
+        self.assertEqual(len(ReplayBuffer(state['replay'])), 10)
+
+        for n in xrange(2):
+            for i in xrange(3, 6):
+                write_alignment("{0}/group{1}/read{2}.tsv".format(self.work_dir, n, i), range(90, 130), rng)
+        record = update_site(**update_args)
+        self.assertEqual((record['version'], record['new_files'], record['new_vectors']), (1, 6, 12))
+        self.assertTrue(os.path.exists(record['model']))
+        state = load_state(self.work_dir, "site")
+        self.assertEqual(state['model'], record['model'])
+        self.assertEqual(len(state['seen']), 12)
+        # the replay buffer is capped for each class
+        self.assertEqual(len(ReplayBuffer(state['replay'])), 12)
+        self.assertTrue(update_site(**update_args) is None)
+
+
+class PositionStatsTest(unittest.TestCase):
+    def test_positionStats(self):
+        rng = np.random.RandomState(0)
+        positions = np.arange(100, 130)
+        chunks = [(rng.choice(positions[:20], 500), rng.randn(500) * 2 + 80) for _ in xrange(4)]
+        bin_edges = np.linspace(70, 90, 201)
+        first, second = PositionStats(positions, bin_edges=bin_edges), PositionStats(positions, bin_edges=bin_edges)
+        for i, (chunk_positions, values) in enumerate(chunks):
+            (first if i % 2 == 0 else second).push(chunk_positions, values)
+        first.merge(second)
+
+        all_positions = np.concatenate([c[0] for c in chunks])
+        all_values = np.concatenate([c[1] for c in chunks])
+        for i, position in enumerate(positions):
+            values = all_values[all_positions == position]
+            self.assertEqual(first.count[i], len(values))
+            if len(values) == 0:
+                continue
+            self.assertAlmostEqual(first.mean[i], values.mean())
+            self.assertAlmostEqual(first.variance()[i], values.var(ddof=1))
+            self.assertEqual((first.min[i], first.max[i]), (values.min(), values.max()))
+            self.assertTrue(abs(first.quantiles(0.5)[i, 0] - np.median(values)) < 0.5)
+        self.assertEqual(first.histogram.sum(), len(all_values))
+        # positions that weren't seen are left empty
+        self.assertTrue(np.all(first.count[20:] == 0) and np.all(np.isnan(first.quantiles([0.5])[20:])))
+
+
+class SyntheticReadsTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_syntheticReads(self):
+        motif_starts = [100, 400]
+        files = write_reads(self.work_dir + "/synthetic", 40, motif_starts, reference_length=800,
+                            read_length=(50, 100), motif_hit_fraction=0.25, events_per_pos=(2, 2), strands=("t",),
+                            shift=5.0)
+        self.assertEqual(len(files), 40)
+        hits = 0
+        for f in files:
+            data = read_alignment_table(f)
+            self.assertTrue(np.all(data['strand'] == "t") and np.all(data['ref_pos'].value_counts() == 2))
+            motif_rows = data['ref_pos'].isin(range(100, 106) + range(400, 406))
+            hits += motif_rows.any()
+            # the motif events are shifted
+            if motif_rows.any():
+                self.assertTrue(data['event_mean'][motif_rows].mean() > data['event_mean'][~motif_rows].mean() + 3)
+        self.assertTrue(0 < hits < 20)
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_profiling(self):
+        import theano
+        import theano.tensor as T
+
+        def compile_and_run(n):
+            x = T.vector('x')
+            f = theano.function(inputs=[x], outputs=T.tanh(x).sum(), name="tanh_sum",
+                                profile=theano_profile("tanh_sum"))
+            return sum(f(np.ones(10, dtype=theano.config.floatX)) for _ in xrange(n))
+
+        profiles = self.work_dir + "/profiles"
+        self.assertAlmostEqual(profile_call(compile_and_run, {"n": 3}, profiles, "s1"), 30 * np.tanh(1.0), places=4)
+        profile_call(compile_and_run, {"n": 2}, profiles, "s2")
+        # outside of profile_call nothing is profiled
+        self.assertTrue(theano_profile("tanh_sum") is None)
+        for title in ["s1", "s2"]:
+            self.assertTrue(os.path.exists("{0}/{1}.prof".format(profiles, title)))
+            self.assertTrue("tanh_sum" in open("{0}/{1}_theano.txt".format(profiles, title)).read())
+        report = open(hotspot_report(profiles, top=5)).read()
+        self.assertTrue("s1.prof, s2.prof" in report)
+        self.assertTrue("compile_and_run" in report)
+        # the functions are merged over the sites
+        self.assertTrue("5\t" in report.split("Theano functions")[1])
+
+
+class PipelineMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        write_site_reads(self.work_dir, np.random.RandomState(0))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_pipelineMetrics(self):
+        rng = np.random.RandomState(1)
+        write_alignment("{}/far.tsv".format(self.work_dir), range(10, 20), rng)
+        open("{}/empty.tsv".format(self.work_dir), 'w').close()
+        metrics = PipelineMetrics(title="site", iteration=0)
+        vectors, _ = collect_data_vectors2(events_per_pos=2, label=0, portion=0.0, files=self.work_dir + "/*.tsv",
+                                           strand="t", motif_starts=[100, 110], dataset_title="test", max_samples=10,
+                                           split_dataset=False, metrics=metrics)
+        self.assertEqual(dict(metrics.skipped), {"malformed": 1, "empty": 1, "no motif events": 1})
+        self.assertTrue(metrics.skipped_examples["malformed"].endswith("bad.tsv"))
+        self.assertEqual(metrics.counters["files_found"], 9)
+        self.assertEqual(metrics.counters["files_read"], 6)
+        self.assertEqual(metrics.counters["vectors_built"], len(vectors))
+        good_files = ["read{}.tsv".format(i) for i in xrange(5)] + ["short.tsv", "far.tsv"]
+        self.assertEqual(metrics.counters["rows_parsed"],
+                         sum(len(open(os.path.join(self.work_dir, f)).readlines()) for f in good_files))
+        self.assertAlmostEqual(metrics.nan_fill_rate(), np.mean(np.isnan(vectors)))
+        self.assertTrue(all(metrics.seconds[stage] >= 0 for stage in ["glob", "parse", "features", "vectors"]))
+
+        metrics.add_training({"train_seconds": 2.0, "steps": 100, "samples": 1000, "compile_seconds": 1.0})
+        self.assertEqual(metrics.steps_per_sec(), 50)
+        metrics_file = self.work_dir + "/site_metrics.jsonl"
+        metrics.emit(metrics_file)
+        total = PipelineMetrics(title="site", iteration="all").merge(metrics).merge(metrics)
+        total.emit(metrics_file)
+        records = read_metrics(metrics_file)
+        self.assertEqual([r["iteration"] for r in records], [0, "all"])
+        self.assertEqual(records[1]["counters"]["files_read"], 12)
+        self.assertEqual(records[1]["skipped"]["malformed"], 2)
+        self.assertTrue("3 skipped" in metrics.summary_line())
+
+
+def record_results_run(args):
+    # a classify worker's writes, for ResultsStoreTest
+    db, title, learning_rate = args
+    store = ResultsStore(db)
+    run_id = store.start_run(title, {"learning_rate": learning_rate, "epochs": 10}, experiment="test")
+    for i in xrange(3):
+        store.record_iteration(run_id, i, 0.5 + learning_rate, summary={"xtrain_accuracies": [40.0, 50.0, 60.0],
+                                                                        "best_model": "/models/model2.pkl"},
+                               artifacts={"test_probs": "/models/test_probs.pkl"})
+    store.finish_run(run_id, 0.5 + learning_rate)
+    store.close()
+    return run_id
+
+
+class ResultsStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.db = "{}/results.db".format(self.work_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_resultsStore(self):
+        # workers all writing to a new database
+        pool = Pool(4)
+        jobs = [(self.db, "site{}".format(i), learning_rate) for i in xrange(8) for learning_rate in [0.01, 0.1]]
+        run_ids = pool.map(record_results_run, jobs)
+        pool.close()
+        pool.join()
+        self.assertEqual(len(set(run_ids)), len(jobs))
+
+        with ResultsStore(self.db) as store:
+            latest = store.latest_accuracies(experiment="test")
+            self.assertEqual([title for title, _, _ in latest], ["site{}".format(i) for i in xrange(8)])
+            param_sets = store.param_set_accuracies()
+            self.assertEqual([(nb_runs, params['learning_rate']) for _, nb_runs, _, _, params in param_sets],
+                             [(8, 0.1), (8, 0.01)])
+            runs = store.site_accuracies(title="site0")
+            self.assertEqual(len(runs), 2)
+            self.assertTrue(all(nb_iterations == 3 for _, _, _, _, nb_iterations, _ in runs))
+            self.assertEqual(store.metric_history(runs[0][0], "xtrain_accuracies", iteration=2), [40.0, 50.0, 60.0])
+            self.assertEqual(len(store.artifacts(runs[0][0], kind="test_probs")), 3)
+            self.assertEqual(store.connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+        # a classify call that raises closes its run as failed before it's retried
+        store, run_id = start_results_run(self.db, "site0", {"learning_rate": 0.01}, experiment="test")
+        self.assertEqual(fail_open_runs("ValueError: broken"), [run_id])
+        with ResultsStore(self.db) as store:
+            self.assertEqual(store.query("SELECT status, error, finished FROM runs WHERE id = ?", (run_id,)),
+                             [("failed", "ValueError: broken", None)])
+            self.assertEqual(len(store.site_accuracies(title="site0")), 2)
+        self.assertEqual(fail_open_runs("again"), [])
+
+        # WAL doesn't work on network filesystems, the store checks the type of the mount the database is under
+        mounts = self.db + ".mounts"
+        with open(mounts, 'w') as f:
+            f.write("/dev/sda1 / ext4 rw 0 0\nserver:/export /mnt/shared\\040dir nfs4 rw 0 0\n"
+                    "tmpfs /mnt/shared\\040dir/local tmpfs rw 0 0\n")
+        self.assertTrue(network_filesystem("/mnt/shared dir/out/results.db", mounts_file=mounts))
+        self.assertFalse(network_filesystem("/mnt/shared dir/local/results.db", mounts_file=mounts))
+        self.assertFalse(network_filesystem("/mnt/shared/results.db", mounts_file=mounts))
+        self.assertFalse(network_filesystem("/mnt/shared dir/results.db", mounts_file=mounts + ".missing"))
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_manifest(self):
+        for i in xrange(3):
+            with open("{0}/read{1}.tsv".format(self.work_dir, i), 'w') as f:
+                f.write("x" * 10)
+        params = {"group_1": self.work_dir + "/*.tsv", "group_2": self.work_dir + "/read0.tsv", "group_3": None,
+                  "learning_rate": 0.01, "iterations": 2}
+        key = task_key("site", params, [[100], [100]])
+        # more iterations of the same site share the key, other settings, motifs or input files don't
+        self.assertEqual(key, task_key("site", dict(params, iterations=5), [[100], [100]]))
+        self.assertNotEqual(key, task_key("site", dict(params, learning_rate=0.1), [[100], [100]]))
+        self.assertNotEqual(key, task_key("site", params, [[100], [110]]))
+        with open("{}/read3.tsv".format(self.work_dir), 'w') as f:
+            f.write("x" * 10)
+        self.assertNotEqual(key, task_key("site", params, [[100], [100]]))
+
+        manifest_file = self.work_dir + "/manifest.jsonl"
+        model = self.work_dir + "/model.pkl"
+        open(model, 'w').close()
+        manifest = Manifest(manifest_file)
+        self.assertEqual(manifest.pending(key, 3), [0, 1, 2])
+        manifest.complete(key, "site", 0, 0.75, files=[model], best_model=model)
+        manifest.complete(key, "site", 1, 0.5, files=[self.work_dir + "/missing.pkl"])
+        with open(manifest_file, 'a') as f:
+            f.write('{"key": "cut off by a cra')
+        manifest = Manifest(manifest_file)
+        self.assertEqual(manifest.completed(key, 0)['accuracy'], 0.75)
+        self.assertEqual(manifest.completed(key, 0)['best_model'], model)
+        # an iteration whose files are gone is trained again
+        self.assertEqual(manifest.pending(key, 3), [1, 2])
+        self.assertEqual(Manifest(manifest_file, resume=False).pending(key, 3), [0, 1, 2])
+
+
+def scheduled_task(task):
+    with open(task["log"], 'a') as log:
+        log.write(task["title"] + "\n")
+    if task["title"] == "flaky" and not os.path.exists(task["log"] + ".flaky"):
+        open(task["log"] + ".flaky", 'w').close()
+        raise ValueError("first attempt")
+    if task["title"] == "broken":
+        raise ValueError("always fails")
+    if task["title"] == "killed":
+        os._exit(1)
+
+
+def queued_task(task):
+    # the first worker to get the "killed" task dies, like a node going down. Tasks run in a child of the worker
+    marker = "{0}.{1}".format(task["log"], task["title"])
+    first_attempt = not os.path.exists(marker)
+    open(marker, 'a').close()
+    if task["title"] == "killed" and first_attempt:
+        os.kill(os.getppid(), signal.SIGKILL)
+        os._exit(1)
+    if task["title"] == "broken":
+        raise ValueError("always fails")
+    return task["title"].upper()
+
+
+def queue_node(queue_dir):
+    run_worker(TaskQueue(queue_dir), queued_task, poll_seconds=0.1)
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_scheduler(self):
+        log = self.work_dir + "/log"
+        sizes = {"small": 1, "flaky": 2, "big": 5, "broken": 3, "killed": 0, "after_killed": 0}
+        tasks = [{"title": title, "log": log} for title in ["small", "flaky", "big", "broken", "killed",
+                                                             "after_killed"]]
+        records = run_tasks(scheduled_task, tasks, jobs=1, threads=1, retries=1, size=lambda t: sizes[t["title"]])
+        # longest first, retried in place, and a failure doesn't stop the worker. The worker that dies is replaced
+        # and its task is queued again, the death counts as an attempt
+        self.assertEqual([line.strip() for line in open(log)],
+                         ["big", "broken", "broken", "flaky", "flaky", "small", "killed", "after_killed", "killed"])
+        self.assertEqual([(r["title"], r["status"], r["attempts"]) for r in records],
+                         [("small", "done", 1), ("flaky", "done", 2), ("big", "done", 1), ("broken", "failed", 2),
+                          ("killed", "lost", 2), ("after_killed", "done", 1)])
+        self.assertTrue("always fails" in records[3]["error"])
+        self.assertTrue(records[2]["seconds"] >= 0)
+
+        self.assertEqual(threads_per_worker(3, cores=16), 5)
+        self.assertEqual(threads_per_worker(32, cores=16), 1)
+        environment = dict(os.environ)
+        try:
+            called = pin_threads(2)
+            self.assertTrue(all(os.environ[variable] == "2" for variable in THREAD_VARIABLES))
+            if any(os.path.basename(library).startswith("libopenblas") for library in loaded_libraries()):
+                self.assertTrue("openblas_set_num_threads" in called)
+        finally:
+            pin_threads(threads_per_worker(1))
+            os.environ.clear()
+            os.environ.update(environment)
+
+        for i in xrange(4):
+            with open("{0}/read{1}.tsv".format(self.work_dir, i), 'w') as f:
+                f.write("x" * 100)
+        task = {"group_1": self.work_dir + "/*.tsv", "group_2": self.work_dir + "/read0.tsv", "group_3": None,
+                "max_samples": 2, "motif_start_positions": [100, 110, 120], "iterations": 2}
+        self.assertEqual(estimated_size(task), (200 + 100) * 3 * 2)
+
+    def test_fsQueue(self):
+        queue_dir = self.work_dir + "/queue"
+        queue = TaskQueue(queue_dir, lease_seconds=1.0, max_attempts=2)
+        titles = ["killed", "a", "b", "broken", "c"]
+        for priority, title in enumerate(titles):
+            self.assertTrue(queue.put(title, {"title": title, "log": self.work_dir + "/log"}, priority=priority))
+        self.assertFalse(queue.put("a", {}))
+        self.assertEqual(queue.counts()["pending"], 5)
+
+        # worker processes standing in for nodes, they read the lease and attempts from the queue
+        nodes = [Process(target=queue_node, args=(queue_dir,)) for _ in xrange(3)]
+        for node in nodes:
+            node.start()
+        for node in nodes:
+            node.join()
+        self.assertEqual(sorted(node.exitcode for node in nodes), [-signal.SIGKILL, 0, 0])
+        self.assertTrue(queue.drained())
+        results = queue.results()
+        self.assertEqual(sorted(results.keys()), sorted(titles))
+        self.assertEqual((results["a"][0], results["a"][1]["result"]), ("done", "A"))
+        # the dead node's task was claimed again when its lease ran out, without using up an attempt
+        self.assertEqual((results["killed"][0], results["killed"][1]["attempt"], results["killed"][1]["leases_lost"]),
+                         ("done", 1, 1))
+        self.assertEqual((results["broken"][0], results["broken"][1]["attempts"]), ("failed", 2))
+        self.assertTrue("always fails" in results["broken"][1]["error"])
+
+        # a done task isn't queued again unless it's replaced, a failed one is
+        self.assertFalse(queue.put("a", {"title": "a", "log": self.work_dir + "/log"}))
+        self.assertTrue(queue.put("a", {"title": "a", "log": self.work_dir + "/log"}, replace=True))
+        self.assertTrue(queue.put("broken", {"title": "broken", "log": self.work_dir + "/log"}))
+        self.assertEqual((queue.counts()["pending"], queue.counts()["failed"]), (2, 0))
+
+        # with one attempt an expired lease is still queued again, until max_leases_lost
+        queue = TaskQueue(self.work_dir + "/single", lease_seconds=60.0, max_attempts=1, max_leases_lost=2)
+        queue.put("site", {"title": "site"})
+        stale_file = queue.claim()[0]
+        self.assertEqual(queue.requeue_expired(), [])
+        self.assertEqual(queue.requeue_expired(now=queue.fs_time() + 61.0), ["site"])
+        self.assertEqual((queue.counts()["pending"], queue.counts()["claimed"]), (1, 0))
+        # the stale worker can't renew, finish or fail the task once another worker has claimed it
+        claimed_file = queue.claim()[0]
+        self.assertFalse(queue.renew(stale_file))
+        self.assertFalse(queue.complete(stale_file, "site", {"result": "stale"}))
+        self.assertEqual(queue.fail(stale_file, "site", "stale"), None)
+        self.assertEqual((queue.counts()["claimed"], queue.counts()["done"], queue.counts()["failed"]), (1, 0, 0))
+        self.assertEqual(queue.requeue_expired(now=queue.fs_time() + 61.0), ["site"])
+        self.assertEqual(queue.results()["site"][0], "failed")
+        self.assertFalse(queue.renew(claimed_file))
+
+        # a task moved to done/ whose record isn't written yet is still in progress, until its lease runs out
+        queue = TaskQueue(self.work_dir + "/finishing", lease_seconds=60.0, max_attempts=1, max_leases_lost=2)
+        queue.put("site", {"title": "site"})
+        claimed_file = queue.claim()[0]
+        self.assertTrue(queue.move(claimed_file, "done", os.path.basename(claimed_file)))
+        self.assertFalse(queue.drained())
+        self.assertEqual(queue.results(), {})
+        self.assertEqual(queue.requeue_expired(), [])
+        self.assertEqual(queue.requeue_expired(now=queue.fs_time() + 61.0), ["site"])
+        self.assertEqual(queue.counts()["pending"], 1)
+        claimed_file = queue.claim()[0]
+        self.assertTrue(queue.complete(claimed_file, "site", {"result": 1}))
+        self.assertTrue(queue.drained())
+        self.assertEqual(queue.results()["site"], ("done", {"result": 1}))
+
 
 # TODO illegal network tests
 # TODO dump/load/eval tests
@@ -89,6 +1040,32 @@ def main():
     testSuite.addTest(skLearnDigitTest('test_ConvNet'))
     testSuite.addTest(skLearnDigitTest('test_scrambledLabels'))
     testSuite.addTest(skLearnDigitTest('test_annealingLearningRate'))
+    testSuite.addTest(skLearnDigitTest('test_recurrentNetworks'))
+    testSuite.addTest(skLearnDigitTest('test_transferLearning'))
+    testSuite.addTest(VanillaNeuralNetTest('test_miniBatchMatchesBackprop'))
+    testSuite.addTest(InferenceEngineTest('test_numpyPredictor'))
+    testSuite.addTest(InferenceEngineTest('test_quantizedPredictor'))
+    testSuite.addTest(InferenceEngineTest('test_pruning'))
+    testSuite.addTest(InferenceEngineTest('test_distillation'))
+    testSuite.addTest(InferenceEngineTest('test_ensemble'))
+    testSuite.addTest(InferenceEngineTest('test_modelRegistry'))
+    testSuite.addTest(InferenceEngineTest('test_multiTaskPredictor'))
+    testSuite.addTest(InferenceEngineTest('test_normalization'))
+    testSuite.addTest(MultiTaskTest('test_classifyMultiTask'))
+    testSuite.addTest(MultiTaskTest('test_transferNormalization'))
+    testSuite.addTest(ScoringTest('test_scoreAlignments'))
+    testSuite.addTest(PipelineMetricsTest('test_pipelineMetrics'))
+    testSuite.addTest(ProfilingTest('test_profiling'))
+    testSuite.addTest(ScoringTest('test_scanWindows'))
+    testSuite.addTest(IncrementalUpdateTest('test_incrementalUpdate'))
+    testSuite.addTest(SyntheticReadsTest('test_syntheticReads'))
+    testSuite.addTest(ScoringTest('test_siteAggregator'))
+    testSuite.addTest(PositionStatsTest('test_positionStats'))
+    testSuite.addTest(ScoringTest('test_inferenceServer'))
+    testSuite.addTest(ResultsStoreTest('test_resultsStore'))
+    testSuite.addTest(ManifestTest('test_manifest'))
+    testSuite.addTest(SchedulerTest('test_scheduler'))
+    testSuite.addTest(SchedulerTest('test_fsQueue'))
 
     testRunner = unittest.TextTestRunner(verbosity=2)
     testRunner.run(testSuite)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Update trained site models with the alignment files that were added since they were trained
+"""
+import sys
+import cPickle
+from argparse import ArgumentParser
+from lib.incremental import update_site
+from lib.utils import RECURRENT_MODELS
+
+
+def parse_args():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--group_1', '-1', action='store', dest='group_1', required=True, type=str,
+                        help="group 1 files")
+    parser.add_argument('--group_2', '-2', action='store', dest='group_2', required=True, type=str,
+                        help="group 2 files")
+    parser.add_argument('--group_3', '-3', action='store', dest='group_3', required=False, type=str, default=None,
+                        help="group_3 files")
+    parser.add_argument('--config_file', '-c', action='store', type=str, dest='config', required=True,
+                        help='config file (pickle)')
+    parser.add_argument('--sites', action='store', dest='sites', required=False, type=str, nargs='+',
+                        default=None, help="titles of the sites to update, default is all of the sites in the config")
+    parser.add_argument('--strand', '-st', action='store', dest='strand', required=True, type=str,
+                        help="which strand to use, options = {t, c, both}")
+    parser.add_argument('--events', '-ev', action='store', required=True, dest='events', type=int,
+                        help='number of events per alignment column the models were trained with')
+    parser.add_argument("--feature_set", '-f', action='store', dest='features', required=False, type=str,
+                        default=None, help="feature set the models were trained with")
+    parser.add_argument('--epochs', '-ep', action='store', dest='epochs', required=False, default=100, type=int,
+                        help="number of epochs for each update")
+    parser.add_argument('--batch_size', '-b', action='store', dest='batch_size', required=False, type=int,
+                        default=None, help='specify batch size')
+    parser.add_argument('--learning_rate', '-e', action='store', dest='learning_rate', required=False,
+                        default=0.01, type=float)
+    parser.add_argument('--L1_reg', '-L1', action='store', dest='L1', required=False, default=0.0, type=float)
+    parser.add_argument('--L2_reg', '-L2', action='store', dest='L2', required=False, default=0.001, type=float)
+    parser.add_argument('--replay_size', action='store', dest='replay_size', required=False, default=5000, type=int,
+                        help="number of older vectors of each class to keep for replay")
+    parser.add_argument('--replay_ratio', action='store', dest='replay_ratio', required=False, default=1.0,
+                        type=float, help="number of replayed vectors to train on for each new vector")
+    parser.add_argument('--output_location', '-o', action='store', dest='out', required=True, type=str,
+                        help="directory the models were trained in (run_nn.py's --output_location)")
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    args = parse_args()
+    config = cPickle.load(open(args.config, 'r'))
+    assert(config['model_type'] not in RECURRENT_MODELS), "incremental updates are for the feed-forward models"
+    try:
+        extra_args = config['extra_args']
+        batch_size = extra_args['batch_size']
+    except KeyError:
+        extra_args = None
+        batch_size = args.batch_size
+    assert(batch_size is not None), "You need to specify batch_size with a flag or have it in the config file"
+
+    groups = [g for g in (args.group_1, args.group_2, args.group_3) if g is not None]
+    sites = [site for site in config['sites'] if args.sites is None or site['title'] in args.sites]
+    assert(len(sites) > 0), "didn't find any of the sites in {}".format(args.config)
+
+    for site in sites:
+        record = update_site(groups=groups, motif_start_positions=site['motif_start_position'], title=site['title'],
+                             strand=args.strand, events_per_pos=args.events, feature_set=args.features,
+                             out_path=args.out, learning_rate=args.learning_rate, L1_reg=args.L1, L2_reg=args.L2,
+                             epochs=args.epochs, batch_size=batch_size, hidden_dim=config['hidden_dim'],
+                             model_type=config['model_type'], extra_args=extra_args, replay_size=args.replay_size,
+                             replay_ratio=args.replay_ratio)
+        if record is None:
+            print >> sys.stdout, "{}\tno update".format(site['title'])
+        else:
+            print >> sys.stdout, "{title}\tversion {version}\t{new_files} new files\t{new_vectors} new vectors\t" \
+                                 "test accuracy {test_accuracy}\t{model}".format(title=site['title'], **record)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))